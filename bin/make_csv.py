@@ -3,8 +3,8 @@
 
 
 import argparse
+import itertools
 import os
-import json
 import sys
 import time
 
@@ -13,8 +13,12 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(
 
 import dateutil.parser
 
+from linkedin.mobster.har.stream import iter_hars
 from linkedin.mobster.utils import datetime_to_millis
 
+# written in place of values whose collector was not used for the page (see mobster.py's --collect option)
+NOT_COLLECTED = 'N/A'
+
 def makeMetaDataBlock(file_name):
   lines = []
   lines.append('##BEGINMETADATA:')
@@ -24,11 +28,12 @@ def makeMetaDataBlock(file_name):
 
 
 def makeDeviceInfoTable(har_data):
+  first_har = next(iter(har_data))
   lines = []
   lines.append('##BEGINTABLE:DEVICE INFORMATION')
   lines.append(','.join(['Device OS', 'Device OS Version', 'Browser', 'Browser Version']))
-  lines.append(','.join([har_data[0]['log']['_os']['_name'], har_data[0]['log']['_os']['_version'], har_data[0]['log']['browser']['name'],
-                         har_data[0]['log']['browser']['version']]))
+  lines.append(','.join([first_har['log']['_os']['_name'], first_har['log']['_os']['_version'], first_har['log']['browser']['name'],
+                         first_har['log']['browser']['version']]))
   lines.append('##ENDTABLE:DEVICE INFORMATION:')
   return '\n'.join(lines)
 
@@ -38,9 +43,11 @@ def makeMemoryInfoTable(har_data):
   lines.append('##BEGINTABLE:MEMORY INFORMATION')
   lines.append(','.join(['Page Name', 'Max Allocated Heap', 'Max Used Heap', 'Number of GC Events']))
   for page_data in har_data:
-    memory_stats = page_data['log']['pages'][0]['_memoryStats']
-    lines.append(','.join([page_data['log']['pages'][0]['_pageName'], str(memory_stats['_maxTotalHeapSize']), str(memory_stats['_maxUsedHeapSize']),
-                           str(page_data['log']['pages'][0]['_eventStats']['_gcEvents'])]))
+    memory_stats = page_data['log']['pages'][0].get('_memoryStats', {})
+    event_stats = page_data['log']['pages'][0].get('_eventStats', {})
+    lines.append(','.join([page_data['log']['pages'][0]['_pageName'], str(memory_stats.get('_maxTotalHeapSize', NOT_COLLECTED)),
+                           str(memory_stats.get('_maxUsedHeapSize', NOT_COLLECTED)),
+                           str(event_stats.get('_gcEvents', NOT_COLLECTED))]))
 
   lines.append('##ENDTABLE:MEMORY INFORMATION')
   return '\n'.join(lines)
@@ -53,23 +60,25 @@ def makePageMetricsTable(har_data):
 
   for page_data in har_data:
     page = page_data['log']['pages'][0]
-    lines.append(','.join([page['_pageName'], str(page['pageTimings']['onContentLoad']), str(page['pageTimings']['onLoad']), str(page['_cssStats']['_totalTime']), str(page['_eventStats']['_styleRecalculates']), str(page['_eventStats']['_paints'])]))
+    css_stats = page.get('_cssStats', {})
+    event_stats = page.get('_eventStats', {})
+    lines.append(','.join([page['_pageName'], str(page['pageTimings']['onContentLoad']), str(page['pageTimings']['onLoad']),
+                           str(css_stats.get('_totalTime', NOT_COLLECTED)),
+                           str(event_stats.get('_styleRecalculates', NOT_COLLECTED)),
+                           str(event_stats.get('_paints', NOT_COLLECTED))]))
 
   lines.append('##ENDTABLE: PAGE METRICS')
   return '\n'.join(lines)
 
 
 def makeWaterfallTables(har_data):
-  tables = []
   i = 0
 
   for page_data in har_data:
-    tables.append(makeWaterfallSummaryTable(page_data, i))
-    tables.append(makeWaterfallDetailsTable(page_data, i))
+    yield makeWaterfallSummaryTable(page_data, i)
+    yield makeWaterfallDetailsTable(page_data, i)
     i += 1
 
-  return tables
-
 
 def makeWaterfallSummaryTable(page_data, index):
   lines = []
@@ -128,11 +137,20 @@ if __name__ == '__main__':
   filename = args.filename or 'mobster_tables_{0}.csv'.format(time.time())
   outputdir = args.outputdir or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'report')
 
-  with open(args.har, 'r') as in_file:
-    har_data = json.loads(in_file.read())
+  def read_har_data():
+    """Reads the HARs one at a time, so each table can be made without holding every HAR in memory"""
+    with open(args.har, 'r') as in_file:
+      for har in iter_hars(in_file):
+        yield har
+
+  tables = itertools.chain([makeMetaDataBlock(args.har), makeDeviceInfoTable(read_har_data()),
+                            makeMemoryInfoTable(read_har_data()), makePageMetricsTable(read_har_data())],
+                           makeWaterfallTables(read_har_data()))
 
   with open(os.path.join(outputdir, filename), 'w') as out_file:
-    out_file.write(('\n'*3).join([makeMetaDataBlock(args.har), makeDeviceInfoTable(har_data), makeMemoryInfoTable(har_data),
-                                  makePageMetricsTable(har_data)] + makeWaterfallTables(har_data)))
+    for i, table in enumerate(tables):
+      if i:
+        out_file.write('\n'*3)
+      out_file.write(table)
 
 
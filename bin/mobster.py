@@ -15,11 +15,18 @@ import time
 # Add src directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
   
-from linkedin.mobster.har.flowprofiler import FlowProfiler
-from linkedin.mobster.har.merge import merge_by_average
-from linkedin.mobster.har.visualization.report import make_html
+from linkedin.mobster.har.css import CSSSelectorIndex
+from linkedin.mobster.har.flowplan import compile_flow
+from linkedin.mobster.har.flowprofiler import COLLECTORS, FlowProfiler, parse_collectors
+from linkedin.mobster.har.merge import merge_by_average, merge_by_percentile
+from linkedin.mobster.har.parallel import profile_iterations, profile_targets
+from linkedin.mobster.har.stream import HarStreamWriter
+from linkedin.mobster.har.visualization.report import write_html
 from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.server import serve
+from linkedin.mobster.targets import parse_targets
 from linkedin.mobster.utils import cmd_exists
+from linkedin.mobster.webkitcommunicator import BrowserConnectionError
 
 LINUX_BROWSER_OPEN_CMD = 'xdg-open'
 MAC_BROWSER_OPEN_CMD = 'open'
@@ -27,34 +34,147 @@ DEFAULT_OUTPUT_DIR = \
   os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'report')
 REPORT_FILE_TEMPLATE = 'http_waterfall_{0}.html'
 HAR_FILE_TEMPLATE = 'data_{0}.json'
+# maximum number of iterations run with --target-ci when no number of iterations is given
+DEFAULT_MAX_ADAPTIVE_ITERATIONS = 30
 TIMESTAMP = int(time.time())
 
-def run(args):
+def run(args, har_sink, css_index=None):
   """
-  Run a test with the specified parameters, and return the HTTP Archive
-  (HAR) File represented as a dictionary.
+  Run a test with the specified parameters, and pass each resulting HTTP
+  Archive (HAR) File, represented as a dictionary, to har_sink. The CSS
+  selector profiles of all the pages are added to css_index, if given.
   """
-  har_gen = FlowProfiler(args.testfile, int(args.iterations))   \
-            if args.iterations else FlowProfiler(args.testfile)
+  if args.parallel_iterations:
+    return run_parallel_iterations(args, har_sink, css_index)
+  if args.targets:
+    return run_targets(args, har_sink, css_index)
 
-  # profiling_results is a list of lists containing HARs for each page in a run
-  profiling_results = har_gen.profile()
+  iterations = max_iterations(args)
+  har_gen = FlowProfiler(args.testfile, iterations, target_ci=args.target_ci, css_index=css_index)
 
-  if args.average:
-    return [merge_by_average(page_results) \
-            for page_results in zip(*profiling_results)]
+  # with a target confidence interval, which iteration is the last one is only known once it is over
+  if args.average or args.percentiles or args.target_ci:
+    # profiling_results is a list of lists containing HARs for each page in a run
+    profiling_results = har_gen.profile()
+    summarize(args, profiling_results, har_sink)
   else:
-    return profiling_results[-1]
+    # only the last iteration is output, and its HARs are written as soon as they are made
+    def har_callback(iteration, har):
+      if iteration == iterations - 1:
+        har_sink(har)
+
+    har_gen.profile(har_callback)
+
+def run_targets(args, har_sink, css_index=None):
+  """
+  Run the test against every target given by the --targets argument at the
+  same time, and output the HARs of all the targets, each tagged with the
+  name of the target it belongs to.
+  """
+  targets = parse_targets(args.targets)
+  if not targets:
+    logging.error('No targets found matching {0}'.format(args.targets))
+    sys.exit(1)
+
+  for target, profiling_results in profile_targets(args.testfile, targets, max_iterations(args), args.use_async,
+                                                   args.target_ci, css_index):
+    if profiling_results:
+      summarize(args, profiling_results, har_sink)
+
+def measure_overhead(args):
+  """
+  Measures how much each collector slows down the page loads of the flow,
+  compared with collecting only network data, and prints the results.
+  """
+  iterations = int(args.iterations or 1)
+  profiler = FlowProfiler(args.testfile)
+  try:
+    overhead = profiler.measure_collector_overhead(iterations)
+  finally:
+    profiler.stop()
+  logging.info('Collector overhead: {0}'.format(overhead))
+
+  collectors = [collector for collector in COLLECTORS if collector in overhead]
+  print 'Median onLoad time of {0} iteration(s) with only the network ' \
+        'collector, and the time each collector adds:'.format(iterations)
+  print ''.join('{0:>12}'.format(column) for column in ['page'] + collectors)
+  for page_name, baseline in sorted(overhead['network'].iteritems()):
+    print ''.join(['{0:>12}'.format(page_name[:12]), '{0:>10.0f}ms'.format(baseline)] +
+                  ['{0:>+10.0f}ms'.format(overhead[collector][page_name])
+                   if page_name in overhead[collector] else '{0:>12}'.format('-')
+                   for collector in collectors[1:]])
+
+def print_top_selectors(css_index, number_results):
+  """
+  Prints the CSS rules which took the most time over all the pages profiled,
+  and the time taken by the rules of each stylesheet.
+  """
+  if not css_index.profiles:
+    logging.warning('No CSS selector profiles were recorded')
+    return
+
+  print 'Most expensive CSS selectors over {0} page load(s), out of {1:.0f}ms ' \
+        'of selector matching:'.format(css_index.profiles, css_index.total_time)
+  print '{0:>10} {1:>10} {2:>10} {3:>6}  {4}'.format('time', 'hits', 'matches', 'pages', 'selector')
+  for rule in css_index.get_top_selectors(number_results):
+    print '{0:>8.1f}ms {1:>10} {2:>10} {3:>6}  {4} ({5}:{6})'.format(
+      rule['time'], rule['hitCount'], rule['matchCount'], rule['profiles'], rule['selector'], rule['url'],
+      rule['lineNumber'])
+
+  print '\n{0:>10} {1:>10}  {2}'.format('time', 'rules', 'stylesheet')
+  for url, stats in sorted(css_index.get_stylesheet_stats().iteritems(), key=lambda (url, stats): -stats['time']):
+    print '{0:>8.1f}ms {1:>10}  {2}'.format(stats['time'], stats['rules'], url)
+
+def max_iterations(args):
+  """Returns the number of iterations to run, or the most to run if iterations stop at a target confidence interval"""
+  if args.iterations:
+    return int(args.iterations)
+  return DEFAULT_MAX_ADAPTIVE_ITERATIONS if args.target_ci else 1
+
+def run_parallel_iterations(args, har_sink, css_index=None):
+  """
+  Run the iterations of the test in parallel, spread over the devices of the
+  targets given by the --targets argument (by default, the browser on the
+  debugging port). Only one page of each device is used.
+  """
+  if args.target_ci:
+    logging.warning('--target-ci is not supported with --parallel-iterations, running all the iterations')
+
+  targets = parse_targets(args.targets or 'localhost:{0}/*'.format(config["WS_DEBUG_PORT"]))
+  if not targets:
+    logging.error('No targets available to run iterations on')
+    sys.exit(1)
+
+  profiling_results = profile_iterations(args.testfile, targets, int(args.iterations or 1),
+                                         args.use_async, css_index)
+  if not profiling_results:
+    logging.error('None of the iterations could be run')
+    sys.exit(1)
+  summarize(args, profiling_results, har_sink)
+
+def summarize(args, profiling_results, har_sink):
+  """
+  Outputs either the averaged HARs of all the iterations, the HARs describing
+  their distribution or the HARs of the last iteration, depending on the
+  arguments.
+  """
+  if args.percentiles:
+    for page_results in zip(*profiling_results):
+      har_sink(merge_by_percentile(page_results))
+  elif args.average:
+    for page_results in zip(*profiling_results):
+      har_sink(merge_by_average(page_results))
+  else:
+    for har in profiling_results[-1]:
+      har_sink(har)
 
 def write_report(args):
   """
   Autogenerates an HTML report and writes it to a file, with location and input
   specified by the given arguments.
   """
-  output_html = make_html(args.har or har_file_path(args), args.debug)
-
   with open(report_file_path(args), 'w') as output_handle:
-    output_handle.write(output_html)
+    write_html(args.har or har_file_path(args), output_handle, args.debug)
   
   if args.browser:
     open_browser(report_file_path(args))
@@ -128,6 +248,28 @@ def init_logging():
   logging.getLogger('').addHandler(console)
 
 
+def main(args):
+  if args.serve:
+    serve(args.serve, args.targets or 'localhost:{0}/*'.format(config["WS_DEBUG_PORT"]))
+    return
+
+  if args.measure_overhead:
+    measure_overhead(args)
+  
+  if args.har:
+    write_report(args)
+  else:
+    with open(har_file_path(args), 'w') as f:
+      with HarStreamWriter(f, args.jsonlines) as writer:
+        css_index = CSSSelectorIndex()
+        run(args, writer.write, css_index)
+
+    if args.top_selectors:
+      print_top_selectors(css_index, args.top_selectors)
+
+    if args.report:
+      write_report(args)
+
 def parse_args():
   arg_parser = argparse.ArgumentParser()
 
@@ -141,10 +283,53 @@ def parse_args():
     help='Name of output HAR file')
   arg_parser.add_argument('-hd', '--hardirectory', \
     help='Directory to store output HAR file')
+  arg_parser.add_argument('-l', '--jsonlines', action='store_true', \
+    help='Write one HAR per line instead of a JSON array of HARs')
   arg_parser.add_argument('-i', '--iterations', \
     help='Do profiling task the specified number of times')
   arg_parser.add_argument('-a', '--average', action='store_true', \
     help='Output the average results of the iterations')
+  arg_parser.add_argument('--percentiles', action='store_true', \
+    help='Output the median and percentiles of the results of the ' \
+         'iterations, matching resources across iterations by URL and ' \
+         'leaving out outlier iterations')
+  arg_parser.add_argument('--target-ci', type=float, \
+    help='Stop iterating once the 95%% confidence interval of the mean onLoad ' \
+         'time of every page is within this fraction of the mean (e.g. 0.05 ' \
+         'for +/-5%%). -i is then the maximum number of iterations (default ' \
+         '{0})'.format(DEFAULT_MAX_ADAPTIVE_ITERATIONS))
+  arg_parser.add_argument('-T', '--targets', \
+    help='Run the test on several targets at once. Comma separated list of ' \
+         'host:port[/page], where a page of * means all open pages')
+  arg_parser.add_argument('--async', dest='use_async', action='store_true', \
+    help='Drive all targets from a single event loop (requires tornado)')
+  arg_parser.add_argument('--parallel-iterations', action='store_true', \
+    help='Run iterations in parallel on the devices of the targets, one ' \
+         'page per device, instead of one after another')
+
+  arg_parser.add_argument('--collect', \
+    help='Comma separated list of the data to collect for every page, out ' \
+         'of {0} (default: all). Network data is always collected'.format(
+           ','.join(COLLECTORS)))
+  arg_parser.add_argument('--top-selectors', type=int, metavar='N', \
+    help='After profiling, print the N CSS selectors which took the most ' \
+         'time over all the pages and iterations, and the time taken by ' \
+         'each stylesheet')
+  arg_parser.add_argument('--measure-overhead', action='store_true', \
+    help='Before profiling, measure how much each collector slows down page ' \
+         'loads compared with collecting network data only')
+
+  arg_parser.add_argument('--heap-snapshot', action='store_true', \
+    help='Take a heap snapshot after each page load and report the objects ' \
+         'retaining the most memory')
+  arg_parser.add_argument('--detect-leaks', action='store_true', \
+    help='Take a heap snapshot after each iteration and report the ' \
+         'constructors whose objects grow from one iteration to the next')
+
+  arg_parser.add_argument('--serve', metavar='ADDRESS', \
+    help='Run as a daemon which keeps its connections to the targets (-T, ' \
+         'default all open pages) open and runs flows posted to its HTTP ' \
+         'API, listening on [host:]port or on a Unix socket path')
 
   arg_parser.add_argument('-p', '--report', action='store_true', \
     help='Generate HTML report')
@@ -173,15 +358,25 @@ if __name__ == '__main__':
     config["WS_DEBUG_PORT"] = args.port
   if args.debug:
     config["DEBUG"] = True
+  if args.heap_snapshot:
+    config["HEAP_SNAPSHOTS"] = True
+  if args.detect_leaks:
+    config["HEAP_GROWTH"] = True
+  if args.collect:
+    try:
+      config["COLLECTORS"] = sorted(parse_collectors(args.collect))
+    except ValueError, e:
+      sys.exit(e)
+  if args.testfile and not args.har:
+    try:
+      with open(args.testfile) as f:
+        compile_flow(json.load(f))
+    except (IOError, ValueError), e:
+      sys.exit('Invalid flow file {0}: {1}'.format(args.testfile, e))
   init_logging()
-  
-  if args.har:
-    write_report(args)
-  else:
-    har_as_dict = run(args)
-    
-    with open(har_file_path(args), 'w') as f:
-      f.write(json.dumps(har_as_dict))
 
-    if args.report:
-      write_report(args)
+  try:
+    main(args)
+  except BrowserConnectionError, e:
+    logging.error(e)
+    sys.exit(1)
@@ -0,0 +1,184 @@
+import atexit
+from collections import deque
+import json
+import logging
+from pprint import pformat
+import threading
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.websocket import WebSocketClosedError, websocket_connect
+
+from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.webkitcommunicator import ProtocolDispatcher, get_debugger_url
+
+_shared_io_loop = None
+_shared_io_loop_lock = threading.Lock()
+
+def get_shared_io_loop():
+  """
+  Returns an IOLoop which runs on a single background thread and is shared by
+  every AsyncWebKitCommunicator that is not given a loop of its own.
+  """
+  global _shared_io_loop
+
+  with _shared_io_loop_lock:
+    if _shared_io_loop is None:
+      _shared_io_loop = IOLoop()
+      loop_thread = threading.Thread(target=_shared_io_loop.start, args=())
+      loop_thread.setDaemon(True)
+      loop_thread.start()
+      # stop the loop before the interpreter tears down the modules it is using
+      atexit.register(_stop_io_loop, _shared_io_loop, loop_thread)
+    return _shared_io_loop
+
+def _stop_io_loop(io_loop, loop_thread):
+  io_loop.add_callback(io_loop.stop)
+  loop_thread.join(1)
+
+
+class DomainEventStream(object):
+  """
+  Asynchronous stream of the events of a single protocol domain. Events are
+  buffered until they are read with next(), which returns a Future.
+  """
+
+  def __init__(self, communicator, domain, name):
+    self._communicator = communicator
+    self._domain = domain
+    self._name = name
+    self._events = deque()
+    self._waiters = deque()
+    communicator.add_domain_callback(domain, name, self._on_event)
+
+  def _on_event(self, message):
+    if self._waiters:
+      self._waiters.popleft().set_result(message)
+    else:
+      self._events.append(message)
+
+  def next(self):
+    """Returns a Future which resolves to the next event of the domain"""
+    future = Future()
+    if self._events:
+      future.set_result(self._events.popleft())
+    else:
+      self._waiters.append(future)
+    return future
+
+  def close(self):
+    self._communicator.remove_domain_callback(self._domain, self._name)
+
+
+class AsyncWebKitCommunicator(ProtocolDispatcher):
+  """
+  Event loop based alternative to RemoteWebKitCommunicator. Any number of
+  communicators can share one IOLoop (and therefore one thread), instead of
+  each holding a reader and a sender thread of their own.
+
+  The synchronous surface (send_cmd, send_batch, add_domain_callback) is the
+  same as RemoteWebKitCommunicator's and is safe to use from any thread, so
+  RemoteWebKitClient and FlowProfiler can run on top of this class. Coroutines
+  running on the loop can use send() and events() instead, e.g.:
+
+    response = yield communicator.send('Page.navigate', {'url': url})
+
+  Callbacks are always called on the loop's thread. This module requires
+  tornado, which is only needed when the asynchronous client is used.
+  """
+
+  def __init__(self, page_num=0, io_loop=None, ws_url=None):
+    ProtocolDispatcher.__init__(self)
+    self._io_loop = io_loop or get_shared_io_loop()
+    self._ws_url = ws_url or get_debugger_url(page_num)
+    self._connection = None
+    self._stream_counter = 0
+
+  @gen.coroutine
+  def open(self):
+    """Coroutine which opens the WebSocket connection and starts reading messages"""
+    self._connection = yield websocket_connect(self._ws_url, io_loop=self._io_loop)
+    self._io_loop.add_future(self._read_messages(), lambda future: future.result())
+
+  def start(self):
+    """Opens the connection from outside the loop's thread, blocking until it is established"""
+    opened = threading.Event()
+    errors = []
+
+    def on_open(future):
+      if future.exception():
+        errors.append(future.exception())
+      opened.set()
+
+    self._io_loop.add_callback(lambda: self._io_loop.add_future(self.open(), on_open))
+    if not opened.wait(config['RESPONSE_TIMEOUT']):
+      raise Exception('Timed out connecting to {0}'.format(self._ws_url))
+    if errors:
+      raise errors[0]
+    return self
+
+  @gen.coroutine
+  def _read_messages(self):
+    while True:
+      message = yield self._connection.read_message()
+
+      # None means the connection has been closed
+      if message is None:
+        break
+
+      try:
+        self.dispatch_raw(message)
+      except Exception:
+        logging.exception('Error while handling message: {0}'.format(message))
+
+  def _write(self, cmd):
+    cmds = cmd if isinstance(cmd, list) else [cmd]
+    for i, c in enumerate(cmds):
+      try:
+        if self._connection is None:
+          raise WebSocketClosedError()
+        self._connection.write_message(json.dumps(c))
+      except WebSocketClosedError:
+        # answer the commands which cannot be sent with an error, so nothing waits for their responses
+        logging.error('Cannot send {0}: not connected to {1}'.format(c['method'], self._ws_url))
+        for unsent in cmds[i:]:
+          self.dispatch_message({'id': unsent['id'], 'error': {'message': 'Not connected'}})
+        return
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+      logging.debug('Sent: \n{0}'.format(pformat(cmd)))
+
+  def _enqueue(self, cmd):
+    self._io_loop.add_callback(self._write, cmd)
+
+  def send(self, method, params={}, timeout=None):
+    """
+    Sends a command and returns a Future which resolves to the response. Must be
+    called from the loop's thread.
+    """
+    future = Future()
+    cmd_id = self.send_cmd(method, params, future.set_result).id
+    if timeout is None:
+      return future
+
+    timed_future = gen.with_timeout(self._io_loop.time() + timeout, future, io_loop=self._io_loop)
+
+    def forget_if_timed_out(timed_future):
+      if isinstance(timed_future.exception(), gen.TimeoutError):
+        self._discard_command(cmd_id)
+    self._io_loop.add_future(timed_future, forget_if_timed_out)
+    return timed_future
+
+  def events(self, domain):
+    """Returns a DomainEventStream of the events of the given domain"""
+    self._stream_counter += 1
+    return DomainEventStream(self, domain, 'event_stream_{0}'.format(self._stream_counter))
+
+  def stop(self):
+    """Closes the WebSocket connection. Commands sent from then on are answered with an error"""
+    self._io_loop.add_callback(self._close)
+
+  def _close(self):
+    if self._connection:
+      self._connection.close()
+      self._connection = None
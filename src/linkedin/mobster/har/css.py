@@ -1,13 +1,35 @@
-from heapq import nlargest
+from heapq import heappush, heappushpop, nlargest
+import threading
 
+from linkedin.mobster.mobsterconfig import config
 from linkedin.mobster.utils import memoize
 
+def rule_misses(hit_count, match_count):
+  """Number of times a rule was considered a possible match but did not match"""
+  return hit_count - match_count
+
+def rule_miss_ratio(hit_count, match_count):
+  """Fraction of the times a rule was considered a possible match in which it did not match (0 if never considered)"""
+  return float(hit_count - match_count) / hit_count if hit_count else 0.0
+
+# metric -> function of (time, hitCount, matchCount) of a rule, larger values being worse
+RULE_METRICS = {
+  'time': lambda time, hit_count, match_count: time,
+  'misses': lambda time, hit_count, match_count: rule_misses(hit_count, match_count),
+  'missRatio': lambda time, hit_count, match_count: rule_miss_ratio(hit_count, match_count)
+}
+
+# positions of the fields of the totals of a rule or stylesheet (whose first field is its number of rules instead)
+PROFILES, TIME, HIT_COUNT, MATCH_COUNT = range(4)
+
 class CSSProfileParser(object):
   """
-  Parses CSS selector profile data and extracts important features
+  Parses CSS selector profile data and extracts important features. The rules are examined in a single pass, which keeps
+  the config['CSS_TOP_RULES'] worst rules by every metric in RULE_METRICS and totals the rules of every stylesheet. If
+  a CSSSelectorIndex is given, the profile is added to it.
   """
 
-  def __init__(self, css_selector_data):
+  def __init__(self, css_selector_data, selector_index=None):
     """
       Format of the css selector data:
 
@@ -28,22 +50,71 @@ class CSSProfileParser(object):
     """
     self.rules = css_selector_data['result']['profile']['data']
     self.total_time = css_selector_data['result']['profile']['totalTime']
+    self.top_rules_kept = config['CSS_TOP_RULES']
+
+    # metric -> min heap of (value, -position, rule) of the worst rules
+    self._top_rules = dict((metric, []) for metric in RULE_METRICS)
+    # url -> [number of rules, time, hitCount, matchCount]
+    self._stylesheets = {}
+
+    self._analyze()
+    if selector_index is not None:
+      selector_index.add_profile(self.rules, self.total_time)
+
+  def _analyze(self):
+    top_rules_kept = self.top_rules_kept
+    time_heap, misses_heap, miss_ratio_heap = [self._top_rules[metric] for metric in ('time', 'misses', 'missRatio')]
+    stylesheets = self._stylesheets
+
+    for position, rule in enumerate(self.rules):
+      time, hit_count, match_count = rule['time'], rule['hitCount'], rule['matchCount']
+
+      # the same as RULE_METRICS, inlined since this runs for every rule. Ties are broken in favour of the earlier
+      # rule, as with nlargest
+      for value, heap in ((time, time_heap), (rule_misses(hit_count, match_count), misses_heap),
+                          (rule_miss_ratio(hit_count, match_count), miss_ratio_heap)):
+        if len(heap) < top_rules_kept:
+          heappush(heap, (value, -position, rule))
+        elif value >= heap[0][0]:
+          heappushpop(heap, (value, -position, rule))
+
+      url = rule['url']
+      try:
+        totals = stylesheets[url]
+      except KeyError:
+        totals = stylesheets[url] = [0, 0.0, 0, 0]
+      totals[PROFILES] += 1
+      totals[TIME] += time
+      totals[HIT_COUNT] += hit_count
+      totals[MATCH_COUNT] += match_count
+
+  def _get_worst_rules(self, metric, number_results):
+    if number_results > self.top_rules_kept:
+      key = RULE_METRICS[metric]
+      return nlargest(number_results, self.rules,
+                      key=lambda rule: key(rule['time'], rule['hitCount'], rule['matchCount']))
+    return [rule for value, position, rule in sorted(self._top_rules[metric], reverse=True)[:number_results]]
 
-  @memoize
   def get_rules_longest_time(self, number_results):
     """Returns the rules which use the most browser running time"""
-    return nlargest(number_results, self.rules, key=lambda profile_entry: profile_entry['time'])
+    return self._get_worst_rules('time', number_results)
 
-  @memoize
   def get_rules_worst_match_ratio(self, number_results):
-    """Returns the rules which have the worst ratio of hits to actual matches"""
-    return nlargest(number_results, self.rules, key=lambda profile_entry: float(profile_entry['matchCount'])/profile_entry['hitCount'])
+    """Returns the rules which have the worst ratio of actual matches to hits"""
+    return self._get_worst_rules('missRatio', number_results)
 
-  @memoize
   def get_rules_most_misses(self, number_results):
     """Returns the rules which have the largest difference between matches and hits"""
-    return nlargest(number_results, self.rules, key=lambda profile_entry: profile_entry['hitCount'] - profile_entry['matchCount'])
+    return self._get_worst_rules('misses', number_results)
 
+  def get_stylesheet_stats(self):
+    """Returns the number of rules, time, hitCount and matchCount of the rules of each stylesheet, keyed by url"""
+    return dict((url, {
+      'rules': totals[PROFILES],
+      'time': totals[TIME],
+      'hitCount': totals[HIT_COUNT],
+      'matchCount': totals[MATCH_COUNT]
+    }) for url, totals in self._stylesheets.iteritems())
 
   @memoize
   def get_css_stats(self):
@@ -58,9 +129,91 @@ class CSSProfileParser(object):
     return {
       "_totalTime": self.total_time,
       "_mostTimeConsumingRule": time_consuming_rule,
-      "_mostMissesRule": most_misses_rule
+      "_mostMissesRule": most_misses_rule,
+      "_stylesheets": self.get_stylesheet_stats()
     }
 
 
+class CSSSelectorIndex(object):
+  """
+  Totals of the CSS selector profiles of many page loads, e.g. all the navigations and iterations of a flow, for every
+  rule (keyed by url, lineNumber and selector) and every stylesheet. Profiles are added with add_profile(), or by
+  passing the index to CSSProfileParser, which may be done from several threads at once.
+  """
+
+  def __init__(self):
+    self.profiles = 0
+    self.total_time = 0.0
+    # (url, lineNumber, selector) -> [number of profiles with the rule, time, hitCount, matchCount]
+    self._rules = {}
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._rules)
+
+  def add_profile(self, rules, total_time):
+    """
+    Adds the rules of a CSS selector profile (in the format of the data of a profile, see CSSProfileParser) and its
+    total time. The fields of the rules are gathered before the lock is taken, so that adding profiles from several
+    threads at once only waits for the totals to be updated.
+    """
+    rows = [((rule['url'], rule['lineNumber'], rule['selector']), rule['time'], rule['hitCount'], rule['matchCount'])
+            for rule in rules]
+
+    with self._lock:
+      self.profiles += 1
+      self.total_time += total_time
+      all_rules = self._rules
+      for key, time, hit_count, match_count in rows:
+        totals = all_rules.get(key)
+        if totals is None:
+          all_rules[key] = [1, time, hit_count, match_count]
+        else:
+          totals[PROFILES] += 1
+          totals[TIME] += time
+          totals[HIT_COUNT] += hit_count
+          totals[MATCH_COUNT] += match_count
 
+  def merge(self, other):
+    """Adds the totals of another index to this one"""
+    with other._lock:
+      profiles, total_time = other.profiles, other.total_time
+      rules = [(key, list(totals)) for key, totals in other._rules.iteritems()]
+    with self._lock:
+      self.profiles += profiles
+      self.total_time += total_time
+      for key, totals in rules:
+        merged = self._rules.setdefault(key, [0, 0.0, 0, 0])
+        for field in (PROFILES, TIME, HIT_COUNT, MATCH_COUNT):
+          merged[field] += totals[field]
+
+  def get_top_selectors(self, number_results, metric='time'):
+    """
+    Returns the number_results rules with the worst totals by the given metric out of RULE_METRICS, each with the total
+    time, hitCount and matchCount of the rule over all the profiles, and the number of profiles it was in
+    """
+    key = RULE_METRICS[metric]
+    with self._lock:
+      top = nlargest(number_results, self._rules.iteritems(),
+                     key=lambda (rule, totals): key(totals[TIME], totals[HIT_COUNT], totals[MATCH_COUNT]))
+      return [{
+        'url': url,
+        'lineNumber': line_number,
+        'selector': selector,
+        'time': totals[TIME],
+        'hitCount': totals[HIT_COUNT],
+        'matchCount': totals[MATCH_COUNT],
+        'profiles': totals[PROFILES]
+      } for (url, line_number, selector), totals in top]
 
+  def get_stylesheet_stats(self):
+    """Returns the number of distinct rules and the total time, hitCount and matchCount of each stylesheet, by url"""
+    stylesheets = {}
+    with self._lock:
+      for (url, line_number, selector), totals in self._rules.iteritems():
+        stats = stylesheets.setdefault(url, {'rules': 0, 'time': 0.0, 'hitCount': 0, 'matchCount': 0})
+        stats['rules'] += 1
+        stats['time'] += totals[TIME]
+        stats['hitCount'] += totals[HIT_COUNT]
+        stats['matchCount'] += totals[MATCH_COUNT]
+    return stylesheets
@@ -0,0 +1,175 @@
+import logging
+
+from linkedin.mobster.webkitclient import (click_button_js, click_link_js, dispatch_event_js, set_field_value_js,
+                                           submit_form_js)
+
+# action type -> function of the action's params returning the JS which performs it. 'navigate' is the only action
+# which is not done with JS
+ACTION_JS = {
+  'textfield-set': lambda params: set_field_value_js(params['id'], params['value']),
+  'click': lambda params: click_button_js(params['id']),
+  'dispatch-event': dispatch_event_js,
+  'form-submit': lambda params: submit_form_js(params['id']),
+  'link-click': click_link_js,
+  'raw-js': lambda params: ';'.join(params['lines'])
+}
+
+# action type -> params the action must have. Actions on an element given by either its id or its class have neither,
+# and are checked separately
+ACTION_PARAMS = {
+  'navigate': ['url'],
+  'textfield-set': ['id', 'value'],
+  'click': ['id'],
+  'dispatch-event': ['event-type'],
+  'form-submit': ['id'],
+  'link-click': [],
+  'raw-js': ['lines']
+}
+ELEMENT_ACTIONS = ['dispatch-event', 'link-click']
+
+# actions done with JS which can navigate away from the page, so the actions after them must not be fused with them:
+# they would run against the old document. Clicking a button can submit its form, or run a handler which navigates
+NAVIGATING_ACTIONS = ['click', 'form-submit', 'link-click']
+
+# a fused script runs the JS of each action in a block of its own, at the top level so that its vars are global as if
+# it had been run on its own, and evaluates to a list of [index of the action, error message] for the actions which
+# threw. The JS is written into the script rather than evaluated from strings, which pages whose Content Security
+# Policy does not allow 'unsafe-eval' would refuse
+FUSED_SCRIPT_START = 'var mobsterActionErrors = [];'
+FUSED_ACTION_TEMPLATE = '''try {{
+{0}
+}} catch (e) {{ mobsterActionErrors.push([{1}, String(e)]); }}'''
+FUSED_SCRIPT_END = 'mobsterActionErrors'
+
+
+class ScriptStep(object):
+  """
+  Performs one or more consecutive actions which are done with JS, with a single Runtime.evaluate. An action which
+  throws does not stop the ones after it, and its error is logged along with the action. An action whose JS does not
+  parse keeps the whole script from running, so every action of the step fails.
+  """
+
+  def __init__(self, actions, descriptions):
+    self.actions = actions
+    self.descriptions = descriptions
+    self.script = '\n'.join([FUSED_SCRIPT_START] +
+                             [FUSED_ACTION_TEMPLATE.format(ACTION_JS[action['type']](action.get('params', {})), index)
+                              for index, action in enumerate(actions)] +
+                             [FUSED_SCRIPT_END])
+
+  def run(self, client):
+    """Performs the actions, and returns a list of (description, error message) of the actions which failed"""
+    errors = client.run_js(self.script)
+    if not isinstance(errors, list):
+      # the script could not be run at all, which run_js has logged
+      errors = [[index, 'not run'] for index in range(len(self.actions))]
+    failures = [(self.descriptions[index], message) for index, message in errors]
+    for description, message in failures:
+      logging.error('{0} failed: {1}'.format(description, message))
+    return failures
+
+
+class NavigateStep(object):
+  """Navigates to the url of a navigate action"""
+
+  def __init__(self, action, description):
+    self.url = action['params']['url']
+    self.description = description
+
+  def run(self, client):
+    client.navigate_to(self.url)
+    return []
+
+
+class NavigationPlan(object):
+  """
+  The compiled actions of one navigation of a flow, along with the options of its page load. The actions before the
+  last one are fused into as few steps as possible (one, unless some of them can navigate), and the last one, which
+  causes the page load being profiled, is a step of its own.
+  """
+
+  def __init__(self, navigation, index):
+    setup_actions = navigation[:-1]
+    last_action = navigation[-1]
+    descriptions = [describe_action(action, i, index) for i, action in enumerate(navigation)]
+
+    self.setup_steps = compile_steps(setup_actions, descriptions[:-1])
+    self.page_load_step = compile_steps([last_action], descriptions[-1:])[0]
+
+    self.page_name = last_action['page-name']
+    self.wait_for_page_load = last_action.get('wait-for-page-load', True)
+    self.network_timeout = last_action.get('network-timeout', 3)
+    self.network_grace_period = last_action.get('network-grace-period')
+    self.collectors = last_action.get('collect')
+
+  def run_setup(self, client):
+    """Performs the actions before the page load, and returns a list of (description, error message) of failures"""
+    failures = []
+    for step in self.setup_steps:
+      failures.extend(step.run(client))
+    return failures
+
+
+def describe_action(action, action_index, navigation_index):
+  return "'{0}' action {1} of navigation {2}".format(action['type'], action_index + 1, navigation_index + 1)
+
+
+def compile_steps(actions, descriptions):
+  """
+  Returns the steps performing the actions, with consecutive actions done with JS fused into a single step. A step ends
+  with any action which can navigate away from the page.
+  """
+  steps = []
+  script_actions = []
+  script_descriptions = []
+  for action, description in zip(actions, descriptions):
+    if action['type'] == 'navigate':
+      if script_actions:
+        steps.append(ScriptStep(script_actions, script_descriptions))
+        script_actions, script_descriptions = [], []
+      steps.append(NavigateStep(action, description))
+    else:
+      script_actions.append(action)
+      script_descriptions.append(description)
+      if action['type'] in NAVIGATING_ACTIONS:
+        steps.append(ScriptStep(script_actions, script_descriptions))
+        script_actions, script_descriptions = [], []
+  if script_actions:
+    steps.append(ScriptStep(script_actions, script_descriptions))
+  return steps
+
+
+def validate_action(action, description):
+  """Raises a ValueError if the action is not of a known type or lacks params its type needs"""
+  if not isinstance(action, dict) or 'type' not in action:
+    raise ValueError('{0} must be an object with a type'.format(description))
+  if action['type'] not in ACTION_PARAMS:
+    raise ValueError('{0} has unknown type, must be one of {1}'.format(description, ', '.join(sorted(ACTION_PARAMS))))
+
+  params = action.get('params', {})
+  missing = [param for param in ACTION_PARAMS[action['type']] if param not in params]
+  if action['type'] in ELEMENT_ACTIONS and 'id' not in params and 'class' not in params:
+    missing.append('id or class')
+  if missing:
+    raise ValueError('{0} is missing params: {1}'.format(description, ', '.join(missing)))
+
+
+def compile_flow(test):
+  """
+  Validates a flow (as loaded from a flow file) and returns a NavigationPlan for each of its navigations. Raises a
+  ValueError describing the first problem found if the flow is not valid.
+  """
+  navigations = test.get('navigations') if isinstance(test, dict) else None
+  if not navigations:
+    raise ValueError('The test must have at least one navigation')
+
+  for index, navigation in enumerate(navigations):
+    if not navigation:
+      raise ValueError('Navigation {0} must have at least one action'.format(index + 1))
+    for i, action in enumerate(navigation):
+      validate_action(action, describe_action(action, i, index) if isinstance(action, dict) and 'type' in action
+                              else 'Action {0} of navigation {1}'.format(i + 1, index + 1))
+    if 'page-name' not in navigation[-1]:
+      raise ValueError('The last action of navigation {0} must have a page-name'.format(index + 1))
+
+  return [NavigationPlan(navigation, index) for index, navigation in enumerate(navigations)]
@@ -1,103 +1,337 @@
+from collections import defaultdict
 import json
+import logging
+import time
 
-from linkedin.mobster.har.css import CSSProfileParser
+from linkedin.mobster.har.css import CSSProfileParser, CSSSelectorIndex
+from linkedin.mobster.har.flowplan import compile_flow, compile_steps, validate_action
 from linkedin.mobster.har.network import NetworkEventHandler
-from linkedin.mobster.har.page import PageEventHandler, PageLoadNotifier
+from linkedin.mobster.har.page import PageLoadNotifier
 from linkedin.mobster.har.timeline import TimelineEventHandler
-from linkedin.mobster.utils import wait_until, format_time
-from linkedin.mobster.webkitclient import RemoteWebKitClient
+from linkedin.mobster.heap import HeapGrowthTracker, HeapSnapshotParser
+from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.utils import StatsAccumulator, format_time
+from linkedin.mobster.webkitclient import CommandBatch, RemoteWebKitClient
 from linkedin.mobster.webkitcommunicator import RemoteWebKitCommunicator
 
+# what can be collected for each navigation:
+#  - network: the entries, page timings and Resource Timing entries (in _resourceTimings). Always collected, because
+#    page load detection depends on it
+#  - timeline: timeline records, summarized in _eventStats
+#  - css: the CSS selector profile, summarized in _cssStats
+#  - memory: the heap sizes of the timeline records (with timeline memory details), the DOM node count and the number
+#    of elements, summarized in _memoryStats, _domNodeStats and _elementCount. Records the timeline even if the
+#    timeline collector is not used
+COLLECTORS = ['network', 'timeline', 'css', 'memory']
+
+def parse_collectors(collectors):
+  """
+  Returns the set of collectors given as a comma separated string or as a list. The network collector is always
+  included.
+  """
+  if isinstance(collectors, basestring):
+    collectors = [collector.strip() for collector in collectors.split(',') if collector.strip()]
+
+  unknown = set(collectors) - set(COLLECTORS)
+  if unknown:
+    raise ValueError('Unknown collectors {0}, must be some of {1}'.format(', '.join(sorted(unknown)),
+                                                                          ', '.join(COLLECTORS)))
+  return set(collectors) | set(['network'])
+
+def make_progress_logger(task, min_interval=1.0):
+  """
+  Returns a progress callback, taking the number of steps done and the total number of steps, which logs the progress
+  of the task at most once every min_interval seconds, and once it is done
+  """
+  last_logged = [0]
+
+  def log_progress(done, total):
+    now = time.time()
+    if done == total or now - last_logged[0] >= min_interval:
+      last_logged[0] = now
+      logging.info('{0}: {1}/{2}'.format(task, done, total))
+  return log_progress
+
 class FlowProfiler(RemoteWebKitClient):
   """
   Runs a flow and records profiling information for each navigation. Generates HAR file.
   """
-  def __init__(self, test_file, iterations=1):
-    super(FlowProfiler, self).__init__(RemoteWebKitCommunicator())
+  # fewest iterations run before deciding that the onLoad times are precise enough
+  MIN_ADAPTIVE_ITERATIONS = 3
+
+  def __init__(self, test_file, iterations=1, communicator=None, target=None, target_ci=None, collectors=None,
+               css_index=None):
+    """
+    test_file is the path of the flow file, or the flow itself as loaded from one.
+
+    communicator defaults to a new RemoteWebKitCommunicator, but any connected communicator with the same interface
+    (e.g. an AsyncWebKitCommunicator sharing an event loop with other profilers) can be given instead.
+
+    target is the Target being profiled. If given, a communicator is created for it (unless one is given as well) and
+    every HAR generated is tagged with the target's name.
+
+    If target_ci is given, iterations is the maximum number of iterations, and profile() stops as soon as the 95%
+    confidence interval of the mean onLoad time of every navigation is narrower than target_ci times that mean on
+    either side (e.g. 0.05 for +/-5%).
+
+    collectors are the collectors used for every navigation (see COLLECTORS), which defaults to config['COLLECTORS'].
+    A navigation can use other collectors by giving them under 'collect' in its last action.
+
+    The CSS selector profile of every navigation is added to css_index, a CSSSelectorIndex which defaults to a new one.
+    An index can be shared by several profilers to total the selectors of all of them.
+    """
+    if communicator is None:
+      communicator = RemoteWebKitCommunicator(ws_url=target.ws_url) if target else RemoteWebKitCommunicator()
+    super(FlowProfiler, self).__init__(communicator)
+    self._target = target
     assert iterations > 0, "iterations must be a positive integer"
     self._iterations = iterations
-    self._page_event_handler = None
+    self._target_ci = target_ci
+    self._collectors = parse_collectors(collectors or config['COLLECTORS'])
+    self._collected = None
     self._network_event_handler = None
     self._timeline_event_handler = None
     self._css_profiler_handler = None
+    self.css_index = css_index if css_index is not None else CSSSelectorIndex()
+    self._heap_summary = None
+    self._heap_growth = None
+    self._heap_growth_tracker = HeapGrowthTracker()
 
+    if isinstance(test_file, dict):
+      self._test = test_file
+    else:
+      with open(test_file, 'r') as f:
+        self._test = json.loads(f.read())
 
-    with open(test_file, 'r') as f:
-      self._test = json.loads(f.read())
+    # the flow is validated and compiled once, so that a mistake in it is found before anything is run
+    self._plan = compile_flow(self._test)
+    for navigation in self._plan:
+      if navigation.collectors:
+        parse_collectors(navigation.collectors)
 
-    assert len(self._test) > 0, 'The test must have at least one navigation'
+    # statistics of the onLoad times of each navigation, updated after every iteration
+    self.onload_stats = [StatsAccumulator() for navigation in self._plan]
+    self.iterations_run = 0
 
 
-  def profile(self):
+  def profile(self, har_callback=None):
     """
     Runs the test specified by the test file given to the constructor, and returns a list of HAR files (one for each
     navigation)
+
+    If har_callback is given, it is called with (iteration, har) as soon as each HAR file is made, instead of the HAR
+    files being collected, and an empty list is returned.
+
+    If a target_ci was given to the constructor, iterations stop as soon as the onLoad times are precise enough, so
+    fewer than the given number of iterations may be run.
     """
 
     # list of list of har files: [[hars from run 1], [hars from run 2], ...]
     iteration_hars = []
 
     for x in range(0, self._iterations):
-      hars = []
-      self.clear_http_cache()
-      self.clear_cookies()
-
-      # Navigate to about:blank, to reset memory, etc.
-      self._page_event_handler = PageEventHandler()
-      self.start_page_event_monitoring(self._page_event_handler.process_event)
-      self.navigate_to('about:blank')
-      wait_until(lambda: self._page_event_handler.page_loaded)
-      self.stop_page_event_monitoring()
-
-      for navigation in self._test['navigations']:
-        assert len(navigation) > 0, 'Each navigation must have at least one action'
-
-        # do all the actions except the last one, because the last action causes the actual page navigation
-        for i in range(0, len(navigation) - 1):
-          self.process_action(navigation[i])
-
-        self._network_event_handler = NetworkEventHandler()
-        try:
-          wait_for_page_load_event = navigation[-1]['wait-for-page-load']
-        except KeyError:
-          wait_for_page_load_event = True
-        try:
-          self._page_load_notifier = PageLoadNotifier(wait_for_page_load_event, navigation[-1]['network-timeout'])
-        except KeyError:
-          self._page_load_notifier = PageLoadNotifier(wait_for_page_load_event)
-
-        self._timeline_event_handler = TimelineEventHandler()
-        self.start_network_monitoring(self._network_event_handler.process_event)
-        self.start_timeline_monitoring(self._timeline_event_handler.process_event)
-        self.start_page_event_monitoring(self._page_load_notifier.process_page_event)
-        self._communicator.add_domain_callback('Network', 'page_load_notifier', self._page_load_notifier.process_network_event)
-        self._communicator.add_domain_callback('Timeline', 'page_load_notifier', self._page_load_notifier.process_timeline_event)
-        self.start_css_selector_profiling()
-        self.process_action(navigation[-1])
-
-        wait_until(lambda: self._page_load_notifier.page_loaded())
-        self.stop_page_event_monitoring()
-        self.stop_timeline_monitoring()
-        self.stop_network_monitoring()
-        self._css_profiler_handler = CSSProfileParser(self.stop_css_selector_profiling())
-
-        hars.append(self.make_har(navigation[-1]['page-name']))
-
-      iteration_hars.append(hars)
+      # onLoad time of each navigation of this iteration
+      onloads = []
+      if har_callback:
+        def iteration_callback(har, x=x):
+          onloads.append(har['log']['pages'][0]['pageTimings']['onLoad'])
+          har_callback(x, har)
+        self.profile_iteration(har_callback=iteration_callback)
+      else:
+        hars = self.profile_iteration()
+        onloads = [har['log']['pages'][0]['pageTimings']['onLoad'] for har in hars]
+        iteration_hars.append(hars)
+      self.iterations_run += 1
+
+      for stats, onload in zip(self.onload_stats, onloads):
+        if onload >= 0:
+          stats.add(onload)
+
+      if self._target_ci and self.onload_converged():
+        logging.info('onLoad times are within +/-{0:.1%} after {1} iterations'.format(self._target_ci,
+                                                                                    self.iterations_run))
+        break
 
     return iteration_hars
 
+  def onload_converged(self):
+    """
+    Returns whether the confidence interval of the mean onLoad time of every navigation is narrower than the target.
+    Navigations without any onLoad time (e.g. ones which do not wait for the page load) are left out, and if no
+    navigation has one, the onLoad times never converge, so every iteration is run.
+    """
+    if self.iterations_run < self.MIN_ADAPTIVE_ITERATIONS:
+      return False
+    measured = [stats for stats in self.onload_stats if stats.count]
+    if not measured:
+      if self.iterations_run == self.MIN_ADAPTIVE_ITERATIONS:
+        logging.warning('No navigation has an onLoad time to converge, running all {0} iterations'.format(
+          self._iterations))
+      return False
+    return all(stats.ci_half_width() <= self._target_ci * stats.mean for stats in measured)
+
+  def measure_collector_overhead(self, iterations=1):
+    """
+    Measures how much each of the profiler's collectors slows down the page loads of the flow. The flow is run with
+    only the network collector, and with the network collector plus each of the others, iterations times each. The
+    runs are interleaved, so that any drift in the state of the device affects them all alike.
+
+    Returns a dictionary of collector -> page name -> median onLoad time with the collector minus the median onLoad time
+    with only the network collector, in ms. For the network collector, the median onLoad times themselves are given.
+    """
+    measured = [collector for collector in COLLECTORS if collector in self._collectors and collector != 'network']
+
+    # collector -> page name -> onLoad times
+    onloads = dict((collector, defaultdict(StatsAccumulator)) for collector in ['network'] + measured)
+    for x in range(0, iterations):
+      for collector in ['network'] + measured:
+        for har in self.profile_iteration(collectors=set(['network', collector])):
+          page = har['log']['pages'][0]
+          if page['pageTimings']['onLoad'] >= 0:
+            onloads[collector][page['_pageName']].add(page['pageTimings']['onLoad'])
+
+    baseline = dict((page_name, stats.quantile(0.5)) for page_name, stats in onloads['network'].iteritems())
+    overhead = {'network': baseline}
+    for collector in measured:
+      overhead[collector] = dict((page_name, stats.quantile(0.5) - baseline[page_name])
+                                 for page_name, stats in onloads[collector].iteritems() if page_name in baseline)
+    return overhead
+
+  def profile_iteration(self, har_callback=None, collectors=None):
+    """
+    Runs the test once, starting from a clean browser state, and returns a list of HAR files (one for each navigation).
+    If har_callback is given, each HAR file is passed to it as soon as it is made instead of being returned.
+
+    If collectors are given, they are used for every navigation, instead of the profiler's or the navigation's own.
+    """
+    self.reset_browser_state()
+
+    hars = []
+    for navigation in self._plan:
+      har = self.profile_navigation(navigation, collectors)
+      if har_callback:
+        har_callback(har)
+      else:
+        hars.append(har)
+
+    return hars
+
+  def reset_browser_state(self):
+    """Clears the cache and cookies, and navigates to about:blank to reset memory, etc."""
+    reset_batch = CommandBatch()
+    self.clear_http_cache(reset_batch)
+    self.clear_cookies(reset_batch)
+
+    # network events are not monitored, so about:blank is loaded as soon as its load event fires
+    blank_page_notifier = PageLoadNotifier(True, grace_period=0)
+    self.start_page_event_monitoring(blank_page_notifier.process_page_event, reset_batch)
+    self.send_batch(reset_batch)
+    self.navigate_to('about:blank')
+    blank_page_notifier.wait_until_loaded()
+    self.stop_page_event_monitoring()
+
+  def profile_navigation(self, navigation, collectors=None):
+    """
+    Performs the actions of a single navigation (a NavigationPlan, see flowplan.compile_flow) and returns the HAR file
+    of the resulting page load. Only the data of the given collectors is recorded, or else of the navigation's own
+    collectors, or else of the profiler's.
+    """
+    if collectors:
+      collectors = parse_collectors(collectors)
+    elif navigation.collectors:
+      collectors = parse_collectors(navigation.collectors)
+    else:
+      collectors = self._collectors
+    self._collected = collectors
+
+    # do all the actions except the last one (in a single round trip unless they navigate), because the last action
+    # causes the actual page navigation
+    navigation.run_setup(self)
+
+    self._network_event_handler = NetworkEventHandler()
+    self._page_load_notifier = PageLoadNotifier(navigation.wait_for_page_load, navigation.network_timeout,
+                                                navigation.network_grace_period)
+
+    self._timeline_event_handler = TimelineEventHandler() if collectors & set(['timeline', 'memory']) else None
+    self._css_profiler_handler = None
+
+    # enable all the domains with a single round trip
+    setup_batch = CommandBatch()
+    self.start_network_monitoring(self._network_event_handler.process_event, setup_batch)
+    if self._timeline_event_handler:
+      self.start_timeline_monitoring(self._timeline_event_handler.process_event, setup_batch,
+                                     include_memory_details='memory' in collectors)
+    self.start_page_event_monitoring(self._page_load_notifier.process_page_event, setup_batch)
+    self._communicator.add_domain_callback('Network', 'page_load_notifier', self._page_load_notifier.process_network_event)
+    if self._timeline_event_handler:
+      self._communicator.add_domain_callback('Timeline', 'page_load_notifier',
+                                             self._page_load_notifier.process_timeline_event)
+    if 'css' in collectors:
+      self.start_css_selector_profiling(setup_batch)
+    self.send_batch(setup_batch)
+    navigation.page_load_step.run(self)
+
+    self._page_load_notifier.wait_until_loaded()
+    teardown_batch = CommandBatch()
+    self.stop_page_event_monitoring(teardown_batch)
+    if self._timeline_event_handler:
+      self.stop_timeline_monitoring(teardown_batch)
+    self.stop_network_monitoring(teardown_batch)
+    if 'css' in collectors:
+      self.stop_css_selector_profiling(teardown_batch)
+    self.send_batch(teardown_batch)
+    if 'css' in collectors:
+      self._css_profiler_handler = CSSProfileParser(teardown_batch.response('CSS.stopSelectorProfiler'),
+                                                    self.css_index)
+
+    # messages which had to wait long to be handled point to skewed timings
+    if hasattr(self._communicator, 'get_ingest_stats'):
+      logging.info('Message handling stats of {0}: {1}'.format(navigation.page_name,
+                                                               self._communicator.get_ingest_stats(reset=True)))
+
+    # taking a heap snapshot forces a garbage collection, so only do it once everything else has been recorded. For
+    # leak detection, a snapshot is taken at the end of every iteration, i.e. after its last navigation
+    self._heap_summary = None
+    self._heap_growth = None
+    track_growth = config['HEAP_GROWTH'] and navigation is self._plan[-1]
+    if config['HEAP_SNAPSHOTS'] or track_growth:
+      snapshot = self.get_heap_snapshot()
+      if snapshot and config['HEAP_SNAPSHOTS']:
+        self._heap_summary = snapshot.get_summary(config['HEAP_SNAPSHOT_TOP_N'])
+      if snapshot and track_growth:
+        self._heap_growth_tracker.add(snapshot.aggregate_by_constructor())
+        self._heap_growth = self._heap_growth_tracker.get_report(config['HEAP_SNAPSHOT_TOP_N'])
+
+      # free the snapshot's arrays before the HAR is made
+      del snapshot
+
+    return self.make_har(navigation.page_name)
+
 
   def process_action(self, action):
-    {
-      'navigate': lambda: self.navigate_to(action['params']['url']),
-      'textfield-set': lambda: self.set_field_value(action['params']['id'], action['params']['value']),
-      'click': lambda: self.click_button(action['params']['id']),
-      'dispatch-event': lambda: self.dispatch_event(action['params']),
-      'form-submit': lambda: self.submit_form_by_id(action['params']['id']),
-      'link-click': lambda: self.submit_form_by_id(action['params']),
-      'raw-js': lambda: self.run_js(';'.join(action['params']['lines']))
-    }[action['type']]()
+    """Performs a single flow action on its own. Flows are run from their compiled plan instead"""
+    validate_action(action, "'{0}' action".format(action.get('type')))
+    for step in compile_steps([action], ["'{0}' action".format(action['type'])]):
+      step.run(self)
+
+  def get_heap_snapshot(self):
+    """
+    Takes a heap snapshot of the current page and returns it as a HeapSnapshot, or None if the snapshot could not be
+    taken. The snapshot is parsed as it is received, without the serialized snapshot being stored.
+    """
+    try:
+      if not self._profiling_enabled:
+        self.enable_profiling()
+      self.take_heap_snapshot(make_progress_logger('Taking heap snapshot'))
+      parser = HeapSnapshotParser()
+      self.get_heap_profile(parser.feed)
+
+      # the browser holds on to every snapshot taken until they are cleared
+      self.clear_profiles()
+      return parser.close()
+    except Exception:
+      logging.exception('Could not take heap snapshot')
+      return None
 
   def make_har(self, page_name):
     """
@@ -105,7 +339,7 @@ class FlowProfiler(RemoteWebKitClient):
 
     page_name is this name that the flow file assigned to this page.
     """
-    return {
+    har = {
       'log': {
         'version': '1.2',
         'creator': {
@@ -125,35 +359,65 @@ class FlowProfiler(RemoteWebKitClient):
       }
     }
 
+    if self._target:
+      har['log']['_target'] = self._target.name
+
+    return har
+
   def make_page_info(self, page_name):
     """
     Make the 'page' entry for this page, which goes into the 'pages' section of the HAR file.
     Includes overall page timings and some memory-related information which is not included in
-    normal HAR files
+    normal HAR files. Sections which need a collector which was not used are left out.
     """
-
-    return {
+    # everything needed from the page is fetched with a single round trip
+    probe = self.probe_page(include_dom_node_count='memory' in self._collected)
+    page_info = {
       'startedDateTime': format_time(self._network_event_handler.get_first_request_time()),
       'id': self._network_event_handler.primary_page_id,
-      'title': self.run_js('document.title'),
+      'title': probe.get('title'),
       '_pageName': page_name,
-      'pageTimings': self.get_page_timings(),
-      '_memoryStats': self._timeline_event_handler.get_memory_stats(),
-      '_eventStats': self._timeline_event_handler.get_event_stats(),
-      '_domNodeStats': self.get_dom_node_count(),
-      '_cssStats': self._css_profiler_handler.get_css_stats()
+      '_collectors': sorted(self._collected),
+      'pageTimings': self.get_page_timings(probe.get('timing')),
+      '_resourceTimings': [{
+        'name': name,
+        'initiatorType': initiator_type,
+        'startTime': start_time,
+        'duration': duration
+      } for name, initiator_type, start_time, duration in probe.get('resources', [])]
     }
 
+    memory_stats = {}
+    if 'memory' in self._collected:
+      memory_stats = self._timeline_event_handler.get_memory_stats()
+      page_info['_domNodeStats'] = probe.get('domNodeCount')
+      page_info['_elementCount'] = probe.get('elements')
+    if self._heap_summary:
+      memory_stats['_heapSnapshot'] = self._heap_summary
+    if self._heap_growth:
+      memory_stats['_heapGrowth'] = self._heap_growth
+    if memory_stats:
+      page_info['_memoryStats'] = memory_stats
+
+    if 'timeline' in self._collected:
+      page_info['_eventStats'] = self._timeline_event_handler.get_event_stats()
+    if self._css_profiler_handler:
+      page_info['_cssStats'] = self._css_profiler_handler.get_css_stats()
+
+    return page_info
+
 
-  def get_page_timings(self):
+  def get_page_timings(self, browser_timings=None):
     """
     Returns a dictionary containing onContentLoad and onLoad times, both in (whole) milliseconds from
-    the start of the request
+    the start of the request. browser_timings are the page's Navigation Timing fields, which are fetched
+    if not given
     """
-    browser_timings = self.get_window_performance()
+    if browser_timings is None:
+      browser_timings = self.get_window_performance()
     first_request_start = self._network_event_handler.get_first_request_time()
     return {
-      'onContentLoad': max(int(browser_timings['domContentLoadedEventEnd'] - (first_request_start * 1000)), -1),
-      'onLoad' : max(int(browser_timings['loadEventEnd'] - (first_request_start * 1000)), -1)
+      'onContentLoad': max(int(browser_timings.get('domContentLoadedEventEnd', 0) - (first_request_start * 1000)), -1),
+      'onLoad' : max(int(browser_timings.get('loadEventEnd', 0) - (first_request_start * 1000)), -1)
     }
 
@@ -1,5 +1,22 @@
 
 
+from collections import defaultdict
+import urlparse
+
+from linkedin.mobster.utils import StatsAccumulator, format_time, parse_time
+
+# memory stats averaged across runs, and memory stats whose max across runs is taken
+avg_memory_fields = ['_initialTotalHeapSize', '_initialUsedHeapSize', '_avgUsedHeapSize', '_p90UsedHeapSize']
+max_memory_fields = ['_maxTotalHeapSize', '_maxUsedHeapSize', '_maxJsEventListeners', '_maxNodes', '_maxDocuments']
+
+page_timing_fields = ['onContentLoad', 'onLoad']
+event_count_fields = ['_styleRecalculates', '_gcEvents', '_paints']
+record_type_fields = ['count', 'totalTime', 'selfTime']
+stylesheet_fields = ['rules', 'time', 'hitCount', 'matchCount']
+
+# runs whose onLoad time has a modified z-score above this are left out by merge_by_percentile
+OUTLIER_MAX_DEVIATION = 3.5
+
 def merge_by_average(hars):
   """
   Returns a har file representing the average of multiple har files, each reprenting the same page request. The har
@@ -22,71 +39,273 @@ def merge_by_average(hars):
   avg_log['creator'] = creator_first
   avg_log['browser'] = browser_info_first
   avg_log['version'] = logs[0]['version']
+  if '_target' in logs[0]:
+    avg_log['_target'] = logs[0]['_target']
 
-  sorted(logs, key=lambda log: log['pages'][0]['pageTimings']['onLoad'])
-  median_onload_log = logs[len(logs) / 2]
+  median_onload_log = get_median_onload_log(logs)
 
   avg_log['entries'] = median_onload_log['entries']
 
   avg_log['pages'] = []
   avg_log['pages'].append({})
 
-  avg_log['pages'][0]['_cssStats'] = avg_css_stats([log['pages'][0]['_cssStats'] for log in logs])
-  avg_log['pages'][0]['_memoryStats'] = avg_memory_stats([log['pages'][0]['_memoryStats'] for log in logs])
-  avg_log['pages'][0]['_eventStats'] = avg_event_stats([log['pages'][0]['_eventStats'] for log in logs])
-  avg_log['pages'][0]['_domNodeStats'] = median_onload_log['pages'][0]['_domNodeStats']
-  avg_log['pages'][0]['pageTimings'] = median_onload_log['pages'][0]['pageTimings']
+  pages = [log['pages'][0] for log in logs]
+  median_page = median_onload_log['pages'][0]
+  avg_page = avg_log['pages'][0]
+
+  # a section is only merged if every run collected it (see flowprofiler.COLLECTORS)
+  if all('_cssStats' in page for page in pages):
+    avg_page['_cssStats'] = avg_css_stats(page['_cssStats'] for page in pages)
 
-  for field, value in median_onload_log['pages'][0].iteritems():
+  memory_stats = {}
+  if all('_maxUsedHeapSize' in page.get('_memoryStats', {}) for page in pages):
+    memory_stats = avg_memory_stats(page['_memoryStats'] for page in pages)
+  median_memory_stats = median_page.get('_memoryStats', {})
+  for field in ['_heapSnapshot', '_heapTimeSeries']:
+    if field in median_memory_stats:
+      memory_stats[field] = median_memory_stats[field]
+
+  # the heap growth report of the last run covers all the runs before it
+  if '_heapGrowth' in pages[-1].get('_memoryStats', {}):
+    memory_stats['_heapGrowth'] = pages[-1]['_memoryStats']['_heapGrowth']
+  if memory_stats:
+    avg_page['_memoryStats'] = memory_stats
+
+  if all('_eventStats' in page for page in pages):
+    avg_page['_eventStats'] = avg_event_stats(page['_eventStats'] for page in pages)
+  for field in ['_domNodeStats', '_elementCount', '_resourceTimings', '_collectors']:
+    if field in median_page:
+      avg_page[field] = median_page[field]
+  avg_page['pageTimings'] = dict(median_page['pageTimings'])
+  timing_accumulators = accumulate_fields((page['pageTimings'] for page in pages), page_timing_fields)
+  avg_page['pageTimings']['_distributions'] = dict((field, accumulator.get_summary())
+                                                   for field, accumulator in timing_accumulators.iteritems())
+
+  for field, value in median_page.iteritems():
     if type(value) == type("") or type(value) == type(u""):
-      avg_log['pages'][0][field] = value
+      avg_page[field] = value
 
 
   return avg_har
 
 
+def merge_by_percentile(hars, max_deviation=OUTLIER_MAX_DEVIATION):
+  """
+  Returns a har file describing the distribution of the results of multiple har files of the same page request,
+  rather than the entries of one of them. Runs whose onLoad time is an outlier are left out first, then the page stats
+  are merged as in merge_by_average. The entries are matched across the remaining runs by request method and
+  normalized URL, and each merged entry holds the median start time, time and timings of the runs which made the
+  request, along with their percentiles and spread.
+  """
+  kept, rejected = reject_outliers(hars, lambda har: har['log']['pages'][0]['pageTimings']['onLoad'], max_deviation)
+  logs = [har['log'] for har in kept]
+
+  merged_har = merge_by_average(kept)
+  merged_log = merged_har['log']
+  merged_log['entries'] = merge_entries(logs, get_median_onload_log(logs))
+  merged_log['_mergedRuns'] = len(kept)
+  merged_log['_rejectedRuns'] = rejected
+
+  return merged_har
+
+
+def get_median_onload_log(logs):
+  """Returns the log of the run with the median onLoad time"""
+  return sorted(logs, key=lambda log: log['pages'][0]['pageTimings']['onLoad'])[len(logs) / 2]
+
+
+def median(values):
+  values = sorted(values)
+  middle = len(values) / 2
+  return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def reject_outliers(items, key, max_deviation=OUTLIER_MAX_DEVIATION):
+  """
+  Splits items into a list of the items to keep and a list of the indexes of the outliers, which are the items whose
+  key has a modified z-score (its distance from the median in units of the median absolute deviation, scaled to be
+  comparable with the standard deviation) above max_deviation. Nothing is rejected when there are less than 3 items or
+  more than half the keys are equal.
+  """
+  values = [key(item) for item in items]
+  if len(values) < 3:
+    return list(items), []
+
+  center = median(values)
+  deviation = 1.4826 * median(abs(value - center) for value in values)
+  if not deviation:
+    return list(items), []
+
+  kept = []
+  rejected = []
+  for i, (item, value) in enumerate(zip(items, values)):
+    if abs(value - center) / deviation > max_deviation:
+      rejected.append(i)
+    else:
+      kept.append(item)
+  return kept, rejected
+
+
+def normalize_url(url):
+  """Returns the URL with a lower case scheme and host, without the default port and without the fragment"""
+  parts = urlparse.urlsplit(url)
+  netloc = parts.netloc.lower()
+  if (parts.scheme.lower(), parts.port) in [('http', 80), ('https', 443)]:
+    netloc = netloc.rsplit(':', 1)[0]
+  return urlparse.urlunsplit((parts.scheme.lower(), netloc, parts.path, parts.query, ''))
+
+
+def merge_entries(logs, median_log):
+  """
+  Returns the entries of the logs merged across runs. The n-th request of a URL with a method in one run is matched with
+  the n-th request of the same URL with the same method in the others. The fields of every merged entry are taken from the entry of median_log (or of
+  the first run which made the request, if the median run did not), except for:
+   - startedDateTime, time and timings, which are the medians over the runs which made the request. Start times are
+     taken relative to the start of each run, and placed relative to the start of median_log
+   - _runs, which is the number of runs which made the request
+   - _distributions, which is the summary of the start time (_startOffset, in ms), time and every timing phase
+  Entries are ordered by their start time.
+  """
+  # (method, normalized url, occurrence) -> [entry, {field -> StatsAccumulator}]
+  merged = {}
+  for log in [median_log] + [log for log in logs if log is not median_log]:
+    if not log['entries']:
+      continue
+    start_times = [parse_time(entry['startedDateTime']) for entry in log['entries']]
+    run_start = min(start_times)
+    occurrences = defaultdict(int)
+
+    for entry, start_time in zip(log['entries'], start_times):
+      request = (entry['request']['method'], normalize_url(entry['request']['url']))
+      key = request + (occurrences[request],)
+      occurrences[request] += 1
+
+      if key not in merged:
+        merged[key] = [entry, defaultdict(StatsAccumulator)]
+      accumulators = merged[key][1]
+      accumulators['_startOffset'].add((start_time - run_start) * 1000)
+      accumulators['time'].add(entry['time'])
+      for phase, duration in entry['timings'].iteritems():
+        # -1 means the phase does not apply to the request
+        if duration >= 0:
+          accumulators[phase].add(duration)
+
+  page_start = min(parse_time(entry['startedDateTime']) for entry in median_log['entries']) \
+               if median_log['entries'] else 0
+  entries = []
+  for entry, accumulators in merged.itervalues():
+    merged_entry = dict(entry)
+    start_offset = accumulators['_startOffset'].quantile(0.5)
+    merged_entry['startedDateTime'] = format_time(page_start + start_offset / 1000)
+    merged_entry['time'] = accumulators['time'].quantile(0.5)
+    merged_entry['timings'] = dict((phase, accumulators[phase].quantile(0.5) if phase in accumulators else -1)
+                                   for phase in entry['timings'])
+    merged_entry['_runs'] = accumulators['time'].count
+    merged_entry['_distributions'] = dict((field, accumulator.get_summary())
+                                          for field, accumulator in accumulators.iteritems())
+    entries.append((start_offset, merged_entry))
+
+  entries.sort(key=lambda (start_offset, entry): start_offset)
+  return [entry for start_offset, entry in entries]
+
+
 def avg_css_stats(stats_list):
   """
-  Returns averaged CSS stats from a list of the CSS stats of multiple runs. We return the average CSS totalTime and the
-  max of the most time consuming and most misses rules from all the runs.
+  Returns averaged CSS stats from the CSS stats of multiple runs. We return the average CSS totalTime, the max of
+  the most time consuming and most misses rules from all the runs, and the average totals of each stylesheet over the
+  runs it was used in (if every run has them).
   """
-  css_result = {}
-  css_result['_totalTime'] = sum(stats['_totalTime'] for stats in stats_list) / len(stats_list)
+  total_time = StatsAccumulator()
+  most_time_consuming_rule = None
+  most_misses_rule = None
+  # url -> totals of the stylesheet in each run, or None once a run without stylesheet totals is seen
+  stylesheets = defaultdict(list)
+  for stats in stats_list:
+    total_time.add(stats['_totalTime'])
+
+    # runs without any CSS rules have no rules to compare
+    rule = stats['_mostTimeConsumingRule']
+    if rule and (not most_time_consuming_rule or rule['time'] > most_time_consuming_rule['time']):
+      most_time_consuming_rule = rule
+    rule = stats['_mostMissesRule']
+    if rule and (not most_misses_rule or rule['hitCount'] - rule['matchCount'] >
+                 most_misses_rule['hitCount'] - most_misses_rule['matchCount']):
+      most_misses_rule = rule
 
-  css_result['_mostTimeConsumingRule'] = max((stats['_mostTimeConsumingRule'] for stats in stats_list),
-                                             key=lambda rule: rule['time'])
-  css_result['_mostMissesRule'] = max((stats['_mostMissesRule'] for stats in stats_list),
-                                      key=lambda rule: rule['hitCount'] - rule['matchCount'])
-  return css_result
+    if stylesheets is not None and '_stylesheets' in stats:
+      for url, stylesheet in stats['_stylesheets'].iteritems():
+        stylesheets[url].append(stylesheet)
+    else:
+      stylesheets = None
+
+  css_stats = {
+    '_totalTime': total_time.mean,
+    '_mostTimeConsumingRule': most_time_consuming_rule,
+    '_mostMissesRule': most_misses_rule,
+    '_distributions': {'_totalTime': total_time.get_summary()}
+  }
+  if stylesheets is not None:
+    css_stats['_stylesheets'] = dict((url, dict((field, accumulator.mean) for field, accumulator in
+                                                accumulate_fields(runs, stylesheet_fields).iteritems()))
+                                     for url, runs in stylesheets.iteritems())
+  return css_stats
 
 def avg_memory_stats(stats_list):
   """
   Returns averaged memory statistics from all the runs (_max* fields are calculated via taking the max as opposed
   to average)
   """
-  mem_result = {}
-
-  mem_result['_initialTotalHeapSize'] = sum(stats['_initialTotalHeapSize'] for stats in stats_list) / len(stats_list)
-  mem_result['_maxTotalHeapSize'] = max(stats['_maxTotalHeapSize'] for stats in stats_list)
-
-  mem_result['_initialUsedHeapSize'] = sum(stats['_initialUsedHeapSize'] for stats in stats_list) / len(stats_list)
-  mem_result['_maxUsedHeapSize'] = max(stats['_maxUsedHeapSize'] for stats in stats_list)
-  mem_result['_avgUsedHeapSize'] = sum(stats['_avgUsedHeapSize'] for stats in stats_list) / len(stats_list)
-
-  mem_result['_maxJsEventListeners'] = max(stats['_maxJsEventListeners'] for stats in stats_list)
-  mem_result['_maxNodes'] = max(stats['_maxNodes'] for stats in stats_list)
-  mem_result['_maxDocuments'] = max(stats['_maxDocuments'] for stats in stats_list)
+  accumulators = accumulate_fields(stats_list, avg_memory_fields + max_memory_fields)
 
+  mem_result = dict((field, accumulators[field].mean if accumulators[field].count else None)
+                    for field in avg_memory_fields)
+  mem_result.update((field, accumulators[field].max) for field in max_memory_fields)
+  mem_result['_distributions'] = dict((field, accumulator.get_summary())
+                                      for field, accumulator in accumulators.iteritems())
   return mem_result
 
 def avg_event_stats(stats_list):
   """
   Returns an object containing simple averages of all the event stats
   """
-  event_result = {}
+  accumulators = dict((field, StatsAccumulator()) for field in event_count_fields)
+  record_type_accumulators = {}
+  num_runs = 0
+  for stats in stats_list:
+    num_runs += 1
+    for field, accumulator in accumulators.iteritems():
+      accumulator.add(stats[field])
+    for record_type, type_stats in stats.get('_recordTypes', {}).iteritems():
+      if record_type not in record_type_accumulators:
+        record_type_accumulators[record_type] = dict((field, StatsAccumulator()) for field in record_type_fields)
+      for field, accumulator in record_type_accumulators[record_type].iteritems():
+        accumulator.add(type_stats[field])
+
+  event_result = dict((field, accumulator.mean) for field, accumulator in accumulators.iteritems())
+  event_result['_distributions'] = dict((field, accumulator.get_summary())
+                                        for field, accumulator in accumulators.iteritems())
+
+  # a record type missing from a run did not occur in it
+  event_result['_recordTypes'] = {}
+  for record_type, type_accumulators in record_type_accumulators.iteritems():
+    for accumulator in type_accumulators.itervalues():
+      for i in xrange(num_runs - accumulator.count):
+        accumulator.add(0)
+    event_result['_recordTypes'][record_type] = dict((field, accumulator.mean)
+                                                     for field, accumulator in type_accumulators.iteritems())
 
-  event_result['_styleRecalculates'] = sum(stats['_styleRecalculates'] for stats in stats_list) / len(stats_list)
-  event_result['_gcEvents'] = sum(stats['_gcEvents'] for stats in stats_list) / len(stats_list)
-  event_result['_paints'] = sum(stats['_paints'] for stats in stats_list) / len(stats_list)
+  return event_result
 
-  return event_result
\ No newline at end of file
+def accumulate_fields(stats_list, fields):
+  """
+  Returns a StatsAccumulator for each of the given fields, holding the values of the field in all the dictionaries of
+  stats_list. stats_list can be any iterable and is only iterated over once. Missing and None values (e.g. the initial
+  heap size of a page load without timeline records) are left out.
+  """
+  accumulators = dict((field, StatsAccumulator()) for field in fields)
+  for stats in stats_list:
+    for field, accumulator in accumulators.iteritems():
+      value = stats.get(field)
+      if value is not None:
+        accumulator.add(value)
+  return accumulators
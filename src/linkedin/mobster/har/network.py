@@ -3,26 +3,75 @@ import logging
 
 from linkedin.mobster.utils import format_time
 
+class RequestRecord(object):
+  """
+  Everything recorded about a single resource request. Data packets are not kept; only the running aggregates needed
+  for the HAR entry are, so memory use grows with the number of requests rather than the number of packets.
+  """
+  __slots__ = ('start_time', 'method', 'url', 'request_headers', 'status', 'status_text', 'response_headers',
+               'timings', 'first_data_time', 'last_data_time', 'data_length', 'encoded_data_length', 'body_size',
+               'compression')
+
+  def __init__(self, timings):
+    # request start time in seconds
+    self.start_time = -1
+    self.method = '_'
+    self.url = '_'
+    self.request_headers = None
+    self.status = -1
+    self.status_text = '_'
+    self.response_headers = None
+    self.timings = timings
+
+    # running aggregates of the dataReceived notifications
+    self.first_data_time = None
+    self.last_data_time = None
+    self.data_length = 0
+    self.encoded_data_length = 0
+
+    # set once loading has finished
+    self.body_size = 0
+    self.compression = '-99999'
+
+  def add_data_packet(self, timestamp, data_length, encoded_data_length):
+    if self.first_data_time is None:
+      self.first_data_time = self.last_data_time = timestamp
+    elif timestamp < self.first_data_time:
+      self.first_data_time = timestamp
+    elif timestamp > self.last_data_time:
+      self.last_data_time = timestamp
+    self.data_length += data_length
+    self.encoded_data_length += encoded_data_length
+
+
 class NetworkEventHandler(object):
   def __init__(self):
-    # request start times in seconds
-    self._request_start_times = {}
-
-    # the following dicts use request ids as keys
-    self._request_start_times = defaultdict(lambda: -1)
-    self._page_refs = defaultdict(lambda: '_')
-    self._server_ips = defaultdict(lambda: '_')
-    self._connection_ids = defaultdict(lambda: '_')
-    self._resource_timings = defaultdict(self._default_resource_timing_value)
-    self._requests = defaultdict(self._default_request_value)
-    self._responses = defaultdict(self._default_response_value)
-    self._caches = defaultdict(self._default_cache_value)
-    self._data_packet_notifications = defaultdict(list)
-    self._response_sizes = defaultdict(lambda: 0)
-    self._response_encoded_sizes = defaultdict(lambda: 0)
+    # request records, keyed by request id
+    self._records = {}
 
     self.primary_page_id = 'page_1'
 
+    # event method -> handler, built once rather than for every event
+    self._handlers = {
+      'Network.requestWillBeSent': self.process_request_will_be_sent,
+      'Network.requestServedFromCache': self.process_request_served_from_cache,
+      'Network.responseReceived': self.process_response_received,
+      'Network.dataReceived': self.process_data_received,
+      'Network.loadingFinished': self.process_loading_finished,
+      'Network.requestServedFromMemoryCache': lambda m: None,
+      'Network.loadingFailed': lambda m: logging.info("Received loadingFailed message: \n{0}".format(m))
+    }
+
+    # number of events received for which there is no handler, keyed by method
+    self.unhandled_events = defaultdict(int)
+
+  def _record(self, message):
+    """
+    Returns the record of the request the message is about, or None if the request was sent before recording started
+    (only requestWillBeSent creates records, so a request without one is left out rather than given a bogus start time)
+    """
+    return self._records.get(message['params']['requestId'])
+
   # --------------
   # Initialization
   # --------------
@@ -81,40 +130,50 @@ class NetworkEventHandler(object):
 
   def get_first_request_time(self):
     """Returns the time, in seconds, when the first resource request is initiated."""
-    return min(self._request_start_times.values())
+    return min(record.start_time for record in self._records.itervalues())
 
   # -----------------------------
   # HAR Resource Entry Generation
   # -----------------------------
 
-  def _total_resource_time(self, req_id):
-    """Returns the total time taken for the request corresponding to the given request ID"""
-    timings = self._resource_timings[req_id]
-    timing_values = timings.values()
-    non_zero_timings = filter(lambda x: x> 0, timing_values)
+  def _total_resource_time(self, record):
+    """Returns the total time taken for the request corresponding to the given record"""
+    non_zero_timings = filter(lambda x: x> 0, record.timings.values())
     return int(sum(non_zero_timings))
 
-  def _make_entry(self, req_id):
-    """Creates the HAR resource entry corresponding to the given request ID"""
+  def _make_entry(self, record):
+    """Creates the HAR resource entry corresponding to the given request record"""
+    request = self._default_request_value()
+    request['method'] = record.method
+    request['url'] = record.url
+    request['headers'] = record.request_headers or []
+
+    response = self._default_response_value()
+    response['status'] = record.status
+    response['statusText'] = record.status_text
+    response['headers'] = record.response_headers or []
+    response['bodySize'] = record.body_size
+    response['content']['size'] = record.body_size
+    response['content']['compression'] = record.compression
 
     return {
       'pageref': self.primary_page_id,
-      'startedDateTime': format_time(self._request_start_times[req_id]),
-      'time': self._total_resource_time(req_id),
-      'request': self._requests[req_id],
-      'response': self._responses[req_id],
-      'cache': self._caches[req_id],
-      'timings': self._resource_timings[req_id],
-      'serverIPAddress': self._server_ips[req_id],
-      'connection': self._connection_ids[req_id]
+      'startedDateTime': format_time(record.start_time),
+      'time': self._total_resource_time(record),
+      'request': request,
+      'response': response,
+      'cache': self._default_cache_value(),
+      'timings': record.timings,
+      'serverIPAddress': '_',
+      'connection': '_'
     }
 
   def make_entry_list(self):
     """
     Makes a list of HAR-formatted "entries", which correspond to resources requested by the page
     """
-    request_ids_sorted_by_time = sorted(self._request_start_times, key=self._request_start_times.get)
-    return [self._make_entry(req_id) for req_id in request_ids_sorted_by_time]
+    records_sorted_by_time = sorted(self._records.itervalues(), key=lambda record: record.start_time)
+    return [self._make_entry(record) for record in records_sorted_by_time]
 
 
   # --------------
@@ -122,20 +181,11 @@ class NetworkEventHandler(object):
   # --------------
 
   def process_event(self, message):
-
-    # the 'method' field of the message object will have the format X.Y, where X is the domain and Y is the command
-    # e.g. 'Runtime.evaluate', 'Page.navigate', etc.
-    message_type = message['method'].split('.')[1]
-
-    {
-      'requestWillBeSent': self.process_request_will_be_sent,
-      'requestServedFromCache': self.process_request_served_from_cache,
-      'responseReceived': self.process_response_received,
-      'dataReceived': self.process_data_received,
-      'loadingFinished': self.process_loading_finished,
-      'requestServedFromMemoryCache': lambda m: None,
-      'loadingFailed': lambda m: logging.info("Received loadingFailed message: \n{0}".format(m))
-    }[message_type](message)
+    handler = self._handlers.get(message['method'])
+    if handler:
+      handler(message)
+    else:
+      self.unhandled_events[message['method']] += 1
 
   def parse_msg(self, msg):
     """Transforms json message into a tuple (params, request_id, frame_id, timestamp)"""
@@ -143,84 +193,74 @@ class NetworkEventHandler(object):
 
   def process_request_will_be_sent(self, message):
     (params, request_id, frame_id, timestamp) = self.parse_msg(message)
+    record = self._records.get(request_id)
+    if record is None:
+      record = self._records[request_id] = RequestRecord(self._default_resource_timing_value())
 
-    headers = [{'name': key, 'value' : value} for key, value in params['request']['headers'].iteritems()]
-    self._requests[request_id]['headers'] = headers
-    self._requests[request_id]['method'] = params['request']['method']
-
-    self._requests[request_id]['url'] = params['request']['url']
+    record.request_headers = [{'name': key, 'value' : value} for key, value in params['request']['headers'].iteritems()]
+    record.method = params['request']['method']
+    record.url = params['request']['url']
 
     # we do this just in case the ResponseReceived event does not include timings (e.g. about:blank)
-    self._request_start_times[request_id] = params['timestamp']
+    record.start_time = params['timestamp']
 
   def process_request_served_from_cache(self, message):
     logging.info('Received request served from cache message: \n{0}'.format(message))
 
   def process_response_received(self, message):
-    (params, request_id, frame_id, timestamp) = self.parse_msg(message)
-
-    self._responses[request_id]['status'] = params['response']['status']
-    self._responses[request_id]['statusText'] = params['response']['statusText']
-    self._responses[request_id]['headersSize'] = -1
+    record = self._record(message)
+    if record is None:
+      return
+    params = message['params']
 
-    headers = [{'name': key, 'value': value} for key, value in params['response']['headers'].iteritems()]
-    self._responses[request_id]['headers'] = headers
+    record.status = params['response']['status']
+    record.status_text = params['response']['statusText']
+    record.response_headers = [{'name': key, 'value': value} for key, value in params['response']['headers'].iteritems()]
 
     # timings are not included for about: url's
-    if not self._requests[request_id]['url'].startswith('about:'):
+    if not record.url.startswith('about:'):
       if not 'timing' in params['response']:
-        log.info('No timing information in message')
+        logging.info('No timing information in message')
         return
       
       provided_timings = params['response']['timing']
 
-      self._request_start_times[request_id] = provided_timings['requestTime']
+      record.start_time = provided_timings['requestTime']
 
-      self._resource_timings[request_id]['blocked'] = max(provided_timings['dnsStart'], 0)
-
-      self._resource_timings[request_id]['dns'] = \
-        self.calc_timing(provided_timings['dnsStart'], provided_timings['dnsEnd'])
-
-      self._resource_timings[request_id]['connect'] = \
-        self.calc_timing(provided_timings['connectStart'], provided_timings['connectEnd'])
-
-      self._resource_timings[request_id]['send'] = \
-        self.calc_timing(provided_timings['sendStart'], provided_timings['sendEnd'])
+      record.timings['blocked'] = max(provided_timings['dnsStart'], 0)
+      record.timings['dns'] = self.calc_timing(provided_timings['dnsStart'], provided_timings['dnsEnd'])
+      record.timings['connect'] = self.calc_timing(provided_timings['connectStart'], provided_timings['connectEnd'])
+      record.timings['send'] = self.calc_timing(provided_timings['sendStart'], provided_timings['sendEnd'])
 
 
   def process_data_received(self, message):
-    self._data_packet_notifications[message['params']['requestId']].append(message['params'])
+    record = self._record(message)
+    if record is not None:
+      params = message['params']
+      record.add_data_packet(params['timestamp'], params['dataLength'], params['encodedDataLength'])
 
   def process_loading_finished(self, message):
-    request_id = message['params']['requestId']
-    self._data_packet_notifications[request_id].sort(key = lambda x: x['timestamp'])
+    record = self._record(message)
+    if record is None:
+      return
+    timings = record.timings
 
-    send_end = self._request_start_times[request_id] * 1000 + max(self._resource_timings[request_id]['blocked'], 0) \
-                                                            + max(self._resource_timings[request_id]['dns'], 0)     \
-                                                            + max(self._resource_timings[request_id]['connect'], 0) \
-                                                            + max(self._resource_timings[request_id]['send'], 0)
+    send_end = record.start_time * 1000 + max(timings['blocked'], 0) \
+                                        + max(timings['dns'], 0)     \
+                                        + max(timings['connect'], 0) \
+                                        + max(timings['send'], 0)
 
     # don't bother recording timing/size info for 'about:XXXX' url's
-    if not self._requests[request_id]['url'].startswith('about:'):
-      data_packet_infos = self._data_packet_notifications[request_id]
-
-      if len(data_packet_infos):
-        first_data_timestamp = self._data_packet_notifications[request_id][0]['timestamp']
-        last_data_timestamp = self._data_packet_notifications[request_id][-1]['timestamp']
-        self._resource_timings[request_id]['wait'] = int(first_data_timestamp * 1000 - send_end)
-        self._resource_timings[request_id]['receive'] = int(last_data_timestamp * 1000 - first_data_timestamp * 1000)
+    if not record.url.startswith('about:'):
+      if record.first_data_time is not None:
+        timings['wait'] = int(record.first_data_time * 1000 - send_end)
+        timings['receive'] = int(record.last_data_time * 1000 - record.first_data_time * 1000)
       else:
-        self._resource_timings[request_id]['wait'] = int(message['params']['timestamp'] * 1000 - send_end)
-        self._resource_timings[request_id]['receive'] = 0
-
-      for packet_info in data_packet_infos:
-        self._response_sizes[request_id] += packet_info['dataLength']
-        self._response_encoded_sizes[request_id] += packet_info['encodedDataLength']
+        timings['wait'] = int(message['params']['timestamp'] * 1000 - send_end)
+        timings['receive'] = 0
 
-      self._responses[request_id]['bodySize'] = self._response_sizes[request_id]
-      self._responses[request_id]['content']['size'] = self._response_sizes[request_id]
-      self._responses[request_id]['content']['compression'] = self._response_sizes[request_id] - \
-                                                              self._response_encoded_sizes[request_id]
+      record.body_size = record.data_length
+      record.compression = record.data_length - record.encoded_data_length
 
 
 
@@ -1,26 +1,64 @@
+from collections import defaultdict
 import logging
+import threading
 import time
-import sys
+
+from linkedin.mobster.mobsterconfig import config
 
 class PageEventHandler(object):
   def __init__(self):
     self.page_loaded = False
 
+    # event method -> handler
+    self._handlers = {
+      'Page.loadEventFired': self.process_load_event_fired
+    }
+
+    # number of events received for which there is no handler, keyed by method
+    self.unhandled_events = defaultdict(int)
+
   def process_event(self, message):
-    if message['method'] == 'Page.loadEventFired':
-      logging.info('Page.loadEventFired recorded')
-      self.page_loaded = True
+    handler = self._handlers.get(message['method'])
+    if handler:
+      handler(message)
+    else:
+      self.unhandled_events[message['method']] += 1
+
+  def process_load_event_fired(self, message):
+    logging.info('Page.loadEventFired recorded')
+    self.page_loaded = True
 
 
 class PageLoadNotifier(object):
-  def __init__(self, wait_for_page_load_event, network_event_timeout=3):
+  """
+  Decides when a page has finished loading: once the page load event has fired (if wait_for_page_load_event is true),
+  every request the page made has finished, and no network event has been received for the last grace_period seconds
+  (which catches requests made by load event handlers). Requests whose end is never reported (e.g. long polling)
+  would keep the page from ever being loaded, so it is also considered loaded once no network event has been received
+  for network_event_timeout seconds, as long as the load event has fired.
+
+  Events are processed on the communicator's thread, and wait_until_loaded() wakes up as soon as the page is loaded.
+  """
+  def __init__(self, wait_for_page_load_event, network_event_timeout=3, grace_period=None):
     self._received_page_load_event = False
     self._network_event_timeout = network_event_timeout
+    self._grace_period = config['NETWORK_QUIET_GRACE_PERIOD'] if grace_period is None else grace_period
     self._wait_for_page_load_event = wait_for_page_load_event
 
-    # set the last network event time to be super large initially, since it needs to not be considerably smaller
-    # than the current time, or we will prematurely report a page load
-    self._last_network_event_time = sys.maxint
+    # ids of the requests which have been sent but have not finished, failed or been served from the cache
+    self._in_flight_requests = set()
+
+    # the network only counts as quiet from the first network event (or the page load event) on, so that nothing is
+    # decided before the navigation has even started
+    self._last_network_event_time = None
+
+    self._condition = threading.Condition()
+    self._handlers = {
+      'Network.requestWillBeSent': self._in_flight_requests.add,
+      'Network.loadingFinished': self._in_flight_requests.discard,
+      'Network.loadingFailed': self._in_flight_requests.discard,
+      'Network.requestServedFromCache': self._in_flight_requests.discard
+    }
 
   def process_timeline_event(self, message):
     pass
@@ -28,20 +66,61 @@ class PageLoadNotifier(object):
   def process_page_event(self, message):
     if message['method'] == 'Page.loadEventFired':
       logging.info('Page.loadEventFired recorded')
-      self._received_page_load_event = True
-
+      with self._condition:
+        self._received_page_load_event = True
+        self._last_network_event_time = self._last_network_event_time or message.get('_arrivalTime', time.time())
+        self._condition.notify_all()
 
   def process_network_event(self, message):
-    self._last_network_event_time = time.time()
+    with self._condition:
+      # until the first network event, a waiter has no decision time to wake up at, so it must be woken up now
+      first_event = self._last_network_event_time is None
 
-  def page_loaded(self):
+      # events can be handled a while after they arrive, and it is when they arrive that tells whether the network is
+      # quiet
+      self._last_network_event_time = message.get('_arrivalTime', time.time())
+      handler = self._handlers.get(message['method'])
+      if handler:
+        handler(message['params']['requestId'])
+      if first_event or (handler and not self._in_flight_requests):
+        self._condition.notify_all()
+
+  @property
+  def in_flight_requests(self):
+    return len(self._in_flight_requests)
+
+  def _next_decision_time(self):
     """
-    Returns true if we have decided that the page is "loaded", false otherwise. If wait_for_page_load_event is true,
-    the page is "loaded" when we
+    Returns the time at which the page will be loaded if no more network events are received, or None if it takes
+    another event first (the page load event, or the first network event). Must be called while holding the
+    condition's lock.
     """
-    curr_time = time.time()
-    if curr_time - self._last_network_event_time > self._network_event_timeout:
-      if not self._wait_for_page_load_event or self._received_page_load_event:
-        return True
+    if self._wait_for_page_load_event and not self._received_page_load_event:
+      return None
+    if self._last_network_event_time is None:
+      return None
+    if self._in_flight_requests:
+      return self._last_network_event_time + self._network_event_timeout
+    return self._last_network_event_time + min(self._grace_period, self._network_event_timeout)
+
+  def page_loaded(self):
+    """Returns true if we have decided that the page is "loaded", false otherwise"""
+    with self._condition:
+      decision_time = self._next_decision_time()
+      return decision_time is not None and time.time() >= decision_time
+
+  def wait_until_loaded(self, timeout=120):
+    """Blocks until the page is loaded, raising an exception if it is not loaded within timeout seconds"""
+    deadline = time.time() + timeout
+    with self._condition:
+      while True:
+        now = time.time()
+        decision_time = self._next_decision_time()
+        if decision_time is not None and now >= decision_time:
+          return
+        if now >= deadline:
+          raise Exception('page load timeout of {0}s reached with {1} requests in flight'.format(
+            timeout, len(self._in_flight_requests)))
 
-    return False
+        # wake up when the page could be loaded if nothing else happens, or earlier if notified of an event
+        self._condition.wait(min(decision_time or deadline, deadline) - now)
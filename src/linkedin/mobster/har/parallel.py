@@ -0,0 +1,113 @@
+import logging
+from Queue import Empty, Queue
+import threading
+
+from linkedin.mobster.har.flowprofiler import FlowProfiler
+from linkedin.mobster.webkitcommunicator import RemoteWebKitCommunicator
+
+def make_communicator(target, use_async=False):
+  """
+  Returns a connected communicator for the given target. Asynchronous communicators all share one event loop thread,
+  instead of using a reader and a sender thread per connection.
+  """
+  if use_async:
+    from linkedin.mobster.asynccommunicator import AsyncWebKitCommunicator
+    return AsyncWebKitCommunicator(ws_url=target.ws_url).start()
+  else:
+    return RemoteWebKitCommunicator(ws_url=target.ws_url)
+
+
+def profile_targets(test_file, targets, iterations=1, use_async=False, target_ci=None, css_index=None):
+  """
+  Runs the flow in test_file against every target concurrently, with one worker per target. Returns a list of
+  (target, iteration_hars) tuples in the order of targets, where iteration_hars is the result of FlowProfiler.profile()
+  for that target, or None if profiling the target failed. target_ci is passed on to each FlowProfiler, so each target
+  stops once its own onLoad times are precise enough. If css_index is given, the CSS selector profiles of all the
+  targets are added to it.
+  """
+  results = [None] * len(targets)
+
+  def worker(index, target):
+    profiler = None
+    try:
+      profiler = FlowProfiler(test_file, iterations, make_communicator(target, use_async), target, target_ci,
+                              css_index=css_index)
+      results[index] = profiler.profile()
+    except Exception:
+      logging.exception('Profiling failed for target {0}'.format(target.name))
+    finally:
+      if profiler:
+        profiler.stop()
+
+  threads = [threading.Thread(target=worker, args=(i, target), name='mobster-{0}'.format(target.name))
+             for i, target in enumerate(targets)]
+  for thread in threads:
+    thread.setDaemon(True)
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  return zip(targets, results)
+
+
+def one_target_per_device(targets):
+  """Returns the first of the targets of each device"""
+  devices = set()
+  chosen = []
+  for target in targets:
+    if target.device not in devices:
+      devices.add(target.device)
+      chosen.append(target)
+  return chosen
+
+
+def profile_iterations(test_file, targets, iterations, use_async=False, css_index=None):
+  """
+  Runs the iterations of the flow in test_file in parallel, spreading them over the given targets (pre-opened tabs or
+  devices). Each target runs one iteration at a time, and every iteration starts by resetting the browser state just
+  like FlowProfiler.profile() does. Returns the HARs in the same format as FlowProfiler.profile(), in iteration order,
+  so the results can be merged as usual. Iterations which failed or were never run (e.g. because every target failed)
+  are left out, and how many are missing is logged as an error.
+
+  Only one target of each device is used: tabs of the same browser compete for the device's resources, and share its
+  cache and cookies, which every iteration resets, so iterations only run in parallel across devices.
+
+  If css_index is given, the CSS selector profiles of all the iterations are added to it.
+  """
+  targets = one_target_per_device(targets)
+
+  pending = Queue()
+  for iteration in range(iterations):
+    pending.put(iteration)
+
+  results = [None] * iterations
+
+  def worker(target):
+    profiler = None
+    try:
+      # iterations are not tagged with the target which happened to run them, so they can be merged together
+      profiler = FlowProfiler(test_file, 1, make_communicator(target, use_async), css_index=css_index)
+      while True:
+        try:
+          iteration = pending.get_nowait()
+        except Empty:
+          break
+        results[iteration] = profiler.profile_iteration()
+    except Exception:
+      logging.exception('Profiling failed for target {0}'.format(target.name))
+    finally:
+      if profiler:
+        profiler.stop()
+
+  threads = [threading.Thread(target=worker, args=(target,), name='mobster-{0}'.format(target.name))
+             for target in targets]
+  for thread in threads:
+    thread.setDaemon(True)
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  completed = [hars for hars in results if hars is not None]
+  if len(completed) < iterations:
+    logging.error('{0} of {1} iterations failed or were not run'.format(iterations - len(completed), iterations))
+  return completed
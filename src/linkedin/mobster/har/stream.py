@@ -0,0 +1,93 @@
+import json
+
+READ_SIZE = 64 * 1024
+
+class HarStreamWriter(object):
+  """
+  Writes HAR files to a file handle one at a time, as soon as they are made, so that the results of a run never need
+  to be held in memory all at once. The output is either a JSON array of HARs (the format mobster has always written)
+  or JSON lines, i.e. one HAR per line.
+  """
+
+  def __init__(self, file_handle, json_lines=False):
+    self._file_handle = file_handle
+    self._json_lines = json_lines
+    self._count = 0
+    self._closed = False
+
+  def write(self, har):
+    if self._json_lines:
+      self._file_handle.write(json.dumps(har))
+      self._file_handle.write('\n')
+    else:
+      self._file_handle.write(',' if self._count else '[')
+      self._file_handle.write(json.dumps(har))
+    self._file_handle.flush()
+    self._count += 1
+
+  def close(self):
+    """Finishes the output. Does not close the underlying file handle."""
+    if self._closed:
+      return
+
+    if not self._json_lines:
+      self._file_handle.write(']' if self._count else '[]')
+    self._file_handle.flush()
+    self._closed = True
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+def iter_hars(file_handle):
+  """
+  Yields the HARs in the given file one at a time, without reading the whole file into memory. Accepts a JSON array
+  of HARs, JSON lines or a single HAR object.
+  """
+  decoder = json.JSONDecoder()
+  buf = ''
+  pos = 0
+  eof = False
+  in_array = None
+
+  while True:
+    # skip whitespace and the separators between array elements
+    while pos < len(buf) and buf[pos] in ' \t\r\n,':
+      pos += 1
+
+    if pos == len(buf):
+      if eof:
+        break
+      buf, pos = file_handle.read(READ_SIZE), 0
+      eof = not buf
+      continue
+
+    if in_array is None:
+      in_array = buf[pos] == '['
+      if in_array:
+        pos += 1
+        continue
+
+    if in_array and buf[pos] == ']':
+      break
+
+    try:
+      har, end = decoder.raw_decode(buf, pos)
+    except ValueError:
+      if eof:
+        raise
+
+      # the next HAR is not complete yet. Read at least as much again as is buffered, so that large HARs are only
+      # re-parsed a logarithmic number of times
+      buf = buf[pos:]
+      pos = 0
+      more = file_handle.read(max(READ_SIZE, len(buf)))
+      eof = not more
+      buf += more
+      continue
+
+    yield har
+    pos = end
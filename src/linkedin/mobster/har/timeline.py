@@ -1,73 +1,236 @@
+from array import array
+from collections import defaultdict
 import logging
 
-from linkedin.mobster.utils import running_avg
+from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.utils import StatsAccumulator
 
 timeline_event_blacklist = ['Program']
 
+# _eventStats field -> timeline record type whose count it holds
+counted_record_types = {
+  '_gcEvents': 'GCEvent',
+  '_paints': 'Paint',
+  '_styleRecalculates': 'RecalculateStyles'
+}
+
+# positions of the fields of the per record type statistics
+COUNT, TOTAL_TIME, SELF_TIME = range(3)
+
+class HeapTimeSeries(object):
+  """
+  A series of (timestamp, used heap size, total heap size) samples which never holds more than a fixed number of
+  samples. Once it is full, it is downsampled in place to half its size by keeping, out of every four consecutive
+  samples, the ones with the smallest and largest used heap size, so spikes and the garbage collections which follow
+  them are kept however long the series runs. From then on incoming samples are reduced the same way before they are
+  stored, so that every stored sample stands for the same number of recorded ones.
+  """
+  FIELDS = 3
+
+  def __init__(self, capacity):
+    assert capacity >= 4 and capacity % 4 == 0, 'capacity must be a positive multiple of 4'
+    self.capacity = capacity
+
+    # flat array of timestamp, used heap size, total heap size, timestamp, ...
+    self._samples = array('d')
+
+    # number of recorded samples which each stored sample stands for
+    self.stride = 1
+
+    # samples are reduced to the smallest and largest used heap sample of every 2 * stride of them before being stored
+    self._pending_count = 0
+    self._pending_min = None
+    self._pending_max = None
+
+  def __len__(self):
+    pending = 0 if not self._pending_count else 1 if self._pending_min is self._pending_max else 2
+    return len(self._samples) / self.FIELDS + pending
+
+  def add(self, timestamp, used_heap_size, total_heap_size):
+    sample = (timestamp, used_heap_size, total_heap_size)
+    if not self._pending_count:
+      self._pending_min = self._pending_max = sample
+    elif used_heap_size < self._pending_min[1]:
+      self._pending_min = sample
+    elif used_heap_size >= self._pending_max[1]:
+      self._pending_max = sample
+    self._pending_count += 1
+
+    if self._pending_count == 2 * self.stride:
+      self._samples.extend(self._pending_samples())
+      self._pending_count = 0
+      if len(self._samples) >= self.capacity * self.FIELDS:
+        self._downsample()
+
+  def _pending_samples(self):
+    """Returns the values of the pending samples to store, in time order"""
+    if not self._pending_count:
+      return ()
+    if self._pending_min is self._pending_max:
+      return self._pending_min
+    if self._pending_min[0] <= self._pending_max[0]:
+      return self._pending_min + self._pending_max
+    return self._pending_max + self._pending_min
+
+  def _downsample(self):
+    samples = self._samples
+    fields = self.FIELDS
+    downsampled = array('d')
+    for start in xrange(0, len(samples), 4 * fields):
+      group = xrange(start, min(start + 4 * fields, len(samples)), fields)
+      low = min(group, key=lambda i: samples[i + 1])
+      high = max(group, key=lambda i: samples[i + 1])
+      for i in sorted(set([low, high])):
+        downsampled.extend(samples[i:i + fields])
+
+    self._samples = downsampled
+    self.stride *= 2
+
+  def get_series(self):
+    """
+    Returns the series in the compact form stored in the HAR file: the time of the first sample, and parallel lists of
+    the times of every sample (in ms relative to the first one), and of the used and total heap sizes
+    """
+    samples = self._samples + array('d', self._pending_samples())
+    times = samples[0::self.FIELDS]
+    start_time = times[0] if times else -1
+    return {
+      'startTime': start_time,
+      'samplesPerPoint': self.stride,
+      'times': [round(t - start_time, 1) for t in times],
+      'usedHeapSize': [int(size) for size in samples[1::self.FIELDS]],
+      'totalHeapSize': [int(size) for size in samples[2::self.FIELDS]]
+    }
+
+
 class TimelineEventHandler(object):
   def __init__(self):
     self.used_heap_init  = None
-    self.used_heap_max  = -1
-    self.used_heap_avg = -1
+    self.total_heap_init = None
+    self.total_heap_max = -1
     self.max_documents = -1
     self.max_js_event_listeners = -1
     self.max_nodes = -1
-    self.style_recalculates = 0
-    self.paints = 0
-    self.gc_events = 0
 
-    self._used_heap_avg_calc = running_avg()
+    self.used_heap_stats = StatsAccumulator()
+    self.heap_time_series = HeapTimeSeries(config['HEAP_TIME_SERIES_CAPACITY'])
+
+    # record type -> [count, total time, self time], where self time excludes the time spent in child records.
+    # Times are in milliseconds
+    self._type_stats = {}
+
+    # event method -> handler
+    self._handlers = {
+      'Timeline.eventRecorded': self.process_event_recorded
+    }
+
+    # number of events received for which there is no handler, keyed by method
+    self.unhandled_events = defaultdict(int)
+
+  @property
+  def used_heap_max(self):
+    return self.used_heap_stats.max if self.used_heap_stats.count else -1
+
+  @property
+  def used_heap_avg(self):
+    return self.used_heap_stats.mean if self.used_heap_stats.count else -1
+
+  @property
+  def used_heap_p90(self):
+    return self.used_heap_stats.quantile(0.9) if self.used_heap_stats.count else -1
 
   def get_memory_stats(self):
     return {
+      '_initialTotalHeapSize': self.total_heap_init,
+      '_maxTotalHeapSize': self.total_heap_max,
+
       '_initialUsedHeapSize': self.used_heap_init,
       '_maxUsedHeapSize': self.used_heap_max,
       '_avgUsedHeapSize': self.used_heap_avg,
+      '_p90UsedHeapSize': self.used_heap_p90,
 
       '_maxDocuments': self.max_documents,
       '_maxJsEventListeners': self.max_js_event_listeners,
-      '_maxNodes': self.max_nodes
+      '_maxNodes': self.max_nodes,
+
+      '_heapTimeSeries': self.heap_time_series.get_series()
     }
 
   def get_event_stats(self):
     """
-    Contains counts of specific timeline events
+    Contains counts of specific timeline events, and the number of records, total time and self time (i.e. excluding
+    child records) of every type of timeline record, e.g. Layout, EvaluateScript or Paint
     """
-    return {
-      '_paints': self.paints,
-      '_styleRecalculates': self.style_recalculates,
-      '_gcEvents': self.gc_events
-    }
+    event_stats = dict((field, self._type_stats[record_type][COUNT] if record_type in self._type_stats else 0)
+                       for field, record_type in counted_record_types.iteritems())
+
+    event_stats['_recordTypes'] = dict((record_type, {
+      'count': stats[COUNT],
+      'totalTime': stats[TOTAL_TIME],
+      'selfTime': stats[SELF_TIME]
+    }) for record_type, stats in self._type_stats.iteritems())
+
+    return event_stats
 
   def process_event(self, message):
-    def helper(record):
+    handler = self._handlers.get(message['method'])
+    if handler:
+      handler(message)
+    else:
+      self.unhandled_events[message['method']] += 1
+
+  def process_event_recorded(self, message):
+    type_stats = self._type_stats
+
+    # records can be nested very deeply, so walk the tree with an explicit stack rather than recursion. Children are
+    # pushed in reverse, so records are still visited in the order they happened
+    stack = [message['params']['record']]
+    while stack:
+      record = stack.pop()
+      record_type = record['type']
+      children = record.get('children')
+      if children:
+        stack.extend(children[::-1])
+
       # don't examine events which are in the blacklist (but we still examine their children)
-      if record['type'] not in timeline_event_blacklist:
-        try:
-          self.used_heap_init = self.used_heap_init or record['usedHeapSize']
-          self._used_heap_avg_calc.next()
-          self.used_heap_avg = self._used_heap_avg_calc.send(record['usedHeapSize'])
-
-          self.used_heap_max = max(self.used_heap_max, record['usedHeapSize'])
-
-          # The following statments keep track of metrics only available in Chrome 19+. Android Chrome is currently
-          # at version 18, so we will not enable these until it is updated.
-
-          #self.max_documents = max(self.max_documents, record['counters']['documents'])
-          #self.max_js_event_listeners = max(self.max_js_event_listeners, record['counters']['jsEventListeners'])
-          #self.max_nodes = max(self.max_nodes, record['counters']['nodes'])
-        except KeyError, e:
-          logging.warning('Could not find key {0} in response'.format(e.message))
-
-        if record['type'] == 'GCEvent':
-          self.gc_events += 1
-        elif record['type'] == 'Paint':
-          self.paints += 1
-        elif record['type'] == 'RecalculateStyles':
-          self.style_recalculates += 1
-
-      if 'children' in record:
-        for child in record['children']:
-          helper(child)
-
-    helper(message['params']['record'])
+      if record_type in timeline_event_blacklist:
+        continue
+
+      try:
+        used_heap_size = record['usedHeapSize']
+        self.used_heap_init = self.used_heap_init or used_heap_size
+        self.used_heap_stats.add(used_heap_size)
+
+        # not every record which has the used heap size has the total heap size as well
+        total_heap_size = record.get('totalHeapSize')
+        if total_heap_size is not None:
+          self.total_heap_init = self.total_heap_init or total_heap_size
+          if total_heap_size > self.total_heap_max:
+            self.total_heap_max = total_heap_size
+          self.heap_time_series.add(record['startTime'], used_heap_size, total_heap_size)
+
+        # The following statments keep track of metrics only available in Chrome 19+. Android Chrome is currently
+        # at version 18, so we will not enable these until it is updated.
+
+        #self.max_documents = max(self.max_documents, record['counters']['documents'])
+        #self.max_js_event_listeners = max(self.max_js_event_listeners, record['counters']['jsEventListeners'])
+        #self.max_nodes = max(self.max_nodes, record['counters']['nodes'])
+      except KeyError, e:
+        logging.warning('Could not find key {0} in response'.format(e.message))
+
+      # instantaneous records (e.g. TimeStamp) have no end time
+      duration = record['endTime'] - record['startTime'] if 'endTime' in record else 0
+      self_time = duration
+      if children:
+        for child in children:
+          if 'endTime' in child:
+            self_time -= child['endTime'] - child['startTime']
+
+      try:
+        stats = type_stats[record_type]
+      except KeyError:
+        stats = type_stats[record_type] = [0, 0.0, 0.0]
+      stats[COUNT] += 1
+      stats[TOTAL_TIME] += duration
+      if self_time > 0:
+        stats[SELF_TIME] += self_time
@@ -0,0 +1,79 @@
+// Line chart of the used and total JS heap size of every page over the course of its load, drawn from the heap time
+// series in the _memoryStats of each HAR file. Each page gets its own canvas.
+var HeapTimeSeriesChart = Class.extend({
+    init: function(containerId, harFiles) {
+        this.height = 160
+        this.margin = 60
+        this.usedColor = Graphics.getRGB(100,105,180)
+        this.totalColor = Graphics.getRGB(205,201,201)
+        this.numCharts = 0
+
+        for (var i in harFiles) {
+            var memoryStats = harFiles[i].log.pages[0]._memoryStats
+            var series = memoryStats && memoryStats._heapTimeSeries
+            if (series && series.times.length > 1) {
+                this.drawChart(containerId, harFiles[i], series, i)
+                this.numCharts++
+            }
+        }
+    },
+
+    drawChart: function(containerId, harFile, series, index) {
+        var width = Math.max(500, $(window).width() - 30)
+        var label = $("<div/>").text(BasicHARInfoTable.prototype.getPageKey(harFile))
+        var canvas = $("<canvas/>").attr("width", width).attr("height", this.height)
+                                   .attr("id", containerId + "-canvas-" + index)
+        $("#" + containerId).append(label).append(canvas)
+
+        var stage = new Stage(canvas[0])
+        var duration = series.times[series.times.length - 1]
+        var maxSize = Math.max.apply(null, series.totalHeapSize.concat(series.usedHeapSize))
+        var plotWidth = width - 2 * this.margin
+        var plotHeight = this.height - 20
+
+        var margin = this.margin
+        var toX = function(time) {
+            return margin + (duration > 0 ? time / duration * plotWidth : 0)
+        }
+        var toY = function(size) {
+            return plotHeight - (maxSize > 0 ? size / maxSize * (plotHeight - 10) : 0)
+        }
+
+        var axes = new Shape()
+        axes.graphics.setStrokeStyle(1)
+                     .beginStroke(Graphics.getRGB(0,0,0))
+                     .moveTo(this.margin, 0)
+                     .lineTo(this.margin, plotHeight)
+                     .lineTo(this.margin + plotWidth, plotHeight)
+        stage.addChild(axes)
+
+        stage.addChild(this.makeLine(series.times, series.totalHeapSize, toX, toY, this.totalColor))
+        stage.addChild(this.makeLine(series.times, series.usedHeapSize, toX, toY, this.usedColor))
+
+        stage.addChild(this.makeLabel(formatAsSizeStr(maxSize), 2, toY(maxSize), "left"))
+        stage.addChild(this.makeLabel("0ms", this.margin, plotHeight + 10, "left"))
+        stage.addChild(this.makeLabel(Math.round(duration) + "ms", this.margin + plotWidth, plotHeight + 10, "right"))
+
+        stage.update()
+    },
+
+    makeLine: function(times, sizes, toX, toY, rgbColor) {
+        var line = new Shape()
+        line.graphics.setStrokeStyle(2)
+                     .beginStroke(rgbColor)
+                     .moveTo(toX(times[0]), toY(sizes[0]))
+        for (var i = 1; i < times.length; i++) {
+            line.graphics.lineTo(toX(times[i]), toY(sizes[i]))
+        }
+        return line
+    },
+
+    makeLabel: function(text, x, y, textAlign) {
+        var label = new Text(text, "12px Courier", "#000")
+        label.textAlign = textAlign
+        label.textBaseline = "middle"
+        label.x = x
+        label.y = y
+        return label
+    }
+})
@@ -1,3 +1,6 @@
+// Shown in place of values whose collector was not used for the page (see the --collect option)
+var notCollected = "N/A"
+
 // Info table superclass - provides a way to define columns and functions to calculate column values
 var BasicHARInfoTable = Class.extend({
     init: function(elementId, harFiles, fields) {
@@ -40,6 +43,9 @@ var BasicHARInfoTable = Class.extend({
         if(name.length > 15) {
             name = name.substr(0, 15) + "..."
         }
+        if (harFile["log"]["_target"]) {
+            name = harFile["log"]["_target"] + " " + name
+        }
         return name
     }
 })
@@ -130,7 +136,8 @@ var PageTimingTable = PageLinkedInfoTable.extend({
     },
 
     getCSSTotalTime: function(harFile) {
-        return harFile["log"]["pages"][0]["_cssStats"]["_totalTime"]
+        var cssStats = harFile["log"]["pages"][0]["_cssStats"]
+        return cssStats ? cssStats["_totalTime"] : notCollected
     },
 
     getOnContentLoad: function(harFile) {
@@ -154,11 +161,13 @@ var PageMetricsTable = PageLinkedInfoTable.extend({
     },
 
     getStyleRecalculates: function(harFile) {
-        return harFile["log"]["pages"][0]["_eventStats"]["_styleRecalculates"]
+        var eventStats = harFile["log"]["pages"][0]["_eventStats"]
+        return eventStats ? eventStats["_styleRecalculates"] : notCollected
     },
 
     getPaints: function(harFile) {
-        return harFile["log"]["pages"][0]["_eventStats"]["_paints"]
+        var eventStats = harFile["log"]["pages"][0]["_eventStats"]
+        return eventStats ? eventStats["_paints"] : notCollected
     },
 
     getTotalPageWeight: function(harFile) {
@@ -185,15 +194,20 @@ var MemoryMetricsTable = PageLinkedInfoTable.extend({
     },
 
     getMaxUsedHeap: function(harFile) {
-        return formatAsSizeStr(harFile.log.pages[0]._memoryStats._maxUsedHeapSize)
+        var memoryStats = harFile.log.pages[0]._memoryStats
+        return memoryStats && memoryStats._maxUsedHeapSize ? formatAsSizeStr(memoryStats._maxUsedHeapSize) : notCollected
     },
 
     getAvgUsedHeap: function(harFile) {
-        return formatAsSizeStr(harFile.log.pages[0]._memoryStats._avgUsedHeapSize)
+        var memoryStats = harFile.log.pages[0]._memoryStats
+        return memoryStats && memoryStats._avgUsedHeapSize ? formatAsSizeStr(memoryStats._avgUsedHeapSize) : notCollected
     },
 
     getNumNodes: function(harFile) {
         var nodeCountObj = harFile["log"]["pages"][0]["_domNodeStats"]
+        if (!nodeCountObj) {
+            return notCollected
+        }
         var total = 0
         for (i in nodeCountObj["domGroups"]) {
             total += nodeCountObj["domGroups"][i]["size"]
@@ -202,6 +216,53 @@ var MemoryMetricsTable = PageLinkedInfoTable.extend({
     },
 
     getGCEvents: function(harFile) {
-        return harFile["log"]["pages"][0]["_eventStats"]["_gcEvents"]
+        var eventStats = harFile["log"]["pages"][0]["_eventStats"]
+        return eventStats ? eventStats["_gcEvents"] : notCollected
+    }
+})
+
+// Lists the constructors whose objects kept growing from one iteration to the next, which points to memory leaks
+var HeapGrowthTable = BasicHARInfoTable.extend({
+    init: function(elementId, harFiles) {
+        var fields = {
+            "Page Key":                     this.getPageKeyOfRow,
+            "Constructor":                  this.getConstructorName,
+            "Objects per Iteration":        this.getCounts,
+            "Object Count Growth":          this.getCountGrowth,
+            "Size Growth":                  this.getSizeGrowth
+        }
+
+        // one row for every growing constructor of every page
+        var rows = []
+        for (var i in harFiles) {
+            var memoryStats = harFiles[i].log.pages[0]._memoryStats
+            var heapGrowth = memoryStats && memoryStats._heapGrowth
+            if (heapGrowth) {
+                for (var j in heapGrowth._growingConstructors) {
+                    rows.push({"harFile": harFiles[i], "growth": heapGrowth._growingConstructors[j]})
+                }
+            }
+        }
+        this._super(elementId, rows, fields)
+    },
+
+    getPageKeyOfRow: function(row) {
+        return BasicHARInfoTable.prototype.getPageKey(row.harFile)
+    },
+
+    getConstructorName: function(row) {
+        return row.growth.name
+    },
+
+    getCounts: function(row) {
+        return row.growth.counts.join(" / ")
+    },
+
+    getCountGrowth: function(row) {
+        return "+" + row.growth.countGrowth
+    },
+
+    getSizeGrowth: function(row) {
+        return "+" + formatAsSizeStr(row.growth.sizeGrowth)
     }
 })
@@ -1,8 +1,9 @@
-import json
 import os
 import re
+from StringIO import StringIO
 import urllib2
 
+from linkedin.mobster.har.stream import HarStreamWriter, iter_hars
 from linkedin.mobster.har.visualization.html import generate_html_dir
 from linkedin.mobster.har.visualization.js import generate_js_dir
 
@@ -18,15 +19,32 @@ def get_script_contents(script_name):
 
 
 def make_html(har_filename, debug=False):
+  output = StringIO()
+  write_html(har_filename, output, debug)
+  return output.getvalue()
+
+
+def write_html(har_filename, output_handle, debug=False):
+  """
+  Writes the HTML report for the given HAR file to output_handle. The HAR files are copied into the report one at a
+  time, so the whole HAR file is never held in memory.
+  """
+  template_contents = make_template(debug)
+  prefix, suffix = template_contents.split('{{ har_json }}', 1)
+
+  output_handle.write(prefix)
+
+  # we must paste a list of HAR files into the template, because that is what the JS expects
   with open(har_filename, 'r') as f:
-    file_json = json.loads(f.read())
+    with HarStreamWriter(output_handle) as writer:
+      for har in iter_hars(f):
+        writer.write(har)
 
-  if type(file_json) != type([]):
-    # we must paste a list of HAR files into the template, because that is what the JS expects
-    file_json = [file_json]
+  output_handle.write(suffix)
 
-  har_json_list = json.dumps(file_json)
 
+def make_template(debug=False):
+  """Returns the report template with all of its scripts inlined, so our output is standalone"""
   with open(os.sep.join([generate_html_dir(), TEMPLATE_NAME]), 'r') as template_handle:
     template_contents = template_handle.read()
 
@@ -47,5 +65,4 @@ def make_html(har_filename, debug=False):
       replacement = '<script>{0}</script>'.format(urllib2.urlopen(link).read())
       template_contents = re.sub(script_regex, replacement.replace("\\", "\\\\"), template_contents, 1)
 
-  # insert the har json into the template
-  return template_contents.replace('{{ har_json }}', har_json_list)
\ No newline at end of file
+  return template_contents
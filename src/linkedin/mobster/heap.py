@@ -0,0 +1,510 @@
+from array import array
+from collections import defaultdict
+from heapq import nlargest
+from itertools import izip
+import json
+
+# characters of a number array which are converted at a time, which bounds the size of the temporary lists created
+NUMBER_BLOCK_SIZE = 1024 * 1024
+
+# the snapshot's top-level arrays of numbers, which are decoded straight into typed arrays
+NUMBER_ARRAYS = ('nodes', 'edges')
+
+WHITESPACE = ' \t\r\n'
+
+class HeapSnapshotParser(object):
+  """
+  Incremental parser for the heap snapshots produced by Profiler.getProfile. Chunks of the serialized snapshot are
+  passed to feed() as they arrive, so it can be used as the sink of RemoteWebKitClient.get_heap_profile():
+
+    parser = HeapSnapshotParser()
+    client.get_heap_profile(parser.feed)
+    snapshot = parser.close()
+
+  The flat nodes and edges arrays, which make up most of a snapshot, are converted block by block into typed arrays
+  of machine integers rather than lists of Python objects, and the serialized snapshot is never held in memory as a
+  whole.
+  """
+
+  def __init__(self):
+    self._decoder = json.JSONDecoder()
+    self._chunks = []
+    self._buffered = 0
+
+    # number of characters to buffer before trying to parse again. Values which are decoded as a whole (e.g. the
+    # strings) are only retried once the buffer has doubled, so that they are not re-parsed for every chunk
+    self._wanted = 0
+
+    self._state = self._parse_start
+    self._key = None
+    self._values = {}
+    self._arrays = {}
+
+  def feed(self, chunk):
+    if isinstance(chunk, unicode):
+      chunk = chunk.encode('utf-8')
+    self._chunks.append(chunk)
+    self._buffered += len(chunk)
+    if self._buffered >= self._wanted:
+      self._parse()
+
+  def close(self):
+    """Finishes parsing and returns the HeapSnapshot"""
+    self._wanted = 0
+    if self._chunks:
+      self._parse()
+    if self._state is not None:
+      raise ValueError('Incomplete heap snapshot')
+
+    try:
+      meta = self._values['snapshot']['meta']
+      return HeapSnapshot(meta, self._arrays['nodes'], self._arrays['edges'], self._values['strings'])
+    except KeyError, e:
+      raise ValueError('Heap snapshot is missing {0}'.format(e.message))
+
+  def _parse(self):
+    buf = ''.join(self._chunks)
+    pos = 0
+    while self._state is not None:
+      next_pos = self._state(buf, pos)
+      if next_pos is None:
+        break
+      pos = next_pos
+
+    remaining = buf[pos:]
+    self._chunks = [remaining] if remaining else []
+    self._buffered = len(remaining)
+
+  def _skip(self, buf, pos, chars=WHITESPACE):
+    while pos < len(buf) and buf[pos] in chars:
+      pos += 1
+    return pos
+
+  # Each of the _parse_* states parses from pos and returns the position up to which it consumed the buffer, or None
+  # if more data is needed
+
+  def _parse_start(self, buf, pos):
+    pos = self._skip(buf, pos)
+    if pos == len(buf):
+      return None
+    if buf[pos] != '{':
+      raise ValueError('Not a heap snapshot')
+    self._state = self._parse_key
+    return pos + 1
+
+  def _parse_key(self, buf, pos):
+    pos = self._skip(buf, pos, WHITESPACE + ',')
+    if pos == len(buf):
+      return None
+    if buf[pos] == '}':
+      self._state = None
+      return pos + 1
+
+    try:
+      key, end = self._decoder.raw_decode(buf, pos)
+    except ValueError:
+      return None
+    end = self._skip(buf, end)
+    if end == len(buf):
+      return None
+    if buf[end] != ':':
+      raise ValueError('Expected : after {0} at position {1}'.format(key, end))
+
+    self._key = key
+    self._wanted = 0
+    self._state = self._parse_number_array_start if key in NUMBER_ARRAYS else self._parse_value
+    return end + 1
+
+  def _parse_value(self, buf, pos):
+    pos = self._skip(buf, pos)
+    try:
+      value, end = self._decoder.raw_decode(buf, pos)
+    except ValueError:
+      end = None
+
+    # a value which extends to the end of the buffer (e.g. a number) may have been cut off
+    if end is None or end == len(buf):
+      self._wanted = 2 * (len(buf) - pos)
+      return None
+
+    self._values[self._key] = value
+    self._wanted = 0
+    self._state = self._parse_key
+    return end
+
+  def _parse_number_array_start(self, buf, pos):
+    pos = self._skip(buf, pos)
+    if pos == len(buf):
+      return None
+    if buf[pos] != '[':
+      raise ValueError('Expected {0} to be an array'.format(self._key))
+
+    self._arrays[self._key] = array('i')
+    self._state = self._parse_numbers
+    return pos + 1
+
+  def _parse_numbers(self, buf, pos):
+    limit = min(len(buf), pos + NUMBER_BLOCK_SIZE)
+
+    end = buf.find(']', pos, limit)
+    if end != -1:
+      self._add_numbers(buf[pos:end])
+      self._state = self._parse_key
+      return end + 1
+
+    # only convert complete numbers; the last one in the buffer may continue in the next chunk
+    cut = buf.rfind(',', pos, limit)
+    if cut == -1:
+      return None
+    self._add_numbers(buf[pos:cut])
+    return cut + 1
+
+  def _add_numbers(self, text):
+    if not text.strip():
+      return
+
+    # the json module's scanner converts numbers several times faster than int() does
+    numbers = self._decoder.raw_decode('[' + text + ']')[0]
+    try:
+      self._arrays[self._key].fromlist(numbers)
+    except OverflowError:
+      # some values do not fit into a C int, so widen the array
+      self._arrays[self._key] = array('l', self._arrays[self._key])
+      self._arrays[self._key].fromlist(numbers)
+
+
+class HeapSnapshot(object):
+  """
+  A parsed heap snapshot. Nodes and edges are kept in the snapshot's own flat layout, described by its meta data, and
+  are only looked up by index. compute_retained_sizes() builds the dominator tree, using the iterative algorithm of
+  Cooper, Harvey and Kennedy ("A Simple, Fast Dominance Algorithm"), which is also what Chrome's developer tools use.
+  """
+
+  def __init__(self, meta, nodes, edges, strings):
+    if 'node_fields' not in meta or 'edge_fields' not in meta:
+      raise ValueError('Unsupported heap snapshot format')
+
+    node_fields = meta['node_fields']
+    edge_fields = meta['edge_fields']
+    self._node_field_count = len(node_fields)
+    self._edge_field_count = len(edge_fields)
+    self._node_type_offset = node_fields.index('type')
+    self._node_name_offset = node_fields.index('name')
+    self._node_id_offset = node_fields.index('id')
+    self._node_self_size_offset = node_fields.index('self_size')
+    self._node_edge_count_offset = node_fields.index('edge_count')
+    self._edge_type_offset = edge_fields.index('type')
+    self._edge_to_node_offset = edge_fields.index('to_node')
+
+    self.node_types = meta['node_types'][self._node_type_offset]
+    self.edge_types = meta['edge_types'][self._edge_type_offset]
+
+    self.nodes = nodes
+    self.edges = edges
+    self.strings = strings
+    self.node_count = len(nodes) / self._node_field_count
+    self.edge_count = len(edges) / self._edge_field_count
+
+    # filled in by compute_retained_sizes()
+    self.dominators = None
+    self.retained_sizes = None
+
+  # ---------
+  # Accessors
+  # ---------
+
+  def node_name(self, node):
+    return self.strings[self.nodes[node * self._node_field_count + self._node_name_offset]]
+
+  def node_type(self, node):
+    return self.node_types[self.nodes[node * self._node_field_count + self._node_type_offset]]
+
+  def node_id(self, node):
+    return self.nodes[node * self._node_field_count + self._node_id_offset]
+
+  def self_sizes(self):
+    return self.nodes[self._node_self_size_offset::self._node_field_count]
+
+  def total_size(self):
+    return sum(self.self_sizes())
+
+  # -------------------------
+  # Dominators/Retained Sizes
+  # -------------------------
+
+  def _first_edges(self):
+    """Returns an array mapping every node to the index of its first edge, with an extra entry for the end"""
+    first_edges = array('l', [0]) * (self.node_count + 1)
+    edge_index = 0
+    for node, edge_count in enumerate(self.nodes[self._node_edge_count_offset::self._node_field_count]):
+      first_edges[node] = edge_index
+      edge_index += edge_count
+    first_edges[self.node_count] = edge_index
+    return first_edges
+
+  def _strong_targets(self):
+    """
+    Returns an array with the index of the node every edge points to, or -1 for weak edges, which do not keep the node
+    they point to alive
+    """
+    weak = self.edge_types.index('weak') if 'weak' in self.edge_types else -1
+    to_nodes = self.edges[self._edge_to_node_offset::self._edge_field_count]
+    edge_types = self.edges[self._edge_type_offset::self._edge_field_count]
+    return array('i', (to_node / self._node_field_count if edge_type != weak else -1
+                       for to_node, edge_type in izip(to_nodes, edge_types)))
+
+  def _post_order(self, first_edges, targets):
+    """
+    Returns the nodes which are reachable from the root (node 0) via strong edges, in the post order of a depth first
+    search, along with the number of strong edges from reachable nodes which point to each node. Uses an explicit
+    stack, since heap graphs are far too deep for recursion.
+    """
+    visited = bytearray(self.node_count)
+    in_degrees = array('i', [0]) * self.node_count
+    post_order = array('i')
+
+    node_stack = [0]
+    edge_stack = [first_edges[0]]
+    visited[0] = 1
+    while node_stack:
+      node = node_stack[-1]
+      edge = edge_stack[-1]
+      end = first_edges[node + 1]
+
+      while edge < end:
+        child = targets[edge]
+        if child != -1:
+          in_degrees[child] += 1
+          if not visited[child]:
+            break
+        edge += 1
+      else:
+        child = -1
+
+      if child == -1:
+        node_stack.pop()
+        edge_stack.pop()
+        post_order.append(node)
+      else:
+        edge_stack[-1] = edge + 1
+        visited[child] = 1
+        node_stack.append(child)
+        edge_stack.append(first_edges[child])
+
+    return post_order, in_degrees
+
+  def compute_retained_sizes(self):
+    """
+    Computes the immediate dominator and the retained size of every node. Nodes which cannot be reached from the root
+    via strong edges are not dominated by anything (their dominator is -1) and only retain themselves.
+    """
+    first_edges = self._first_edges()
+    targets = self._strong_targets()
+    post_order, in_degrees = self._post_order(first_edges, targets)
+    reachable = len(post_order)
+
+    # from here on, reachable nodes are identified by their post order index
+    post_order_index = array('i', [-1]) * self.node_count
+    for index, node in enumerate(post_order):
+      post_order_index[node] = index
+
+    # predecessors of every reachable node, in compressed sparse row form
+    pred_starts = array('i', [0]) * (reachable + 1)
+    total = 0
+    for index, node in enumerate(post_order):
+      pred_starts[index] = total
+      total += in_degrees[node]
+    pred_starts[reachable] = total
+    del in_degrees
+
+    preds = array('i', [0]) * total
+    fill = array('i', pred_starts)
+    for index, node in enumerate(post_order):
+      for target in targets[first_edges[node]:first_edges[node + 1]]:
+        if target != -1:
+          target = post_order_index[target]
+          preds[fill[target]] = index
+          fill[target] += 1
+    del targets, fill
+
+    # immediate dominators, as post order indices. The root is last in post order and dominates itself. Visiting the
+    # nodes in reverse post order means every node's parent in the depth first search has been visited before it, so
+    # nodes with a single predecessor get their final dominator in the first pass, and only nodes with several
+    # predecessors need to be revisited until nothing changes
+    root = reachable - 1
+    doms = array('i', [-1]) * reachable
+    doms[root] = root
+    merge_nodes = array('i')
+    for index in xrange(root - 1, -1, -1):
+      if pred_starts[index + 1] - pred_starts[index] == 1:
+        doms[index] = preds[pred_starts[index]]
+      else:
+        merge_nodes.append(index)
+
+    changed = True
+    while changed:
+      changed = False
+      for index in merge_nodes:
+        new_dom = -1
+        for pred in preds[pred_starts[index]:pred_starts[index + 1]]:
+          if doms[pred] == -1:
+            continue
+          if new_dom == -1:
+            new_dom = pred
+            continue
+          # intersect the dominator chains of the two nodes
+          while pred != new_dom:
+            while pred < new_dom:
+              pred = doms[pred]
+            while new_dom < pred:
+              new_dom = doms[new_dom]
+        if doms[index] != new_dom:
+          doms[index] = new_dom
+          changed = True
+    del preds, pred_starts, merge_nodes
+
+    # a node's dominator always comes after it in post order, so a single pass adds every retained size to its
+    # dominator's before the dominator's own is added further up
+    retained = array('d', self.self_sizes())
+    reachable_retained = array('d', (retained[node] for node in post_order))
+    for index in xrange(root):
+      reachable_retained[doms[index]] += reachable_retained[index]
+
+    dominators = array('i', [-1]) * self.node_count
+    for index, node in enumerate(post_order):
+      retained[node] = reachable_retained[index]
+      dominators[node] = post_order[doms[index]]
+    dominators[0] = 0
+
+    self.dominators = dominators
+    self.retained_sizes = retained
+
+  # -------
+  # Summary
+  # -------
+
+  def aggregate_by_constructor(self):
+    """
+    Returns a dictionary mapping every constructor name to the number of objects and their total self size, as a
+    (count, size) tuple. Like in Chrome's developer tools, objects are grouped by their name and everything else (e.g.
+    strings, closures, code) by its node type, e.g. '(closure)'.
+    """
+    named_types = [index for index, node_type in enumerate(self.node_types) if node_type in ('object', 'native')]
+    node_types = self.nodes[self._node_type_offset::self._node_field_count]
+    names = self.nodes[self._node_name_offset::self._node_field_count]
+
+    # aggregate by string index (or negative node type index) first, so every node is a single dictionary update
+    counts = defaultdict(int)
+    sizes = defaultdict(int)
+    for node_type, name, size in izip(node_types, names, self.self_sizes()):
+      key = name if node_type in named_types else -node_type - 1
+      counts[key] += 1
+      sizes[key] += size
+
+    aggregates = {}
+    for key, count in counts.iteritems():
+      name = self.strings[key] if key >= 0 else '({0})'.format(self.node_types[-key - 1])
+      # different string indices can hold the same name
+      previous_count, previous_size = aggregates.get(name, (0, 0))
+      aggregates[name] = (previous_count + count, previous_size + sizes[key])
+    return aggregates
+
+  def top_retainers(self, number_results):
+    """
+    Returns the objects with the largest retained sizes. Synthetic nodes, like the snapshot's root and the GC roots,
+    are left out since they do not correspond to anything in the page.
+    """
+    if self.retained_sizes is None:
+      self.compute_retained_sizes()
+
+    synthetic = self.node_types.index('synthetic') if 'synthetic' in self.node_types else -1
+    node_types = self.nodes[self._node_type_offset::self._node_field_count]
+    candidates = (node for node in xrange(self.node_count) if node_types[node] != synthetic)
+    top_nodes = nlargest(number_results, candidates, key=self.retained_sizes.__getitem__)
+
+    return [{
+      'name': self.node_name(node),
+      'type': self.node_type(node),
+      'id': self.node_id(node),
+      'selfSize': self.nodes[node * self._node_field_count + self._node_self_size_offset],
+      'retainedSize': int(self.retained_sizes[node])
+    } for node in top_nodes]
+
+  def get_summary(self, number_results=10):
+    """Returns the summary of the snapshot which goes into the _memoryStats of a page"""
+    top_retainers = self.top_retainers(number_results)
+    return {
+      '_nodeCount': self.node_count,
+      '_edgeCount': self.edge_count,
+      '_totalSize': self.total_size(),
+      '_reachableSize': int(self.retained_sizes[0]),
+      '_topRetainers': top_retainers
+    }
+
+
+class HeapGrowthTracker(object):
+  """
+  Follows the number and total size of the objects of every constructor over successive heap snapshots (e.g. one per
+  iteration of a flow) to find the constructors whose objects keep accumulating, which points to a memory leak. Only
+  the per-constructor aggregates of each snapshot are kept, so snapshots are compared without matching up individual
+  objects.
+  """
+
+  def __init__(self):
+    self.snapshots = 0
+
+    # constructor name -> list of object counts/total sizes, one per snapshot
+    self._counts = {}
+    self._sizes = {}
+
+  def add(self, aggregates):
+    """Adds the result of HeapSnapshot.aggregate_by_constructor() for the next snapshot"""
+    for name, (count, size) in aggregates.iteritems():
+      if name not in self._counts:
+        self._counts[name] = [0] * self.snapshots
+        self._sizes[name] = [0] * self.snapshots
+      self._counts[name].append(count)
+      self._sizes[name].append(size)
+    self.snapshots += 1
+
+    # constructors which have no objects left
+    for name, counts in self._counts.iteritems():
+      if len(counts) < self.snapshots:
+        counts.append(0)
+        self._sizes[name].append(0)
+
+  def growing_constructors(self):
+    """Returns the names of the constructors whose object count grew from every snapshot to the next"""
+    if self.snapshots < 2:
+      return []
+    return [name for name, counts in self._counts.iteritems()
+            if all(later > earlier for earlier, later in izip(counts, counts[1:]))]
+
+  def get_report(self, number_results=10):
+    """
+    Returns the report which goes into the _memoryStats of a page: the growing constructors whose objects grew the most
+    in total size, along with their counts and sizes in every snapshot
+    """
+    growing = nlargest(number_results, self.growing_constructors(),
+                       key=lambda name: self._sizes[name][-1] - self._sizes[name][0])
+    return {
+      '_snapshots': self.snapshots,
+      '_growingConstructors': [{
+        'name': name,
+        'counts': self._counts[name],
+        'sizes': self._sizes[name],
+        'countGrowth': self._counts[name][-1] - self._counts[name][0],
+        'sizeGrowth': self._sizes[name][-1] - self._sizes[name][0]
+      } for name in growing]
+    }
+
+
+def parse_heap_snapshot(file_handle, read_size=64 * 1024):
+  """Parses the heap snapshot stored in the given file, reading it a piece at a time"""
+  parser = HeapSnapshotParser()
+  while True:
+    data = file_handle.read(read_size)
+    if not data:
+      break
+    parser.feed(data)
+  return parser.close()
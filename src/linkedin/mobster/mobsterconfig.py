@@ -7,7 +7,40 @@ class MobsterConfigDict(dict):
   
   CONFIG_DEFAULTS = {
     'WS_DEBUG_PORT': 9222, 
-    'DEBUG': False
+    'DEBUG': False,
+    # seconds to wait for the browser to respond to a single protocol command
+    'RESPONSE_TIMEOUT': 120,
+    # take a heap snapshot after every page load and summarize what retains the
+    # most memory. Snapshots are slow to take and transfer, so this is opt-in
+    'HEAP_SNAPSHOTS': False,
+    # take a heap snapshot at the end of every iteration and report the
+    # constructors whose objects keep growing from one iteration to the next
+    'HEAP_GROWTH': False,
+    # number of largest retainers (or growing constructors) included in the
+    # heap snapshot summaries
+    'HEAP_SNAPSHOT_TOP_N': 10,
+    # maximum number of heap size samples kept for the heap size chart of a
+    # page. Longer series are downsampled, keeping the peaks. Multiple of 4
+    'HEAP_TIME_SERIES_CAPACITY': 512,
+    # seconds without network events, once the load event has fired and all
+    # requests have finished, after which a page counts as loaded. Can be
+    # overridden per navigation with 'network-grace-period'
+    'NETWORK_QUIET_GRACE_PERIOD': 0.5,
+    # what is recorded for every navigation (see flowprofiler.COLLECTORS).
+    # Can be overridden per navigation with 'collect'
+    'COLLECTORS': ['network', 'timeline', 'css', 'memory'],
+    # number of worst CSS rules kept by each metric while a page's CSS
+    # selector profile is examined
+    'CSS_TOP_RULES': 10,
+    # maximum number of received messages waiting to be handled. When the
+    # queue is full, reading from the browser waits for up to
+    # INGEST_QUEUE_PUT_TIMEOUT seconds before the message is dropped, if it is
+    # an event. Command responses are never dropped
+    'INGEST_QUEUE_SIZE': 10000,
+    'INGEST_QUEUE_PUT_TIMEOUT': 10,
+    # maximum number of jobs waiting for a device when running as a daemon
+    # (see server.py). Jobs submitted to a device with a full queue are refused
+    'SERVER_MAX_QUEUED_JOBS': 100
   }
 
   _instance = None
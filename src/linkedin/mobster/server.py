@@ -0,0 +1,323 @@
+import BaseHTTPServer
+import json
+import logging
+import os
+from Queue import Full, Queue
+import SocketServer
+import threading
+import time
+
+from linkedin.mobster.har.flowplan import compile_flow
+from linkedin.mobster.har.flowprofiler import FlowProfiler, parse_collectors
+from linkedin.mobster.har.merge import merge_by_average, merge_by_percentile
+from linkedin.mobster.har.parallel import make_communicator
+from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.targets import parse_targets
+from linkedin.mobster.webkitcommunicator import BrowserConnectionError
+
+# merge option of a job -> function merging the HARs of a page from every iteration
+MERGES = {
+  'average': merge_by_average,
+  'percentiles': merge_by_percentile
+}
+
+class Job(object):
+  """
+  A flow to be profiled on a target. Its results are put on the results queue as they are made: a ('har', har) tuple
+  for every HAR, followed by a single ('done', summary) tuple, whose summary holds the error if the job failed.
+  """
+
+  def __init__(self, flow, target, iterations=1, merge=None, collectors=None):
+    self.flow = flow
+    self.target = target
+    self.iterations = iterations
+    self.merge = merge
+    self.collectors = collectors
+    self.results = Queue()
+    self.submitted = time.time()
+
+
+class DeviceWorker(object):
+  """
+  Runs the jobs of one device (see Target.device) one at a time, in the order they are submitted, since pages of the
+  same browser compete for the device's resources. The connection to each target of the device is kept open between
+  jobs, and only reopened if it was closed or a job on it failed.
+  """
+
+  def __init__(self, device, max_queued=None):
+    self.device = device
+    self._jobs = Queue(max_queued or config['SERVER_MAX_QUEUED_JOBS'])
+    # target name -> communicator connected to the target
+    self._sessions = {}
+    self.running = None
+    self.jobs_run = 0
+
+    self._thread = threading.Thread(target=self._work, name='mobster-serve-{0}'.format(device))
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+  def submit(self, job):
+    """Queues the job, raising Queue.Full if too many jobs are already waiting for the device"""
+    self._jobs.put_nowait(job)
+
+  @property
+  def queued(self):
+    return self._jobs.qsize()
+
+  def connected_targets(self):
+    return sorted(name for name, communicator in self._sessions.items() if not getattr(communicator, 'terminated', False))
+
+  def stop(self):
+    self._jobs.put(None)
+    self._thread.join()
+
+  def _work(self):
+    while True:
+      job = self._jobs.get()
+      # None is our termination flag
+      if job is None:
+        break
+      self.running = job
+      try:
+        self._run(job)
+      finally:
+        self.running = None
+        self.jobs_run += 1
+
+    for name in self._sessions.keys():
+      self._close_session(name)
+
+  def _session(self, target):
+    """Returns the open connection to the target, connecting to it if there is none"""
+    communicator = self._sessions.get(target.name)
+    if communicator is None or getattr(communicator, 'terminated', False):
+      # a closed connection still has its threads running until it is stopped
+      self._close_session(target.name)
+      logging.info('Connecting to {0}'.format(target.name))
+      communicator = self._sessions[target.name] = make_communicator(target)
+    return communicator
+
+  def _close_session(self, name):
+    communicator = self._sessions.pop(name, None)
+    if communicator:
+      communicator.stop()
+
+  def _run(self, job):
+    started = time.time()
+    summary = {'target': job.target.name, 'queuedTime': started - job.submitted}
+    try:
+      profiler = FlowProfiler(job.flow, job.iterations, self._session(job.target), job.target,
+                              collectors=job.collectors)
+      if job.merge:
+        for page_results in zip(*profiler.profile()):
+          job.results.put(('har', MERGES[job.merge](list(page_results))))
+      else:
+        def har_callback(iteration, har):
+          har['log']['_iteration'] = iteration
+          job.results.put(('har', har))
+        profiler.profile(har_callback)
+      summary['iterations'] = profiler.iterations_run
+    except Exception, e:
+      logging.exception('Job failed on target {0}'.format(job.target.name))
+      summary['error'] = str(e) or e.__class__.__name__
+      # the browser may be left in any state, e.g. with monitoring still enabled, so start afresh for the next job
+      self._close_session(job.target.name)
+    finally:
+      summary['runTime'] = time.time() - started
+      job.results.put(('done', summary))
+
+
+class ProfilingService(object):
+  """
+  Accepts profiling jobs for the targets given by target_spec (see targets.parse_targets) and runs them on a
+  DeviceWorker per device
+  """
+
+  def __init__(self, target_spec):
+    self.target_spec = target_spec
+    # target name -> Target, in the order they were found
+    self._targets = {}
+    self._target_names = []
+    # device -> DeviceWorker
+    self._workers = {}
+    self._lock = threading.Lock()
+    self.refresh_targets()
+
+  def refresh_targets(self):
+    """Looks for targets again, e.g. for pages opened since the service started"""
+    targets = parse_targets(self.target_spec)
+    with self._lock:
+      for target in targets:
+        if target.name not in self._targets:
+          self._targets[target.name] = target
+          self._target_names.append(target.name)
+
+  def find_target(self, name=None):
+    """Returns the target with the given name, or the first target if no name is given. Raises KeyError if not found"""
+    for attempt in range(2):
+      with self._lock:
+        if name is None and self._target_names:
+          return self._targets[self._target_names[0]]
+        if name in self._targets:
+          return self._targets[name]
+      if not attempt:
+        self.refresh_targets()
+    raise KeyError(name)
+
+  def submit(self, job):
+    """Queues the job on the worker of its target's device, raising Queue.Full if that worker has too many jobs"""
+    with self._lock:
+      worker = self._workers.get(job.target.device)
+      if worker is None:
+        worker = self._workers[job.target.device] = DeviceWorker(job.target.device)
+    worker.submit(job)
+
+  def get_status(self):
+    with self._lock:
+      targets = [self._targets[name] for name in self._target_names]
+      workers = dict(self._workers)
+    return {
+      'targets': [target.name for target in targets],
+      'devices': dict((device, {
+        'queued': worker.queued,
+        'running': worker.running is not None,
+        'jobsRun': worker.jobs_run,
+        'connected': worker.connected_targets()
+      }) for device, worker in workers.iteritems())
+    }
+
+  def stop(self):
+    with self._lock:
+      workers = self._workers.values()
+    for worker in workers:
+      worker.stop()
+
+
+class ProfilingRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  HTTP API of a ProfilingService:
+
+    GET /status    the targets, and the jobs queued and running on each device
+    POST /jobs     runs a job, whose body is a JSON object:
+                     {
+                       "flow": [the flow, as in a flow file],
+                       "target": [name of the target, e.g. localhost:9222/0. Defaults to the first target],
+                       "iterations": [number of times to run the flow, default 1],
+                       "merge": ["average" or "percentiles" to merge the iterations, as -a and --percentiles do],
+                       "collect": [list of the data to collect, see flowprofiler.COLLECTORS]
+                     }
+                   The response is a line of JSON for each HAR, written as soon as it is made, followed by a line
+                   {"_job": {"target", "queuedTime", "runTime", "iterations" or "error"}} once the job is over
+  """
+
+  # the end of a streamed response is marked by closing the connection
+  protocol_version = 'HTTP/1.0'
+
+  def do_GET(self):
+    if self.path.rstrip('/') == '/status':
+      self.send_json(200, self.server.service.get_status())
+    else:
+      self.send_json(404, {'error': 'Unknown path {0}'.format(self.path)})
+
+  def do_POST(self):
+    if self.path.rstrip('/') != '/jobs':
+      return self.send_json(404, {'error': 'Unknown path {0}'.format(self.path)})
+
+    try:
+      job = self.parse_job(json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0)))))
+    except KeyError, e:
+      return self.send_json(404, {'error': 'Unknown target {0}'.format(e.args[0])})
+    except BrowserConnectionError, e:
+      return self.send_json(502, {'error': str(e)})
+    except (ValueError, TypeError), e:
+      return self.send_json(400, {'error': str(e)})
+
+    try:
+      self.server.service.submit(job)
+    except Full:
+      return self.send_json(503, {'error': 'Too many jobs queued for {0}'.format(job.target.device)})
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/x-json-stream')
+    self.end_headers()
+    while True:
+      kind, result = job.results.get()
+      if kind == 'done':
+        self.write_line({'_job': result})
+        break
+      self.write_line(result)
+
+  def parse_job(self, request):
+    """Returns the Job described by the body of a POST /jobs request"""
+    if not isinstance(request, dict) or 'flow' not in request:
+      raise ValueError('The job must be a JSON object with a flow')
+    compile_flow(request['flow'])
+
+    iterations = int(request.get('iterations', 1))
+    if iterations < 1:
+      raise ValueError('iterations must be a positive integer')
+    merge = request.get('merge')
+    if merge is not None and merge not in MERGES:
+      raise ValueError('merge must be one of {0}'.format(', '.join(sorted(MERGES))))
+    collectors = request.get('collect')
+    if collectors is not None:
+      collectors = parse_collectors(collectors)
+
+    return Job(request['flow'], self.server.service.find_target(request.get('target')), iterations, merge, collectors)
+
+  def send_json(self, status, value):
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.end_headers()
+    self.wfile.write(json.dumps(value))
+
+  def write_line(self, value):
+    self.wfile.write(json.dumps(value) + '\n')
+    self.wfile.flush()
+
+  def address_string(self):
+    # connections over a Unix socket have no client address
+    return self.client_address[0] if self.client_address else 'local'
+
+  def log_message(self, format, *args):
+    logging.info('{0} {1}'.format(self.address_string(), format % args))
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+class ThreadingUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+  daemon_threads = True
+
+
+def make_server(address, service):
+  """
+  Returns a server for the HTTP API of the service. address is either [host:]port (the host defaulting to localhost)
+  or the path of a Unix socket, which is replaced if it exists.
+  """
+  if os.sep in address:
+    if os.path.exists(address):
+      os.remove(address)
+    server = ThreadingUnixHTTPServer(address, ProfilingRequestHandler)
+  else:
+    host, _, port = address.rpartition(':')
+    server = ThreadingHTTPServer((host or 'localhost', int(port)), ProfilingRequestHandler)
+  server.service = service
+  return server
+
+
+def serve(address, target_spec):
+  """Runs a ProfilingService for the targets given by target_spec, serving its HTTP API on address until interrupted"""
+  service = ProfilingService(target_spec)
+  server = make_server(address, service)
+  logging.warning('Serving profiling jobs for {0} on {1}'.format(', '.join(service.get_status()['targets']) or
+                                                                  'no targets yet', address))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    service.stop()
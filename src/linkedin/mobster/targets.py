@@ -0,0 +1,66 @@
+from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.webkitcommunicator import list_pages
+
+class Target(object):
+  """
+  A single browser page which can be profiled, identified by the host and port of its browser's remote debugging
+  endpoint and by the page's index in that browser's page list.
+  """
+
+  def __init__(self, host='localhost', port=None, page_num=0, ws_url=None):
+    self.host = host
+    self.port = int(port or config['WS_DEBUG_PORT'])
+    self.page_num = page_num
+    self._ws_url = ws_url
+
+  @property
+  def device(self):
+    """Identifies the browser (and therefore the device) which the page belongs to"""
+    return '{0}:{1}'.format(self.host, self.port)
+
+  @property
+  def name(self):
+    return '{0}/{1}'.format(self.device, self.page_num)
+
+  @property
+  def ws_url(self):
+    if self._ws_url is None:
+      self._ws_url = list_pages(self.host, self.port)[self.page_num]['webSocketDebuggerUrl']
+    return self._ws_url
+
+  def __repr__(self):
+    return 'Target({0})'.format(self.name)
+
+
+def discover_targets(host='localhost', port=None):
+  """Returns a Target for every page which is open in the browser listening on the given host and port"""
+  pages = list_pages(host, port)
+  return [Target(host, port, page_num, page.get('webSocketDebuggerUrl'))
+          for page_num, page in enumerate(pages)
+          if 'webSocketDebuggerUrl' in page]
+
+
+def parse_targets(spec):
+  """
+  Parses a comma separated list of targets, each of the form host:port[/page]. The page defaults to 0, and a page of
+  '*' stands for every page open in that browser, e.g.:
+
+    localhost:9222,localhost:9223/1,10.0.0.5:9222/*
+  """
+  targets = []
+  for target_spec in spec.split(','):
+    target_spec = target_spec.strip()
+    if not target_spec:
+      continue
+
+    address, _, page = target_spec.partition('/')
+    host, _, port = address.rpartition(':')
+    if not host:
+      host, port = port, None
+
+    if page == '*':
+      targets.extend(discover_targets(host, port))
+    else:
+      targets.append(Target(host, port, int(page or 0)))
+
+  return targets
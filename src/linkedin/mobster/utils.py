@@ -1,7 +1,10 @@
+import calendar
 import commands
 from datetime import datetime
 import functools
+import threading
 from time import mktime, sleep, time
+import weakref
 
 import pytz
 
@@ -15,6 +18,13 @@ def format_time(seconds):
   # return the formatted string with a semicolon between the hour and minute offset components (per HAR file standard)
   return ":".join([formatted_dt[:-2], formatted_dt[-2:]])
 
+def parse_time(formatted_time):
+  """
+  Returns the time in seconds since the epoch of a time formatted by format_time (which always formats times in UTC)
+  """
+  dt = datetime.strptime(formatted_time[:26], "%Y-%m-%dT%H:%M:%S.%f")
+  return calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6
+
 def datetime_to_millis(dt):
   return mktime(dt.timetuple()) * 1e3 + dt.microsecond / 1e3
 
@@ -31,43 +41,327 @@ def cmd_exists(cmd):
   (status, output) = commands.getstatusoutput("which {0}".format(cmd))
   return status == 0
 
-class memoize(object):
+class LRUCache(object):
+  """
+  Cache which holds at most maxsize entries (any number if maxsize is None), evicting the least recently used one to
+  make room for a new one. If ttl is given, entries expire that many seconds after they were stored. Counts of hits,
+  misses, evictions and expirations are kept in stats, which may be shared between caches.
+  """
+  # positions of the fields of a link of the list of entries
+  PREV, NEXT, KEY, VALUE, EXPIRY = range(5)
+
+  def __init__(self, maxsize=None, ttl=None, stats=None):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.stats = stats if stats is not None else CacheStats()
+    # key -> link of a circular doubly linked list of entries, ordered from least to most recently used after the root
+    self._links = {}
+    self._root = []
+    self._root[:] = [self._root, self._root, None, None, None]
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._links)
+
+  def get(self, key):
+    """Returns the value stored under key, raising KeyError if there is none or it has expired"""
+    PREV, NEXT = self.PREV, self.NEXT
+    with self._lock:
+      link = self._links.get(key)
+      if link is None:
+        self.stats.misses += 1
+        raise KeyError(key)
+      if link[self.EXPIRY] is not None and time() >= link[self.EXPIRY]:
+        self._unlink(link)
+        self.stats.expirations += 1
+        self.stats.misses += 1
+        raise KeyError(key)
+
+      # move the entry to the most recently used end
+      link[PREV][NEXT] = link[NEXT]
+      link[NEXT][PREV] = link[PREV]
+      root = self._root
+      last = root[PREV]
+      last[NEXT] = root[PREV] = link
+      link[PREV] = last
+      link[NEXT] = root
+      self.stats.hits += 1
+      return link[self.VALUE]
+
+  def put(self, key, value):
+    if self.maxsize == 0:
+      return
+    with self._lock:
+      if key in self._links:
+        self._unlink(self._links[key])
+      elif self.maxsize is not None:
+        while len(self._links) >= self.maxsize:
+          self._unlink(self._root[self.NEXT])
+          self.stats.evictions += 1
+
+      root = self._root
+      last = root[self.PREV]
+      link = [last, root, key, value, time() + self.ttl if self.ttl is not None else None]
+      last[self.NEXT] = root[self.PREV] = self._links[key] = link
+
+  def clear(self):
+    with self._lock:
+      self._links.clear()
+      self._root[:] = [self._root, self._root, None, None, None]
+
+  def _unlink(self, link):
+    link[self.PREV][self.NEXT] = link[self.NEXT]
+    link[self.NEXT][self.PREV] = link[self.PREV]
+    del self._links[link[self.KEY]]
+
+class CacheStats(object):
+  __slots__ = ['hits', 'misses', 'evictions', 'expirations']
+
+  def __init__(self):
+    self.hits = self.misses = self.evictions = self.expirations = 0
+
+  def as_dict(self):
+    return dict((field, getattr(self, field)) for field in self.__slots__)
+
+class memoized(object):
   """
-  Memoize decorator.
+  Function or method whose results are cached by its arguments in an LRUCache. When it is a method, every instance gets
+  a cache of its own, which is held in a WeakKeyDictionary so that it goes away with the instance rather than keeping
+  the instance alive; the instance must therefore be hashable and weak referenceable. Use the memoize decorator to make
+  one.
   """
-  def __init__(self, func):
+  def __init__(self, func, maxsize=None, ttl=None):
     self.func = func
-    self.memoized = {}
-    self.method_cache = {}
-  def __call__(self, *args):
-    return self.cache_get(self.memoized, args,
-      lambda: self.func(*args))
-  def __get__(self, obj, objtype):
-    return self.cache_get(self.method_cache, obj,
-      lambda: self.__class__(functools.partial(self.func, obj)))
-  def cache_get(self, cache, key, func):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    # hits, misses etc. of the function, or of every instance of the method together
+    self.stats = CacheStats()
+    self._cache = LRUCache(maxsize, ttl, self.stats)
+    self._instance_caches = weakref.WeakKeyDictionary()
+    self._instance_caches_lock = threading.Lock()
+    functools.update_wrapper(self, func)
+
+  def __call__(self, *args, **kwargs):
+    return self._call(self._cache, self.func, args, kwargs)
+
+  def __get__(self, obj, objtype=None):
+    if obj is None:
+      return self
+    return _MemoizedMethod(self, obj)
+
+  def instance_cache(self, obj):
+    """Returns the cache of the method's results for obj"""
+    cache = self._instance_caches.get(obj)
+    if cache is not None:
+      return cache
+    with self._instance_caches_lock:
+      return self._instance_caches.setdefault(obj, LRUCache(self.maxsize, self.ttl, self.stats))
+
+  def cache_info(self):
+    """Returns the hits, misses, evictions and expirations, and the number of entries currently cached"""
+    info = self.stats.as_dict()
+    info['size'] = len(self._cache) + sum(len(cache) for cache in self._instance_caches.values())
+    info['maxsize'] = self.maxsize
+    return info
+
+  def cache_clear(self):
+    self._cache.clear()
+    self._instance_caches.clear()
+
+  @staticmethod
+  def _call(cache, func, args, kwargs, bound_args=()):
+    """Returns the cached result of func for args and kwargs, or calls func with bound_args followed by them"""
+    key = args + (_KWARGS_MARK,) + tuple(sorted(kwargs.iteritems())) if kwargs else args
     try:
-      return cache[key]
+      return cache.get(key)
     except KeyError:
-      cache[key] = func()
-      return cache[key]
+      pass
+    # the lock is not held while func runs, so two threads may both compute a missing value; the last one is kept
+    value = func(*(bound_args + args), **kwargs)
+    cache.put(key, value)
+    return value
+
+_KWARGS_MARK = object()
 
-def running_avg():
+class _MemoizedMethod(object):
+  """A memoized method bound to an instance"""
+  __slots__ = ['_memoized', '_obj']
+
+  def __init__(self, memoized, obj):
+    self._memoized = memoized
+    self._obj = obj
+
+  def __call__(self, *args, **kwargs):
+    memoized = self._memoized
+    return memoized._call(memoized.instance_cache(self._obj), memoized.func, args, kwargs, (self._obj,))
+
+  def cache_info(self):
+    """Returns the hits, misses etc. of the method across all instances, and the number of entries cached for obj"""
+    info = self._memoized.stats.as_dict()
+    info['size'] = len(self._memoized.instance_cache(self._obj))
+    info['maxsize'] = self._memoized.maxsize
+    return info
+
+  def cache_clear(self):
+    self._memoized.instance_cache(self._obj).clear()
+
+def memoize(func=None, maxsize=128, ttl=None):
+  """
+  Memoize decorator for functions and methods. Results are kept in an LRU cache of at most maxsize entries (per
+  instance, for methods), which expire ttl seconds after they were computed if ttl is given. Example usage:
+  > @memoize
+  > def get_user_agent(self): ...
+  > @memoize(maxsize=8, ttl=60)
+  > def get_rules_longest_time(self, number_results): ...
+  > print client.get_user_agent.cache_info()
+  {'hits': 3, 'misses': 1, 'evictions': 0, 'expirations': 0, 'size': 1, 'maxsize': 128}
   """
-  Generator and coroutine for keeping track of a changing average. Example usage:
-  > avg_helper = running_avg()
-  > avg_helper.next()
-  > print avg_helper.send(1.0)
-  1.0
-  > avg_helper.next()
-  > print avg_helper.send(2.0)
-  1.5
+  if func is None:
+    return lambda func: memoized(func, maxsize, ttl)
+  return memoized(func, maxsize, ttl)
+
+# two-sided 95% critical values of Student's t distribution, indexed by degrees of freedom - 1
+T_CRITICAL_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145,
+                 2.131, 2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048,
+                 2.045, 2.042]
+
+def t_critical_95(degrees_of_freedom):
+  """Returns the two-sided 95% critical value of Student's t distribution"""
+  if degrees_of_freedom <= len(T_CRITICAL_95):
+    return T_CRITICAL_95[degrees_of_freedom - 1]
+  # first term of the Cornish-Fisher expansion around the normal distribution's 1.96
+  return 1.96 + (1.96 ** 3 + 1.96) / (4 * degrees_of_freedom)
+
+class StatsAccumulator(object):
   """
+  Keeps summary statistics of a stream of numbers in a single pass and constant memory: the count, mean, variance
+  (using Welford's algorithm), min, max and approximate quantiles. Accumulators of separate streams can be merged.
+  Example usage:
+  > stats = StatsAccumulator()
+  > for value in [1, 2, 3, 4]:
+  >   stats.add(value)
+  > print stats.mean, stats.quantile(0.5)
+  2.5 2.5
+
+  Quantiles are computed from a sketch of at most 2 * max_centroids (value, weight) centroids, so they are exact for
+  short streams such as the runs of a flow. Once the sketch is full, it is compressed into max_centroids centroids of
+  about equal weight.
+  """
+  __slots__ = ['count', 'mean', '_m2', 'min', 'max', '_centroids', '_max_centroids']
+
+  def __init__(self, max_centroids=64):
+    self.count = 0
+    self.mean = 0.0
+    self._m2 = 0.0
+    self.min = None
+    self.max = None
+    self._centroids = []
+    self._max_centroids = max_centroids
+
+  def add(self, value):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self._m2 += delta * (value - self.mean)
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+
+    self._centroids.append((value, 1))
+    if len(self._centroids) >= 2 * self._max_centroids:
+      self._compress()
+
+  def merge(self, other):
+    """Adds all the values added to other, and returns self"""
+    if not other.count:
+      return self
+
+    # Chan et al.'s formula for combining the variances of two streams
+    count = self.count + other.count
+    delta = other.mean - self.mean
+    self.mean += delta * other.count / count
+    self._m2 += other._m2 + delta * delta * self.count * other.count / count
+    self.count = count
+    if self.min is None or other.min < self.min:
+      self.min = other.min
+    if self.max is None or other.max > self.max:
+      self.max = other.max
+
+    self._centroids.extend(other._centroids)
+    if len(self._centroids) >= 2 * self._max_centroids:
+      self._compress()
+    return self
+
+  def _compress(self):
+    """Replaces the centroids with at most max_centroids centroids of about equal weight"""
+    group_weight = float(self.count) / self._max_centroids
+    compressed = []
+    total = weight = 0
+    for value, value_weight in sorted(self._centroids):
+      total += value * value_weight
+      weight += value_weight
+      if weight >= group_weight:
+        compressed.append((float(total) / weight, weight))
+        total = weight = 0
+    if weight:
+      compressed.append((float(total) / weight, weight))
+    self._centroids = compressed
+
+  @property
+  def variance(self):
+    """The sample variance, i.e. 0 for less than 2 values"""
+    return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+  @property
+  def stddev(self):
+    return self.variance ** 0.5
+
+  def ci_half_width(self):
+    """
+    Returns the half width of the 95% confidence interval of the mean, assuming the values are independent samples of a
+    roughly normal distribution, or infinity if there are less than 2 values
+    """
+    if self.count < 2:
+      return float('inf')
+    return t_critical_95(self.count - 1) * self.stddev / self.count ** 0.5
+
+  def quantile(self, q):
+    """
+    Returns the q-quantile (0 <= q <= 1) of the values, interpolating between the closest values like
+    numpy.percentile does, or None if no values were added
+    """
+    if not self.count:
+      return None
+
+    # every centroid is placed at the middle of the ranks of the values it stands for, and the min and max at the ends.
+    # Once compressed, a lone value added since can sort first or last without being the min or max, so centroids at
+    # either end give way to the exact min and max
+    points = [(0, self.min)]
+    rank = 0
+    for value, weight in sorted(self._centroids):
+      middle = rank + (weight - 1) / 2.0
+      if 0 < middle < self.count - 1:
+        points.append((middle, value))
+      rank += weight
+    points.append((self.count - 1, self.max))
 
-  count = 0
-  total = 0.0
+    target = q * (self.count - 1)
+    for (low_rank, low), (high_rank, high) in zip(points, points[1:]):
+      if target <= high_rank:
+        if high_rank == low_rank:
+          return high
+        return low + (high - low) * (target - low_rank) / (high_rank - low_rank)
+    return self.max
 
-  while True:
-    total += (yield)
-    count += 1
-    yield total/count
+  def get_summary(self):
+    return {
+      'count': self.count,
+      'mean': self.mean if self.count else None,
+      'stddev': self.stddev,
+      'min': self.min,
+      'max': self.max,
+      'p50': self.quantile(0.5),
+      'p90': self.quantile(0.9),
+      'p99': self.quantile(0.99)
+    }
@@ -1,11 +1,91 @@
-from collections import defaultdict
+import json
 from pprint import pformat
 import re
 import logging
-from uuid import uuid4
+import threading
 
+from linkedin.mobster.mobsterconfig import config
 from linkedin.mobster.utils import memoize
-from utils import wait_until
+
+class CommandBatch(object):
+  """
+  Collects protocol commands so they can be sent to the browser together via
+  RemoteWebKitClient.send_batch(). The start_*/stop_* helpers accept a batch and
+  add their commands to it instead of sending them immediately.
+  """
+
+  def __init__(self):
+    self.commands = []
+    self.responses = []
+
+  def add(self, method, params=None):
+    self.commands.append((method, {} if params is None else params))
+
+  def response(self, method):
+    """Returns the response to the first command in the batch with the given method"""
+    for (cmd_method, params), response in zip(self.commands, self.responses):
+      if cmd_method == method:
+        return response
+
+
+# ---------------------------------------------------------------------------
+# JS for interacting with the page. Values are JSON encoded to quote them as JS
+# string literals.
+# ---------------------------------------------------------------------------
+
+def element_js(params):
+  """JS expression for the element with the id given in params, or else the first one with the class given in params"""
+  if 'id' in params:
+    return 'document.getElementById({0})'.format(json.dumps(params['id']))
+  return 'document.getElementsByClassName({0})[0]'.format(json.dumps(params['class']))
+
+def set_field_value_js(field_id, value):
+  return 'document.getElementById({0}).value = {1}'.format(json.dumps(field_id), json.dumps(value))
+
+def click_button_js(button_id):
+  return 'document.getElementById({0}).click()'.format(json.dumps(button_id))
+
+def dispatch_event_js(params):
+  """JS dispatching an event of type params['event-type'] to the element given by params (see element_js)"""
+  return ';'.join(['e = document.createEvent("HTMLEvents")',
+                   'e.initEvent({0}, true, true)'.format(json.dumps(params['event-type'])),
+                   '{0}.dispatchEvent(e)'.format(element_js(params))])
+
+def click_link_js(params):
+  """JS following the link given by params (see element_js) by submitting a form with the link's href as its action"""
+  return ';'.join(['var f = document.createElement("form")',
+                   'f.action = {0}.href'.format(element_js(params)),
+                   'document.body.appendChild(f)',
+                   'f.submit()'])
+
+def submit_form_js(form_id):
+  return 'document.getElementById({0}).submit()'.format(json.dumps(form_id))
+
+
+# Navigation Timing fields returned by RemoteWebKitClient.probe_page()
+NAVIGATION_TIMING_FIELDS = ['navigationStart', 'domContentLoadedEventEnd', 'loadEventEnd']
+
+# JS collecting the page's title, the Navigation Timing fields in NAVIGATION_TIMING_FIELDS, its Resource Timing entries
+# (as arrays rather than objects, to keep the response small) and its number of elements
+PAGE_PROBE_JS = '''(function(timingFields) {{
+  var performance = window.performance || {{}};
+  var timing = {{}};
+  for (var i = 0; i < timingFields.length; i++) {{
+    timing[timingFields[i]] = performance.timing ? performance.timing[timingFields[i]] : 0;
+  }}
+  var resources = [];
+  var entries = performance.getEntriesByType ? performance.getEntriesByType("resource") : [];
+  for (var j = 0; j < entries.length; j++) {{
+    resources.push([entries[j].name, entries[j].initiatorType, Math.round(entries[j].startTime * 10) / 10,
+                    Math.round(entries[j].duration * 10) / 10]);
+  }}
+  return {{
+    title: document.title,
+    timing: timing,
+    resources: resources,
+    elements: document.getElementsByTagName("*").length
+  }};
+}})({0})'''.format(json.dumps(NAVIGATION_TIMING_FIELDS))
 
 class RemoteWebKitClient(object):
 
@@ -21,8 +101,6 @@ class RemoteWebKitClient(object):
     self._page_events_enabled = False
     self._css_profiling_started = False
     self._css_profile = None
-    self._received = defaultdict(lambda: False)
-    self._responses = {}
 
   # --------------------------------------------------------------------------
   # UTILITY FUNCTIONS
@@ -33,19 +111,30 @@ class RemoteWebKitClient(object):
     Send a command with the given arguments, wait till a response is received, 
     and return it.
     """
-    rec_id = uuid4().hex
-    
-    def response_handler(response):
-      self._received[rec_id] = True
-      self._responses[rec_id] = response
+    future = self._communicator.send_cmd(command, args)
+    return future.result(config['RESPONSE_TIMEOUT'])
+
+  def _send_or_batch(self, command, args=None, batch=None):
+    """Adds the command to the batch if one is given, otherwise sends it and waits for the response"""
+    if args is None:
+      args = {}
+    if batch is not None:
+      batch.add(command, args)
+    else:
+      return self._sendw(command, args)
 
-    self._communicator.send_cmd(command, args, response_handler)
+  def send_batch(self, batch):
+    """
+    Sends all the commands in the given CommandBatch at once, waits till every
+    response is received, and returns the responses in order.
+    """
+    future = self._communicator.send_batch(batch.commands)
+    batch.responses = future.responses(config['RESPONSE_TIMEOUT'])
 
-    wait_until(lambda: self._received[rec_id])
-    response = self._responses[rec_id]
-    del self._received[rec_id]
-    del self._responses[rec_id]
-    return response
+    for response in batch.responses:
+      if 'error' in response:
+        logging.error('Error received: ' + pformat(response['error']))
+    return batch.responses
 
 
   def stop(self):
@@ -63,30 +152,24 @@ class RemoteWebKitClient(object):
     Runs JS in the current browser page, and returns the value if the JS is an expression.
     Otherwise, returns None.
     """
-    self._got_js_result = False
-    self._js_result = None
-
-    def response_handler(response):
-      if not is_expression:
-        self._got_js_result = True
-      elif 'result' in response and 'result' in response['result']:
-        if 'wasThrown' in response['result']['result']:
-          logging.error('Received error after running JS: {0}\n{1}'.format(js, response['result']))
-
-        self._js_result = response['result']['result']['value']
-        self._got_js_result = True
-
-    self._communicator.send_cmd('Runtime.evaluate',
-                                {'expression': js,
-                                 'objectGroup': 'group',
-                                 'returnByValue': True },
-                                response_handler)
+    future = self._communicator.send_cmd('Runtime.evaluate',
+                                         {'expression': js,
+                                          'objectGroup': 'group',
+                                          'returnByValue': True })
     self._communicator.send_cmd('Runtime.releaseObjectGroup',
-                                {'objectGroup': 'group' },
-                                response_handler)
+                                {'objectGroup': 'group' })
 
-    wait_until(lambda: self._got_js_result)
-    return self._js_result
+    response = future.result(config['RESPONSE_TIMEOUT'])
+    if not is_expression:
+      return None
+
+    if 'result' in response and 'result' in response['result']:
+      if 'wasThrown' in response['result']:
+        logging.error('Received error after running JS: {0}\n{1}'.format(js, response['result']))
+      return response['result']['result'].get('value')
+
+    logging.error('Received unexpected response after running JS: {0}\n{1}'.format(js, pformat(response)))
+    return None
 
   def get_window_performance(self):
     """
@@ -95,6 +178,34 @@ class RemoteWebKitClient(object):
     """
     return self.run_js('window.performance')['timing']
 
+  def probe_page(self, include_dom_node_count=False):
+    """
+    Returns what is recorded about a page once it has loaded, fetched with a single round trip:
+      {
+        "title": [document.title],
+        "timing": {[each field in NAVIGATION_TIMING_FIELDS]: [time in ms since the epoch, 0 if it has not happened]},
+        "resources": [[name, initiatorType, startTime, duration] of each Resource Timing entry, if supported],
+        "elements": [number of elements in the document],
+        "domNodeCount": [the result of get_dom_node_count(), only if include_dom_node_count is given]
+      }
+    Only the fields which were received are included.
+    """
+    batch = CommandBatch()
+    batch.add('Runtime.evaluate', {'expression': PAGE_PROBE_JS, 'returnByValue': True})
+    if include_dom_node_count:
+      batch.add('Memory.getDOMNodeCount')
+    self.send_batch(batch)
+
+    probe = {}
+    result = batch.response('Runtime.evaluate').get('result', {})
+    if 'wasThrown' in result or not isinstance(result.get('result', {}).get('value'), dict):
+      logging.error('Received unexpected response to the page probe: {0}'.format(pformat(result)))
+    else:
+      probe = result['result']['value']
+    if include_dom_node_count and 'result' in batch.response('Memory.getDOMNodeCount'):
+      probe['domNodeCount'] = batch.response('Memory.getDOMNodeCount')['result']
+    return probe
+
   # --------------------------------------------------------------------------
   # MEMORY
   # --------------------------------------------------------------------------
@@ -116,18 +227,11 @@ class RemoteWebKitClient(object):
 
     logging.error('get_proc_memory_info: This function only works on the very latest browsers. Do not use.')
 
-    self._memory_info = None
-
-    def response_handler(response):
-      try:
-        self._memory_info = response['result']
-      except KeyError, e:
-        logging.error('Browser is too old to feature Memory.getProcessMemoryDistribution')
-
-    self._communicator.send_cmd('Memory.getProcessMemoryDistribution', {}, response_handler)
-
-    wait_until(lambda: self._memory_info)
-    return self._memory_info
+    response = self._sendw('Memory.getProcessMemoryDistribution', {})
+    try:
+      return response['result']
+    except KeyError, e:
+      logging.error('Browser is too old to feature Memory.getProcessMemoryDistribution')
 
 
 
@@ -190,18 +294,26 @@ class RemoteWebKitClient(object):
     self._communicator.remove_domain_callback('Profiler', 'profile_event')
     self._heap_profiling_started = False
 
-  def take_heap_snapshot(self):
-    """Takes a heap snapshot, which can be retrieved using get_heap_profile()"""
-    self._heap_snapshot_finished = False
+  def take_heap_snapshot(self, progress_callback=None):
+    """
+    Takes a heap snapshot, which can be retrieved using get_heap_profile(). If a progress_callback is given, it is
+    called with the number of steps done and the total number of steps whenever the browser reports progress.
+    """
+    snapshot_finished = threading.Event()
 
-    def progress_callback(response):
+    def progress_handler(response):
       if response['method'] == 'Profiler.reportHeapSnapshotProgress':
-        self._heap_snapshot_finished = (response['params']['done'] == response['params']['total'])
+        done, total = response['params']['done'], response['params']['total']
+        if progress_callback:
+          progress_callback(done, total)
+        if done == total:
+          snapshot_finished.set()
 
-    self._communicator.add_domain_callback('Profiler', 'heap_snapshot_progress', progress_callback)
+    self._communicator.add_domain_callback('Profiler', 'heap_snapshot_progress', progress_handler)
     self._sendw('Profiler.takeHeapSnapshot')
 
-    wait_until(lambda: self._heap_snapshot_finished)
+    if not snapshot_finished.wait(config['RESPONSE_TIMEOUT']):
+      raise Exception('Timed out waiting for heap snapshot to finish')
     self._communicator.remove_domain_callback('Profiler', 'heap_snapshot_progress')
 
 
@@ -210,31 +322,50 @@ class RemoteWebKitClient(object):
     
     self._sendw('Profiler.clearProfiles')
 
-  def get_heap_profile(self):
-    """Returns raw heap profiling data"""
-    self._first_profile_id = None
-
+  def get_heap_profile(self, sink=None):
+    """
+    Returns raw heap profiling data. Snapshots can be hundreds of MB, so a sink can be given instead, in which case each
+    chunk of the snapshot is handed to the sink as soon as it arrives and the snapshot as a whole is never held in
+    memory. The sink is either a file handle, which chunks are written to as UTF-8, or a function which is called with
+    every chunk. When a sink is given, the number of characters received is returned.
+    """
     first_profile_id = \
       self._sendw('Profiler.getProfileHeaders')['result']['headers'][0]['uid']
 
-    logging.info('Profile ID: %i' % self._first_profile_id)
+    logging.info('Profile ID: %i' % first_profile_id)
+
+    chunks = []
+    if sink is None:
+      write_chunk = chunks.append
+    elif hasattr(sink, 'write'):
+      write_chunk = lambda chunk: sink.write(chunk.encode('utf-8') if isinstance(chunk, unicode) else chunk)
+    else:
+      write_chunk = sink
 
-    self._heap_profile_chunks = []
-    self._heap_profile_data_recorded = False
+    data_recorded = threading.Event()
+    received = [0]
 
     def heap_snapshot_data_callback(response):
       if response['method'] == 'Profiler.addHeapSnapshotChunk':
-        self._heap_profile_chunks.append(response['params']['chunk'])
+        chunk = response['params']['chunk']
+        received[0] += len(chunk)
+        write_chunk(chunk)
       elif response['method'] == 'Profiler.finishHeapSnapshot':
-        self._heap_profile_data_recorded = True
+        data_recorded.set()
 
     self._communicator.add_domain_callback('Profiler', 'heap_snapshot_data', heap_snapshot_data_callback)
-    self._communicator.send_cmd('Profiler.getProfile', {'type': 'HEAP', 'uid': self._first_profile_id})
-
-    wait_until(lambda: self._heap_profile_data_recorded)
+    self._communicator.send_cmd('Profiler.getProfile', {'type': 'HEAP', 'uid': first_profile_id})
+
+    # large snapshots take a while to transfer, so only give up once no data has arrived for a whole timeout
+    last_received = -1
+    while not data_recorded.wait(config['RESPONSE_TIMEOUT']):
+      if received[0] == last_received:
+        self._communicator.remove_domain_callback('Profiler', 'heap_snapshot_data')
+        raise Exception('Timed out waiting for heap profile data')
+      last_received = received[0]
     self._communicator.remove_domain_callback('Profiler', 'heap_snapshot_data')
 
-    return ''.join(self._heap_profile_chunks)
+    return ''.join(chunks) if sink is None else received[0]
 
   # --------------------------------------------------------------------------
   # DEBUGGER
@@ -261,13 +392,16 @@ class RemoteWebKitClient(object):
   # TIMELINE
   # --------------------------------------------------------------------------
 
-  def start_timeline_monitoring(self, callback):
+  def start_timeline_monitoring(self, callback, batch=None, include_memory_details=True):
     """
     Enables monitoring of timeline events, including:
       - Resource requests
       - Paint events
       - GC Events
       ...and more
+
+    Memory details make the browser do extra work for every record, so they can be left out with
+    include_memory_details.
     """
 
     if self._timeline_started:
@@ -275,16 +409,16 @@ class RemoteWebKitClient(object):
       return
 
     self._communicator.add_domain_callback('Timeline', 'timeline_event', callback)
-    self._sendw('Timeline.setIncludeMemoryDetails', {'enabled': True})
-    self._sendw('Timeline.start')
+    self._send_or_batch('Timeline.setIncludeMemoryDetails', {'enabled': include_memory_details}, batch)
+    self._send_or_batch('Timeline.start', {}, batch)
     self._timeline_started = True
 
-  def stop_timeline_monitoring(self):
+  def stop_timeline_monitoring(self, batch=None):
     if not self._timeline_started:
       logging.error('Timeline monitoring not started')
       return
 
-    self._sendw('Timeline.stop')
+    self._send_or_batch('Timeline.stop', {}, batch)
     self._communicator.remove_domain_callbacks('Timeline')
     self._timeline_started = False
 
@@ -292,7 +426,7 @@ class RemoteWebKitClient(object):
   # NETWORK
   # --------------------------------------------------------------------------
 
-  def start_network_monitoring(self, callback):
+  def start_network_monitoring(self, callback, batch=None):
     """
     Enables processing of network events via the specified callback.
 
@@ -307,15 +441,15 @@ class RemoteWebKitClient(object):
       return
 
     self._communicator.add_domain_callback('Network', 'network_event', callback)
-    self._sendw('Network.enable')
+    self._send_or_batch('Network.enable', {}, batch)
     self._network_enabled = True
 
-  def stop_network_monitoring(self):
+  def stop_network_monitoring(self, batch=None):
     if not self._network_enabled:
       logging.error('Network monitoring not enabled')
       return
 
-    self._sendw('Network.disable')
+    self._send_or_batch('Network.disable', {}, batch)
     self._communicator.remove_domain_callbacks('Network')
     self._network_enabled = False
 
@@ -325,27 +459,23 @@ class RemoteWebKitClient(object):
     
     return self._sendw('Network.canClearBrowserCache')['result']['result']
 
-  def clear_http_cache(self):
-    self._cache_clear_complete = False
-
-    response = self._sendw('Network.clearBrowserCache')
-    if 'error' in response:
+  def clear_http_cache(self, batch=None):
+    response = self._send_or_batch('Network.clearBrowserCache', {}, batch)
+    if response and 'error' in response:
       logging.error('Error received: ' + pformat(response['error']))
 
 
-  def clear_cookies(self):
-    self._cookie_clear_complete = False
-    
-    response = self._sendw('Network.clearBrowserCookies')
+  def clear_cookies(self, batch=None):
+    response = self._send_or_batch('Network.clearBrowserCookies', {}, batch)
 
-    if 'error' in response:
+    if response and 'error' in response:
       logging.error('Error received: ' + pformat(response["error"]))
 
   # --------------------------------------------------------------------------
   # PAGE
   # --------------------------------------------------------------------------
 
-  def start_page_event_monitoring(self, callback):
+  def start_page_event_monitoring(self, callback, batch=None):
     """
     Allows processing of page events via the given callback.
 
@@ -362,15 +492,15 @@ class RemoteWebKitClient(object):
       return
 
     self._communicator.add_domain_callback('Page', 'page_event', callback)
-    self._sendw('Page.enable')
+    self._send_or_batch('Page.enable', {}, batch)
     self._page_events_enabled = True
 
-  def stop_page_event_monitoring(self):
+  def stop_page_event_monitoring(self, batch=None):
     if not self._page_events_enabled:
       logging.error('Page events not being monitored')
       return
 
-    self._sendw('Page.disable')
+    self._send_or_batch('Page.disable', {}, batch)
     self._communicator.remove_domain_callback('Page', 'page_event')
     self._page_events_enabled = False
 
@@ -384,63 +514,42 @@ class RemoteWebKitClient(object):
   # ----------------
 
   def set_field_value(self, field_id, value):
-    js = 'document.getElementById("{0}").value = "{1}"'.format(field_id, value)
-    self.run_js(js, False)
+    self.run_js(set_field_value_js(field_id, value), False)
 
   def click_button(self, button_id):
-    js = 'document.getElementById("{0}").click()'.format(button_id)
-    self.run_js(js, False)
+    self.run_js(click_button_js(button_id), False)
 
   def dispatch_event(self, params):
-    js_lines = ['e = document.createEvent("HTMLEvents")', 'e.initEvent("{0}", true, true)'.format(params['event-type'])]
-
-    if 'id' in params:
-      js_lines.append('document.getElementById("{0}").dispatchEvent(e)'.format(params['id']))
-    else:
-      js_lines.append('document.getElementsByClassName("{0}")[0].dispatchEvent(e)'.format(params['class']))
-
-    js = ';'.join(js_lines)
-
-    self.run_js(js, False)
+    self.run_js(dispatch_event_js(params), False)
 
   def click_link(self, params):
-    js_lines = []
-
-    js_lines.append('var f = document.createElement("form")')
-
-    if "id" in params:
-      js_lines.append('f.action = document.getElementById("{0}").href'.format(kwargs['id']))
-    else:
-      js_lines.append('f.action = document.getElementsByClassName("{0}")[0].href'.format(kwargs['class']))
-
-    js_lines.append('document.body.appendChild(f)')
-    js_lines.append('f.submit()')
-
-    js = ';'.join(js_lines)
-    self.run_js(js, False)
+    self.run_js(click_link_js(params), False)
 
   def submit_form_by_id(self, form_id):
-    js = 'document.getElementById("{0}").submit()'.format(form_id)
-    self.run_js(js, False)
+    self.run_js(submit_form_js(form_id), False)
 
   # ---
   # CSS
   # ---
 
-  def start_css_selector_profiling(self):
+  def start_css_selector_profiling(self, batch=None):
     if self._css_profiling_started:
       logging.error('CSS Profiling already started')
       return
 
-    self._sendw('CSS.startSelectorProfiler')
+    self._send_or_batch('CSS.startSelectorProfiler', {}, batch)
     self._css_profiling_started = True
 
-  def stop_css_selector_profiling(self):
+  def stop_css_selector_profiling(self, batch=None):
+    """
+    Stops CSS selector profiling and returns the profile. If a batch is given, the profile is the batch's response
+    to 'CSS.stopSelectorProfiler' once it has been sent.
+    """
     if not self._css_profiling_started:
       logging.error('CSS selector profiling not started')
       return
 
-    result = self._sendw('CSS.stopSelectorProfiler')
+    result = self._send_or_batch('CSS.stopSelectorProfiler', {}, batch)
     self._css_profiling_started = False
     return result
 
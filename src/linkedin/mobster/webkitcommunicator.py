@@ -1,17 +1,371 @@
+from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 import json
 import logging
 from pprint import pformat
-from Queue import Queue
-import sys
+from Queue import Full, Queue
+import re
+import socket
 import threading
+import time
 import urllib2
 
 from ws4py.client.threadedclient import WebSocketClient
 
 from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.utils import StatsAccumulator
 
-class RemoteWebKitCommunicator(WebSocketClient):
+# decode incoming messages with a faster JSON implementation when one is installed
+try:
+  from ujson import loads as decode_json
+except ImportError:
+  try:
+    from simplejson import loads as decode_json
+  except ImportError:
+    decode_json = json.loads
+
+# matches the method of an event without decoding the message. The browser serializes the method of an event before
+# its params, so events can be recognized (and dropped if nobody is listening) from the first few bytes
+EVENT_METHOD_RE = re.compile(r'\s*\{\s*"method"\s*:\s*"([^"]+)"')
+
+class CommandFuture(object):
+  """
+  Holds the eventual response to a single protocol command. The communicator's
+  reader thread completes the future as soon as the response with the matching
+  id arrives, waking up any thread blocked in result().
+
+  If the response does not arrive in time, discard is called with the id, so
+  the dispatcher can forget the command instead of holding on to it forever.
+  """
+
+  def __init__(self, cmd_id, discard=None):
+    self.id = cmd_id
+    self._response = None
+    self._done = threading.Event()
+    self._discard = discard
+
+  def done(self):
+    return self._done.is_set()
+
+  def set_result(self, response):
+    self._response = response
+    self._done.set()
+
+  def result(self, timeout=None):
+    """
+    Blocks until the response is received and returns it. Raises an exception if
+    the response does not arrive within timeout seconds.
+    """
+    if not self._done.wait(timeout):
+      self.discard()
+      raise Exception("Timed out after {0}s waiting for response to command {1}".format(timeout, self.id))
+    return self._response
+
+  def discard(self):
+    """Tells the dispatcher that nobody is waiting for the response any more"""
+    if self._discard and not self.done():
+      self._discard(self.id)
+
+
+class BatchFuture(object):
+  """
+  Combines the CommandFutures of a batch of commands. Responses are keyed by
+  command id, and ids preserves the order in which the commands were sent.
+  """
+
+  def __init__(self, futures):
+    self._futures = futures
+    self.ids = [future.id for future in futures]
+
+  def done(self):
+    return all(future.done() for future in self._futures)
+
+  def result(self, timeout=None):
+    """
+    Blocks until every command in the batch has been answered and returns a
+    dictionary mapping command ids to responses. timeout applies to the batch
+    as a whole.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    results = {}
+    try:
+      for future in self._futures:
+        remaining = max(deadline - time.time(), 0) if deadline is not None else None
+        results[future.id] = future.result(remaining)
+    except Exception:
+      # the rest of the batch is given up on along with the command which timed out
+      for future in self._futures:
+        future.discard()
+      raise
+    return results
+
+  def responses(self, timeout=None):
+    """Same as result(), but returns the responses as a list in the order the commands were sent"""
+    results = self.result(timeout)
+    return [results[cmd_id] for cmd_id in self.ids]
+
+
+class IngestQueue(object):
+  """
+  Decouples reading messages from the socket from handling them. The reader thread only timestamps each message and
+  puts it on a bounded queue, and a worker thread takes the messages off the queue in order and passes them to
+  dispatch(data, arrival_time). If the worker falls behind and the queue is full, the reader blocks (so the browser is
+  slowed down rather than messages being lost). If the queue is still full after put_timeout seconds, an event is
+  dropped, but a command response is waited on for as long as it takes, since a command waiting for it would otherwise
+  time out.
+
+  The statistics are updated on both threads, and read from others, so they are guarded by a lock.
+  """
+
+  def __init__(self, dispatch, maxsize=None, put_timeout=None):
+    self._dispatch = dispatch
+    self._queue = Queue(config['INGEST_QUEUE_SIZE'] if maxsize is None else maxsize)
+    self._put_timeout = config['INGEST_QUEUE_PUT_TIMEOUT'] if put_timeout is None else put_timeout
+    self._stats_lock = threading.Lock()
+    self._reset_stats()
+
+    self._worker = threading.Thread(target=self._work, name='mobster-ingest')
+    self._worker.setDaemon(True)
+    self._worker.start()
+
+  def _reset_stats(self):
+    self.max_depth = 0
+    # number of messages which found the queue full, and how many events were dropped as a result
+    self.blocked = 0
+    self.dropped = 0
+    # seconds messages spent on the queue, and seconds spent handling them
+    self.queue_latency = StatsAccumulator()
+    self.handler_latency = StatsAccumulator()
+
+  def put(self, data):
+    """Called on the reader thread for every message received"""
+    arrival_time = time.time()
+    try:
+      self._queue.put_nowait((data, arrival_time))
+    except Full:
+      with self._stats_lock:
+        self.blocked += 1
+      try:
+        self._queue.put((data, arrival_time), True, self._put_timeout)
+      except Full:
+        if not EVENT_METHOD_RE.match(data):
+          logging.warning('Still waiting for the ingest queue after {0}s to queue a response'.format(
+            self._put_timeout))
+          self._queue.put((data, arrival_time))
+        else:
+          with self._stats_lock:
+            self.dropped += 1
+          logging.error('Dropped event after waiting {0}s for the ingest queue'.format(self._put_timeout))
+          return
+    depth = self._queue.qsize()
+    if depth > self.max_depth:
+      with self._stats_lock:
+        self.max_depth = max(self.max_depth, depth)
+
+  def stop(self):
+    """Stops the worker once the messages already on the queue have been handled"""
+    self._queue.put(None)
+
+  def _work(self):
+    while True:
+      item = self._queue.get()
+
+      # None is our termination flag
+      if item is None:
+        break
+
+      data, arrival_time = item
+      start = time.time()
+      try:
+        self._dispatch(data, arrival_time)
+      except Exception:
+        logging.exception('Error while handling message')
+      end = time.time()
+      with self._stats_lock:
+        self.queue_latency.add(start - arrival_time)
+        self.handler_latency.add(end - start)
+
+  def get_stats(self, reset=False):
+    """Returns the statistics since the queue was created, or since they were last reset if reset was given"""
+    with self._stats_lock:
+      stats = {
+        'depth': self._queue.qsize(),
+        'maxDepth': self.max_depth,
+        'blocked': self.blocked,
+        'dropped': self.dropped,
+        'queueLatency': self.queue_latency.get_summary(),
+        'handlerLatency': self.handler_latency.get_summary()
+      }
+      if reset:
+        self._reset_stats()
+    return stats
+
+
+class BrowserConnectionError(Exception):
+  """Raised when the remote debugging endpoint of a browser cannot be reached"""
+
+
+def list_pages(host='localhost', port=None):
+  """
+  Returns the list of open browser pages (as reported by the /json endpoint) of
+  the browser listening on the given host and port. Raises a
+  BrowserConnectionError if the browser cannot be reached.
+  """
+  url = 'http://{0}:{1}/json'.format(host, port or config["WS_DEBUG_PORT"])
+  try:
+    response = urllib2.urlopen(url).read()
+  except urllib2.URLError, e:
+    raise BrowserConnectionError("Failed to connect to {0} ({1}). Please make sure a browser "
+                                 "is running with WebKit remote debugging enabled.".format(url, e.reason))
+
+  return json.loads(response)
+
+def get_debugger_url(page_num=0, host='localhost', port=None):
+  """
+  Accesses the list of open browser pages and returns the WebSocket debugger url
+  of the page with the specified index
+  """
+  page = list_pages(host, port)[page_num]
+  return page['webSocketDebuggerUrl']
+
+
+class ProtocolDispatcher(object):
+  """
+  Transport-independent half of a remote debugging protocol connection. Assigns
+  ids to outgoing commands, matches responses to their callbacks and futures,
+  and routes events to domain callbacks. Subclasses provide the transport by
+  implementing _enqueue(), and call dispatch_message() for every decoded
+  message.
+  """
+  __metaclass__ = ABCMeta
+
+  def __init__(self):
+    self._counter = 0
+    self._response_callbacks = {}
+    self._response_futures = {}
+    self._counter_lock = threading.Lock()
+    self._domain_callbacks = defaultdict(lambda: {})
+
+    # event method -> tuple of the callbacks of its domain. Filled in as events arrive and replaced whenever the domain
+    # callbacks change, so dispatching an event is a single dictionary lookup
+    self._event_callbacks = {}
+
+    # number of events which were dropped without decoding them, since no callback was registered for their domain
+    self.dropped_events = 0
+
+  @abstractmethod
+  def _enqueue(self, cmd):
+    """Hands a command (or a list of commands, for a batch) to the transport"""
+
+  def dispatch_raw(self, data, arrival_time=None):
+    """
+    Decodes a message exactly as it was received from the browser and dispatches it. Events which no callback is
+    registered for are dropped without being decoded.
+
+    If the time the message arrived at is given, events are passed to their callbacks with it as '_arrivalTime', so
+    that callbacks which run some time after the message arrived can still tell when it did.
+    """
+    match = EVENT_METHOD_RE.match(data)
+    if match and not self._callbacks_for_event(match.group(1)):
+      self.dropped_events += 1
+      return
+
+    response = decode_json(data)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+      logging.debug('Received: \n{0}'.format(pformat(response)))
+    if arrival_time is not None and 'method' in response:
+      response['_arrivalTime'] = arrival_time
+    self.dispatch_message(response)
+
+  def dispatch_message(self, response):
+    """Routes a decoded message to the callbacks waiting for it"""
+    if 'id' in response:
+      id = response['id']
+      self._response_callbacks.pop(id, lambda x: None)(response)
+      future = self._response_futures.pop(id, None)
+      if future:
+        future.set_result(response)
+    elif 'method' in response:
+      for callback in self._callbacks_for_event(response['method']):
+        callback(response)
+    else:
+      logging.warning('Unrecognized message: {0}'.format(pformat(response)))
+
+  def _callbacks_for_event(self, method):
+    """Returns the domain callbacks to call for an event with the given method"""
+    # hold on to the index, since another thread may replace it while we are filling it in
+    index = self._event_callbacks
+    try:
+      return index[method]
+    except KeyError:
+      domain = method.split('.')[0]
+      callbacks = tuple(self._domain_callbacks[domain].values()) if domain in self._domain_callbacks else ()
+      index[method] = callbacks
+      return callbacks
+
+  def send_cmd(self, method, params={}, callback=lambda x: None):
+    """
+    Sends a command to the browser. The given 'method' must be valid, or an
+    error will be returned. Automatically adds a unique ID to the command.
+    This allows the given callback to be called on all responses to the command
+    which is sent. Returns a CommandFuture which is completed with the response.
+    """
+
+    cmd = self.generate_cmd(method, params)
+    future = CommandFuture(cmd['id'], self._discard_command)
+    self._response_callbacks[cmd['id']] = callback
+    self._response_futures[cmd['id']] = future
+    self._enqueue(cmd)
+    return future
+
+  def send_batch(self, commands):
+    """
+    Sends a list of (method, params) commands to the browser in one go, so the
+    whole batch costs a single network round trip. Returns a BatchFuture which is
+    completed once every command has been answered.
+    """
+    cmds = [self.generate_cmd(method, params) for method, params in commands]
+    futures = [CommandFuture(cmd['id'], self._discard_command) for cmd in cmds]
+    for future in futures:
+      self._response_futures[future.id] = future
+    self._enqueue(cmds)
+    return BatchFuture(futures)
+
+  def _discard_command(self, cmd_id):
+    """Forgets a command whose response is no longer waited for, e.g. after it timed out"""
+    self._response_callbacks.pop(cmd_id, None)
+    self._response_futures.pop(cmd_id, None)
+
+  def add_domain_callback(self, domain, name, callback):
+    """
+    Adds a callback for responses based on their remote protocol domain. Will 
+    not be called for messages containing an ID. Common use case is timeline 
+    events, network events, etc.
+    """
+    self._domain_callbacks[domain][name] = callback
+    self._event_callbacks = {}
+
+  def remove_domain_callback(self, domain, name):
+    self._domain_callbacks[domain].pop(name)
+    self._event_callbacks = {}
+
+  def remove_domain_callbacks(self, domain):
+    self._domain_callbacks[domain].clear()
+    self._event_callbacks = {}
+
+  def generate_cmd(self, method, params):
+    """
+    Constructs a command according to the WebKit remote protocol (to be sent as
+    JSON)
+    """
+    # Give command a unique identifier so we can match callbacks
+    with self._counter_lock:
+      self._counter += 1
+      cmd_id = self._counter
+    return {'id': cmd_id, 'method': method, 'params': params}
+
+
+class RemoteWebKitCommunicator(ProtocolDispatcher, WebSocketClient):
   """
   Asynchronous interface for communicating with a remote WebKit-based browser 
   via remote debugging protocol. Currently tested only on desktop and Android 
@@ -26,47 +380,40 @@ class RemoteWebKitCommunicator(WebSocketClient):
   WebKit browser releases.
   """
 
-  def __init__(self, page_num = 0):
-    self._counter = 0
-    self._response_callbacks = {}
-    self._domain_callbacks = defaultdict(lambda: {})
+  def __init__(self, page_num = 0, ws_url=None):
+    ProtocolDispatcher.__init__(self)
     self._stopped = False
     self._command_queue = Queue()
 
-    # Access list of open browser pages and pick the page with the specified 
-    # index
-    url = 'http://localhost:{0}/json'.format(config["WS_DEBUG_PORT"])
-    try:
-      response = urllib2.urlopen(url).read()
-    except urllib2.URLError:
-      logging.error("Failed to connect. Please make sure a browser "   \
-                    "is running with WebKit remote debugging enabled.")
-      sys.exit()
+    # messages are handled on a worker thread, so slow callbacks do not hold up reading from the socket
+    self._ingest_queue = IngestQueue(self.dispatch_raw)
 
-    page_info = json.loads(response)
-    page = page_info[page_num]
-    debug_ws_url = page['webSocketDebuggerUrl']
-
-    super(RemoteWebKitCommunicator, self).__init__(debug_ws_url)
+    WebSocketClient.__init__(self, ws_url or get_debugger_url(page_num))
     self.start()
 
-  def opened(self): pass
+  def opened(self):
+    # commands are small and latency sensitive, so don't let Nagle's algorithm hold them back
+    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
   def closed(self, code, reason=None): pass
 
   def received_message(self, messageData):
     """Called whenever the WebSocket receives a message"""
-    response = json.loads(str(messageData))
-    logging.debug('Received: \n{0}'.format(pformat(response)))   
+    # decode the message's payload directly, rather than a copy of it. Older versions of ws4py buffer the payload in a
+    # bytearray, which the json module cannot decode
+    data = getattr(messageData, 'data', messageData)
+    if isinstance(data, bytearray):
+      data = str(data)
+    self._ingest_queue.put(data)
 
-    if 'id' in response:
-      id = response['id']
-      self._response_callbacks[id](response)
-    elif 'method' in response:
-      callbacks = self._domain_callbacks[response['method'].split('.')[0]].values()
-      for callback in callbacks: 
-        callback(response)
-    else:
-      logging.warning('Unrecognized message: {0}'.format(pformat(response)))
+  def get_ingest_stats(self, reset=False):
+    """
+    Returns statistics of the handling of received messages: the current and maximum number of messages waiting to be
+    handled, how many messages found the queue full and how many events were dropped, and summaries of the time (in
+    seconds) messages spent waiting and being handled. The statistics are since the connection was opened, or since
+    they were last reset, if reset is given to start afresh.
+    """
+    return self._ingest_queue.get_stats(reset)
 
 
   def start(self):
@@ -88,50 +435,32 @@ class RemoteWebKitCommunicator(WebSocketClient):
         if cmd == None:
           self.close()
           break
-        self.send(json.dumps(cmd))
-        logging.debug('Sent: \n{0}'.format(pformat(cmd)))
+
+        if isinstance(cmd, list):
+          self.send_frames([json.dumps(c) for c in cmd])
+        else:
+          self.send(json.dumps(cmd))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+          logging.debug('Sent: \n{0}'.format(pformat(cmd)))
 
     cmd_thread = threading.Thread(target=send_commands, args=())
     cmd_thread.setDaemon(True)
     cmd_thread.start()
 
-  def send_cmd(self, method, params={}, callback=lambda x: None):
+  def send_frames(self, messages):
     """
-    Sends a command to the browser. The given 'method' must be valid, or an
-    error will be returned. Automatically adds a unique ID to the command.
-    This allows the given callback to be called on all responses to the command
-    which is sent.
+    Writes several text messages to the socket with a single write, so that a
+    batch of commands is not split up into many small packets.
     """
+    frames = [self.stream.text_message(message).single(mask=self.stream.always_mask) for message in messages]
+    self.sock.sendall(''.join(frames))
 
-    cmd = self.generate_cmd(method, params)
-    self._response_callbacks[cmd['id']] = callback
+  def _enqueue(self, cmd):
     self._command_queue.put(cmd)
 
-  def add_domain_callback(self, domain, name, callback):
-    """
-    Adds a callback for responses based on their remote protocol domain. Will 
-    not be called for messages containing an ID. Common use case is timeline 
-    events, network events, etc.
-    """
-    self._domain_callbacks[domain][name] = callback
-
-  def remove_domain_callback(self, domain, name):
-    self._domain_callbacks[domain].pop(name)
-
-  def remove_domain_callbacks(self, domain):
-    self._domain_callbacks[domain].clear()
-
-  def generate_cmd(self, method, params):
-    """
-    Constructs a command according to the WebKit remote protocol (to be sent as
-    JSON)
-    """
-    # Give command a unique identifier so we can match callbacks
-    self._counter += 1
-    return {'id': self._counter, 'method': method, 'params': params}
-
   def stop(self):
     """
     Stops the sending and receiving threads
     """
     self._command_queue.put(None)
+    self._ingest_queue.stop()
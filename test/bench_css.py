@@ -0,0 +1,77 @@
+"""
+Benchmark for CSSProfileParser. Generates a synthetic CSS selector profile with the given number of rules, checks that
+the worst rules found in a single pass match those found by sorting, and compares the time taken with one nlargest
+pass over the rules per metric. Then adds the profile to a CSSSelectorIndex many times over, as for every page load of
+a flow, and reports the time taken and the most expensive selectors.
+
+Usage: python test/bench_css.py [number of rules]
+"""
+
+from heapq import nlargest
+import os
+import random
+import sys
+import time
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.har.css import CSSProfileParser, CSSSelectorIndex, RULE_METRICS
+
+PAGE_LOADS = 20
+
+
+def make_profile(num_rules, seed=0):
+  rand = random.Random(seed)
+  rules = []
+  for i in xrange(num_rules):
+    hit_count = rand.choice([0, rand.randrange(1, 1000)])
+    rules.append({'selector': '.rule{0}'.format(i), 'url': 'http://example.com/style{0}.css'.format(i % 7),
+                  'lineNumber': i, 'time': round(rand.expovariate(1.0), 1), 'hitCount': hit_count,
+                  'matchCount': rand.randrange(hit_count + 1)})
+  return {'result': {'profile': {'totalTime': sum(rule['time'] for rule in rules), 'data': rules}}}
+
+
+def check_top_rules(parser):
+  for metric, key in RULE_METRICS.iteritems():
+    expected = sorted(parser.rules, key=lambda rule: -key(rule['time'], rule['hitCount'], rule['matchCount']))
+    assert parser._get_worst_rules(metric, parser.top_rules_kept) == expected[:parser.top_rules_kept], metric
+  print 'worst {0} rules by {1} match a sort'.format(parser.top_rules_kept, ', '.join(sorted(RULE_METRICS)))
+
+
+def nlargest_passes(rules):
+  """The worst rule by every metric, found with one nlargest pass per metric"""
+  return [nlargest(1, rules, key=lambda rule: key(rule['time'], rule['hitCount'], rule['matchCount']))
+          for key in RULE_METRICS.itervalues()]
+
+
+def run(num_rules):
+  profile = make_profile(num_rules)
+
+  start = time.time()
+  parser = CSSProfileParser(profile)
+  parser.get_css_stats()
+  single_pass = time.time() - start
+
+  start = time.time()
+  nlargest_passes(parser.rules)
+  separate_passes = time.time() - start
+
+  check_top_rules(parser)
+  print '{0} rules: single pass {1:.3f}s (including stylesheet totals), one nlargest pass per metric ' \
+        '{2:.3f}s'.format(num_rules, single_pass, separate_passes)
+
+  index = CSSSelectorIndex()
+  start = time.time()
+  for i in xrange(PAGE_LOADS):
+    CSSProfileParser(profile, index)
+  elapsed = time.time() - start
+  top = index.get_top_selectors(3)
+  assert len(index) == num_rules and all(rule['profiles'] == PAGE_LOADS for rule in top)
+  print '{0} profiles added to an index in {1:.3f}s, most expensive selectors:'.format(PAGE_LOADS, elapsed)
+  for rule in top:
+    print '  {0:>8.1f}ms {1} ({2}:{3})'.format(rule['time'], rule['selector'], rule['url'], rule['lineNumber'])
+
+
+if __name__ == '__main__':
+  run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,66 @@
+"""
+Benchmark for decoding inbound DevTools messages. Compares the old path (json.loads of a copy of the message followed by
+an unconditional pformat for the debug log) with ProtocolDispatcher.dispatch_raw(), for events which a callback is
+registered for and for events which nobody is listening to.
+
+Usage: python test/bench_decode.py [number of messages]
+"""
+
+import json
+import logging
+import os
+from pprint import pformat
+import sys
+import time
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.webkitcommunicator import ProtocolDispatcher, decode_json
+
+
+def make_message(method, payload_size):
+  # like the browser, put the method before the params
+  params = json.dumps({'requestId': '1', 'frameId': '1', 'timestamp': 1000000.0, 'dataLength': 1400,
+                       'encodedDataLength': 700, 'payload': ['x' * 64] * (payload_size / 64)})
+  return '{{"method":"{0}","params":{1}}}'.format(method, params)
+
+
+def old_dispatch(dispatcher, data):
+  response = json.loads(str(data))
+  logging.debug('Received: \n{0}'.format(pformat(response)))
+  dispatcher.dispatch_message(response)
+
+
+class ReceivingDispatcher(ProtocolDispatcher):
+  """Dispatcher of received messages only, which sends nothing"""
+
+  def _enqueue(self, cmd):
+    pass
+
+
+def time_it(func, dispatcher, messages):
+  start = time.time()
+  for message in messages:
+    func(dispatcher, message)
+  return time.time() - start
+
+
+def run(num_messages, payload_size):
+  dispatcher = ReceivingDispatcher()
+  dispatcher.add_domain_callback('Network', 'bench', lambda m: None)
+
+  for method in ['Network.dataReceived', 'Timeline.eventRecorded']:
+    messages = [bytearray(make_message(method, payload_size)) for i in xrange(num_messages)]
+    old = time_it(old_dispatch, dispatcher, messages)
+    new = time_it(lambda d, m: d.dispatch_raw(str(m)), dispatcher, messages)
+    print '{0:<24} {1:>7}B payload: old {2:7.3f}s, new {3:7.3f}s ({4:5.1f}x)'.format(
+      method, payload_size, old, new, old / new)
+
+
+if __name__ == '__main__':
+  num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  print 'JSON decoder: {0}'.format(decode_json.__module__)
+
+  run(num_messages, 256)
+  run(num_messages, 16 * 1024)
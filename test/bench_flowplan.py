@@ -0,0 +1,72 @@
+"""
+Benchmark for compiled flow plans. Against a local fake DevTools server which delays every response to emulate the
+round trip to a device, times the setup actions of a login-like navigation done one run_js at a time, as flows used to
+be run, and fused into as few evaluated scripts as the flow plan can.
+
+Usage: python test/bench_flowplan.py [round trip latency in ms]
+"""
+
+import os
+import sys
+import time
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from fakedevtools import FakeDevToolsServer, page_load_responder
+from linkedin.mobster.har.flowplan import ACTION_JS, compile_flow
+from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.webkitclient import RemoteWebKitClient
+from linkedin.mobster.webkitcommunicator import RemoteWebKitCommunicator
+
+SETUP_ACTIONS = [
+  {'type': 'textfield-set', 'params': {'id': 'session_key', 'value': 'user@example.com'}},
+  {'type': 'dispatch-event', 'params': {'event-type': 'change', 'id': 'session_key'}},
+  {'type': 'textfield-set', 'params': {'id': 'session_password', 'value': 'secret'}},
+  {'type': 'dispatch-event', 'params': {'event-type': 'change', 'id': 'session_password'}},
+  {'type': 'click', 'params': {'id': 'remember_me'}},
+  {'type': 'raw-js', 'params': {'lines': ['window.scrollTo(0, 100)']}},
+  {'type': 'textfield-set', 'params': {'id': 'captcha', 'value': 'abc'}},
+  {'type': 'dispatch-event', 'params': {'event-type': 'blur', 'class': 'captcha'}},
+  {'type': 'click', 'params': {'id': 'terms'}},
+  {'type': 'raw-js', 'params': {'lines': ['localStorage.clear()']}},
+  {'type': 'textfield-set', 'params': {'id': 'locale', 'value': 'en_US'}},
+  {'type': 'click', 'params': {'id': 'expand'}}
+]
+
+FLOW = {'navigations': [SETUP_ACTIONS + [{'type': 'form-submit', 'params': {'id': 'login'}, 'page-name': 'Home'}]]}
+
+
+def make_delayed_responder(latency):
+  def delayed_responder(cmd):
+    time.sleep(latency)
+    return page_load_responder(cmd)
+  return delayed_responder
+
+
+def separate_round_trips(client):
+  for action in SETUP_ACTIONS:
+    client.run_js(ACTION_JS[action['type']](action['params']))
+
+
+def measure(label, func, rounds=5):
+  start = time.time()
+  for i in range(rounds):
+    func()
+  print '{0:<36} {1:8.1f}ms'.format(label, (time.time() - start) * 1000 / rounds)
+
+
+if __name__ == '__main__':
+  latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+
+  server = FakeDevToolsServer(responder=make_delayed_responder(latency)).start()
+  config['WS_DEBUG_PORT'] = server.port
+  client = RemoteWebKitClient(RemoteWebKitCommunicator())
+  plan = compile_flow(FLOW)[0]
+
+  print '{0} setup actions, {1:.0f}ms per round trip:'.format(len(SETUP_ACTIONS), latency * 1000)
+  measure('one run_js per action', lambda: separate_round_trips(client))
+  measure('fused ({0} steps)'.format(len(plan.setup_steps)), lambda: plan.run_setup(client))
+
+  client.stop()
+  server.shutdown()
@@ -0,0 +1,149 @@
+"""
+Benchmark for the heap snapshot analyzer. Generates a synthetic heap snapshot in Chrome's format (in a separate process,
+so that generating it does not count towards the peak memory), then reports how long it takes to parse it from the
+file a chunk at a time and to compute the dominator tree and retained sizes, along with the peak memory of the
+process. On a small graph, the dominators are also checked against a brute force computation.
+
+Usage: python test/bench_heap.py [number of nodes]
+"""
+
+import json
+from multiprocessing import Process
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.heap import HeapSnapshotParser, parse_heap_snapshot
+
+NODE_FIELDS = ['type', 'name', 'id', 'self_size', 'edge_count', 'trace_node_id']
+NODE_TYPES = ['hidden', 'array', 'string', 'object', 'code', 'closure', 'regexp', 'number', 'native', 'synthetic']
+EDGE_FIELDS = ['type', 'name_or_index', 'to_node']
+EDGE_TYPES = ['context', 'element', 'property', 'internal', 'hidden', 'shortcut', 'weak']
+
+CONSTRUCTORS = ['Object', 'Array', 'HTMLDivElement', 'Closure', 'system / Context', 'String', 'Foo', 'Bar']
+
+
+def make_graph(num_nodes, seed=0):
+  """
+  Returns a random heap-like graph as a list of edge lists. Node 0 is the root, and every other node is reachable from a
+  parent with a lower index, plus some extra strong and weak edges.
+  """
+  rand = random.Random(seed)
+  graph = [[] for i in xrange(num_nodes)]
+  for node in xrange(1, num_nodes):
+    graph[rand.randrange(max(node - 50, 0), node)].append((2, node))
+    for i in xrange(rand.randrange(3)):
+      graph[rand.randrange(num_nodes)].append((rand.choice([2, 2, 1, 6]), node))
+  return graph
+
+
+def serialize(graph, seed=0):
+  """Serializes the graph as a Chrome heap snapshot"""
+  rand = random.Random(seed)
+  nodes = []
+  edges = []
+  for node, node_edges in enumerate(graph):
+    node_type = 9 if node < 2 else rand.randrange(9)
+    nodes.extend([node_type, rand.randrange(len(CONSTRUCTORS)), node * 2 + 1, rand.randrange(16, 256),
+                  len(node_edges), 0])
+    for edge_type, to_node in node_edges:
+      edges.extend([edge_type, 0, to_node * len(NODE_FIELDS)])
+
+  snapshot = {'meta': {'node_fields': NODE_FIELDS, 'node_types': [NODE_TYPES, 'string', 'number', 'number', 'number',
+                                                                   'number'],
+                       'edge_fields': EDGE_FIELDS, 'edge_types': [EDGE_TYPES, 'string_or_number', 'node']},
+              'node_count': len(graph), 'edge_count': len(edges) / 3}
+
+  # like Chrome, write the numbers a line at a time
+  def number_lines(numbers, width):
+    return '\n,'.join(','.join(str(n) for n in numbers[i:i + width]) for i in xrange(0, len(numbers), width))
+
+  return '{{"snapshot":{0},\n"nodes":[{1}],\n"edges":[{2}],\n"strings":{3}}}'.format(
+    json.dumps(snapshot), number_lines(nodes, len(NODE_FIELDS)), number_lines(edges, len(EDGE_FIELDS)),
+    json.dumps(CONSTRUCTORS))
+
+
+def brute_force_dominators(graph):
+  """Returns the immediate dominator of every node reachable from the root via strong edges"""
+  def reachable(removed):
+    seen = set([0]) if removed != 0 else set()
+    stack = list(seen)
+    while stack:
+      for edge_type, child in graph[stack.pop()]:
+        if edge_type != 6 and child != removed and child not in seen:
+          seen.add(child)
+          stack.append(child)
+    return seen
+
+  all_reachable = reachable(None)
+  dominated_by = dict((node, set([node])) for node in all_reachable)
+  for candidate in all_reachable:
+    for node in all_reachable - reachable(candidate):
+      dominated_by[node].add(candidate)
+
+  # the immediate dominator is the strict dominator which is dominated by all the others
+  idoms = {0: 0}
+  for node, dominators in dominated_by.iteritems():
+    strict = dominators - set([node])
+    for candidate in strict:
+      if dominated_by[candidate] >= strict:
+        idoms[node] = candidate
+  return idoms
+
+
+def parse(data, chunk_size=64 * 1024):
+  parser = HeapSnapshotParser()
+  for i in xrange(0, len(data), chunk_size):
+    parser.feed(unicode(data[i:i + chunk_size]))
+  return parser.close()
+
+
+def check_dominators():
+  graph = make_graph(300, seed=1)
+  snapshot = parse(serialize(graph, seed=1), chunk_size=97)
+  snapshot.compute_retained_sizes()
+  expected = brute_force_dominators(graph)
+  for node in xrange(len(graph)):
+    assert snapshot.dominators[node] == expected.get(node, -1), node
+  print 'dominators of a {0} node graph match the brute force computation'.format(len(graph))
+
+
+def write_snapshot(num_nodes, path):
+  with open(path, 'w') as f:
+    f.write(serialize(make_graph(num_nodes)))
+
+
+def run(num_nodes):
+  path = tempfile.mktemp(suffix='.heapsnapshot')
+  generator = Process(target=write_snapshot, args=(num_nodes, path))
+  generator.start()
+  generator.join()
+
+  try:
+    start = time.time()
+    with open(path) as f:
+      snapshot = parse_heap_snapshot(f)
+    parsed = time.time()
+    summary = snapshot.get_summary(10)
+    analyzed = time.time()
+    size = os.path.getsize(path)
+  finally:
+    os.remove(path)
+
+  assert snapshot.node_count == num_nodes
+  assert summary['_reachableSize'] <= summary['_totalSize']
+  print '{0:>9} nodes, {1:>9} edges, {2:7.1f}MB snapshot: parse {3:6.2f}s, dominators/retained sizes {4:6.2f}s, ' \
+        '{5:7.1f}MB peak RSS'.format(snapshot.node_count, snapshot.edge_count, size / 1024.0 / 1024,
+                                     parsed - start, analyzed - parsed,
+                                     resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
+
+if __name__ == '__main__':
+  check_dominators()
+  run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,80 @@
+"""
+Benchmark for handling received messages off the reader thread. Simulates a reader thread receiving a burst of
+Network and Timeline events whose callbacks do some work, and compares handling each message on the reader thread (as
+before) with handing it to an IngestQueue. Reports how long the reader is held up per message, which is what delays
+the next socket read, and the queue's statistics.
+
+Usage: python test/bench_ingest.py [number of messages]
+"""
+
+import json
+import os
+import sys
+import time
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.har.network import NetworkEventHandler
+from linkedin.mobster.har.timeline import TimelineEventHandler
+from linkedin.mobster.webkitcommunicator import IngestQueue, ProtocolDispatcher
+
+
+def make_messages(num_messages):
+  messages = []
+  for i in xrange(num_messages):
+    if i % 2:
+      record = {'type': 'Layout', 'startTime': i, 'endTime': i + 1, 'usedHeapSize': 10 ** 6, 'totalHeapSize': 10 ** 7,
+                'children': [{'type': 'Paint', 'startTime': i, 'endTime': i + 0.5, 'usedHeapSize': 10 ** 6,
+                              'totalHeapSize': 10 ** 7}] * 20}
+      messages.append('{{"method":"Timeline.eventRecorded","params":{0}}}'.format(json.dumps({'record': record})))
+    else:
+      messages.append('{{"method":"Network.dataReceived","params":{0}}}'.format(json.dumps({
+        'requestId': str(i), 'timestamp': time.time(), 'dataLength': 1000, 'encodedDataLength': 500})))
+  return messages
+
+
+class ReceivingDispatcher(ProtocolDispatcher):
+  """Dispatcher of received messages only, which sends nothing"""
+
+  def _enqueue(self, cmd):
+    pass
+
+
+def make_dispatcher():
+  dispatcher = ReceivingDispatcher()
+  dispatcher.add_domain_callback('Network', 'bench', NetworkEventHandler().process_event)
+  dispatcher.add_domain_callback('Timeline', 'bench', TimelineEventHandler().process_event)
+  return dispatcher
+
+
+def run(num_messages):
+  messages = make_messages(num_messages)
+
+  dispatcher = make_dispatcher()
+  start = time.time()
+  for message in messages:
+    dispatcher.dispatch_raw(message)
+  inline = time.time() - start
+
+  dispatcher = make_dispatcher()
+  ingest_queue = IngestQueue(dispatcher.dispatch_raw, maxsize=num_messages)
+  start = time.time()
+  for message in messages:
+    ingest_queue.put(message)
+  queued = time.time() - start
+  ingest_queue.stop()
+  ingest_queue._worker.join()
+  drained = time.time() - start
+
+  print 'reader thread time per message: inline {0:6.1f}us, queued {1:6.1f}us ({2:.1f}x)'.format(
+    inline * 1e6 / num_messages, queued * 1e6 / num_messages, inline / queued)
+  print 'all {0} messages handled after {1:.3f}s (inline {2:.3f}s)'.format(num_messages, drained, inline)
+  stats = ingest_queue.get_stats()
+  print 'max depth {0}, blocked {1}, dropped {2}, handler latency p50 {3:.1f}us p99 {4:.1f}us'.format(
+    stats['maxDepth'], stats['blocked'], stats['dropped'], stats['handlerLatency']['p50'] * 1e6,
+    stats['handlerLatency']['p99'] * 1e6)
+
+
+if __name__ == '__main__':
+  run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,82 @@
+"""
+Benchmark and leak check for utils.memoize. Creates the given number of CSSProfileParsers, calling their memoized
+methods on each one, and checks that none of them is still alive once they are dropped. Then reports the time of a
+cache hit, and checks the LRU eviction and expiry of a small cache.
+
+Usage: python test/bench_memoize.py [number of parsers]
+"""
+
+import gc
+import os
+import sys
+import time
+import weakref
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.har.css import CSSProfileParser
+from linkedin.mobster.utils import memoize
+
+
+def make_css_data(num_rules):
+  rules = [{'selector': '.rule{0}'.format(i), 'url': 'http://example.com/style.css', 'lineNumber': i,
+            'time': i % 17, 'hitCount': i % 13 + 1, 'matchCount': i % 7} for i in xrange(num_rules)]
+  return {'result': {'profile': {'totalTime': sum(rule['time'] for rule in rules), 'data': rules}}}
+
+
+def check_no_leak(num_parsers):
+  css_data = make_css_data(50)
+  refs = []
+  start = time.time()
+  for i in xrange(num_parsers):
+    parser = CSSProfileParser(css_data)
+    parser.get_css_stats()
+    parser.get_rules_worst_match_ratio(10)
+    refs.append(weakref.ref(parser))
+  elapsed = time.time() - start
+  del parser
+  gc.collect()
+
+  alive = sum(1 for ref in refs if ref() is not None)
+  assert alive == 0, '{0} parsers are still alive'.format(alive)
+  info = CSSProfileParser.get_css_stats.cache_info()
+  assert info['size'] == 0
+  print '{0} parsers created and released in {1:.3f}s, none kept alive; get_css_stats: {2}'.format(
+    num_parsers, elapsed, info)
+
+
+def time_hits(num_calls):
+  parser = CSSProfileParser(make_css_data(50))
+  parser.get_css_stats()
+  start = time.time()
+  for i in xrange(num_calls):
+    parser.get_css_stats()
+  elapsed = time.time() - start
+  print '{0} cache hits: {1:.2f}us/call'.format(num_calls, elapsed * 1e6 / num_calls)
+
+
+def check_lru_and_ttl():
+  calls = []
+
+  @memoize(maxsize=2, ttl=0.05)
+  def square(x):
+    calls.append(x)
+    return x * x
+
+  square(1), square(2), square(1), square(3)
+  assert calls == [1, 2, 3]
+  square(2)
+  assert calls == [1, 2, 3, 2], 'least recently used entry was not evicted'
+  time.sleep(0.06)
+  square(2)
+  assert calls == [1, 2, 3, 2, 2], 'expired entry was returned'
+  info = square.cache_info()
+  assert (info['hits'], info['misses'], info['evictions'], info['expirations']) == (1, 5, 2, 1), info
+  print 'LRU eviction and expiry: {0}'.format(info)
+
+
+if __name__ == '__main__':
+  check_no_leak(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
+  time_hits(100000)
+  check_lru_and_ttl()
@@ -0,0 +1,81 @@
+"""
+Benchmark for NetworkEventHandler. Replays a large synthetic stream of Network events through process_event and
+reports the processing time and the number of objects the handler retains. Retained objects should grow with the
+number of requests, not with the number of dataReceived packets.
+
+Usage: python test/bench_network.py [number of requests] [packets per request]
+"""
+
+import os
+import sys
+import time
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.har.network import NetworkEventHandler
+
+
+def make_event_stream(num_requests, packets_per_request):
+  """Generates the events of num_requests requests, each of which receives its body in packets_per_request packets"""
+  start = 1000000.0
+  for i in xrange(num_requests):
+    request_id = str(i)
+    base = {'requestId': request_id, 'frameId': '1', 'timestamp': start + i}
+    yield {'method': 'Network.requestWillBeSent', 'params': dict(base, request={
+      'url': 'http://example.com/resource{0}'.format(i), 'method': 'GET', 'headers': {'Accept': '*/*'}})}
+    yield {'method': 'Network.responseReceived', 'params': dict(base, response={
+      'status': 200, 'statusText': 'OK', 'headers': {'Content-Type': 'text/html'}, 'timing': {
+        'requestTime': start + i, 'dnsStart': 0, 'dnsEnd': 1, 'connectStart': 1, 'connectEnd': 3, 'sendStart': 3,
+        'sendEnd': 4}})}
+    for p in xrange(packets_per_request):
+      yield {'method': 'Network.dataReceived', 'params': dict(base, timestamp=start + i + p * 0.001, dataLength=1400,
+                                                              encodedDataLength=700)}
+    yield {'method': 'Network.loadingFinished', 'params': dict(base, timestamp=start + i + 1)}
+
+
+def deep_sizeof(obj, seen=None):
+  """Returns the size in bytes of obj and of everything reachable from it"""
+  seen = seen if seen is not None else set()
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.iteritems())
+  elif isinstance(obj, (list, tuple, set)):
+    size += sum(deep_sizeof(item, seen) for item in obj)
+  elif hasattr(obj, '__dict__'):
+    size += deep_sizeof(obj.__dict__, seen)
+  if hasattr(obj, '__slots__'):
+    size += sum(deep_sizeof(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+  return size
+
+
+def run(num_requests, packets_per_request):
+  events = list(make_event_stream(num_requests, packets_per_request))
+  handler = NetworkEventHandler()
+  start = time.time()
+  for event in events:
+    handler.process_event(event)
+  elapsed = time.time() - start
+
+  del events
+  retained = deep_sizeof(handler)
+
+  entries = handler.make_entry_list()
+  assert len(entries) == num_requests
+  assert entries[0]['response']['bodySize'] == 1400 * packets_per_request
+
+  num_events = num_requests * (packets_per_request + 3)
+  print '{0:>6} requests x {1:>4} packets: {2:8.3f}s ({3:6.2f}us/event), {4:8.2f}MB retained'.format(
+    num_requests, packets_per_request, elapsed, elapsed * 1e6 / num_events, retained / 1024.0 / 1024)
+
+
+if __name__ == '__main__':
+  num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  packets_per_request = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+  run(num_requests, 1)
+  run(num_requests, packets_per_request)
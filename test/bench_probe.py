@@ -0,0 +1,55 @@
+"""
+Benchmark for RemoteWebKitClient.probe_page(). Against a local fake DevTools server which delays every response to
+emulate the round trip to a device, times fetching what is recorded about a page after it loads with one call per
+value, as make_page_info used to, and with the single round trip of probe_page().
+
+Usage: python test/bench_probe.py [round trip latency in ms]
+"""
+
+import os
+import sys
+import time
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from fakedevtools import FakeDevToolsServer, page_load_responder
+from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.webkitclient import RemoteWebKitClient
+from linkedin.mobster.webkitcommunicator import RemoteWebKitCommunicator
+
+
+def make_delayed_responder(latency):
+  def delayed_responder(cmd):
+    time.sleep(latency)
+    return page_load_responder(cmd)
+  return delayed_responder
+
+
+def separate_calls(client):
+  return client.run_js('document.title'), client.get_window_performance(), client.get_dom_node_count()
+
+
+def measure(label, func, rounds=10):
+  start = time.time()
+  for i in range(rounds):
+    func()
+  print '{0:<28} {1:8.1f}ms'.format(label, (time.time() - start) * 1000 / rounds)
+
+
+if __name__ == '__main__':
+  latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+
+  server = FakeDevToolsServer(responder=make_delayed_responder(latency)).start()
+  config['WS_DEBUG_PORT'] = server.port
+  client = RemoteWebKitClient(RemoteWebKitCommunicator())
+
+  probe = client.probe_page(include_dom_node_count=True)
+  assert probe['title'] and probe['timing']['loadEventEnd'] and probe['domNodeCount']
+
+  print '{0:.0f}ms per round trip:'.format(latency * 1000)
+  measure('one call per value', lambda: separate_calls(client))
+  measure('probe_page', lambda: client.probe_page(include_dom_node_count=True))
+
+  client.stop()
+  server.shutdown()
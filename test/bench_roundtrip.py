@@ -0,0 +1,74 @@
+"""
+Micro-benchmark for protocol round trip latency. Runs against a local fake DevTools server which answers every
+command immediately, so the measured latency is mobster's own overhead.
+
+Usage: python test/bench_roundtrip.py [number of round trips]
+"""
+
+import os
+import sys
+import time
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from fakedevtools import FakeDevToolsServer
+from linkedin.mobster.mobsterconfig import config
+from linkedin.mobster.utils import wait_until
+from linkedin.mobster.webkitclient import CommandBatch, RemoteWebKitClient
+from linkedin.mobster.webkitcommunicator import RemoteWebKitCommunicator
+
+
+def polling_sendw(communicator, command):
+  """The previous implementation of RemoteWebKitClient._sendw, which polls a flag every 100ms"""
+  received = []
+  communicator.send_cmd(command, {}, received.append)
+  wait_until(lambda: received)
+  return received[0]
+
+
+SETUP_COMMANDS = ['Network.enable', 'Timeline.setIncludeMemoryDetails', 'Timeline.start', 'Page.enable',
+                  'CSS.startSelectorProfiler']
+
+
+def sequential_setup(client):
+  for command in SETUP_COMMANDS:
+    client._sendw(command)
+
+
+def batched_setup(client):
+  batch = CommandBatch()
+  for command in SETUP_COMMANDS:
+    batch.add(command)
+  client.send_batch(batch)
+
+
+def measure(label, func, rounds):
+  latencies = []
+  for i in range(rounds):
+    start = time.time()
+    func()
+    latencies.append((time.time() - start) * 1000)
+
+  latencies.sort()
+  print '{0:<24} mean {1:8.3f}ms   median {2:8.3f}ms   max {3:8.3f}ms'.format(
+    label, sum(latencies) / len(latencies), latencies[len(latencies) / 2], latencies[-1])
+
+
+if __name__ == '__main__':
+  rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+  server = FakeDevToolsServer().start()
+  config['WS_DEBUG_PORT'] = server.port
+
+  communicator = RemoteWebKitCommunicator()
+  client = RemoteWebKitClient(communicator)
+
+  measure('_sendw (futures)', lambda: client._sendw('Page.enable'), rounds)
+  measure('run_js (futures)', lambda: client.run_js('document.title'), rounds)
+  measure('setup (sequential)', lambda: sequential_setup(client), rounds)
+  measure('setup (send_batch)', lambda: batched_setup(client), rounds)
+  measure('_sendw (100ms polling)', lambda: polling_sendw(communicator, 'Page.enable'), max(rounds / 20, 5))
+
+  client.stop()
+  server.shutdown()
@@ -0,0 +1,86 @@
+"""
+Benchmark for the daemon mode in server.py. Against a local fake DevTools server which delays every response to
+emulate the round trip to a device, times running a one page flow the way a CI job would without a daemon, i.e. a new
+run of bin/mobster.py for every flow (starting the interpreter, finding the page through /json and connecting to it),
+and as a job posted to the HTTP API of a daemon, which keeps its connection open between jobs.
+
+Usage: python test/bench_server.py [round trip latency in ms]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+MOBSTER_HOME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(MOBSTER_HOME, 'src')))
+
+from fakedevtools import FakeDevToolsServer, page_load_responder
+from linkedin.mobster.server import ProfilingService, make_server
+
+FLOW = {
+  'navigations': [[{'type': 'navigate', 'params': {'url': 'http://example.com'}, 'page-name': 'Example',
+                    'network-timeout': 0.05, 'network-grace-period': 0}]]
+}
+
+
+def make_delayed_responder(latency):
+  def delayed_responder(cmd):
+    time.sleep(latency)
+    return page_load_responder(cmd)
+  return delayed_responder
+
+
+def run_mobster(port, flow_file, har_file):
+  subprocess.check_call([sys.executable, os.path.join(MOBSTER_HOME, 'bin', 'mobster.py'), '-o', str(port),
+                         '-t', flow_file, '-ho', har_file])
+  with open(har_file) as f:
+    assert len(json.load(f)) == 1
+
+
+def post_job(address):
+  response = urllib2.urlopen('http://{0}:{1}/jobs'.format(*address), json.dumps({'flow': FLOW}))
+  lines = [json.loads(line) for line in response]
+  assert len(lines) == 2 and 'error' not in lines[-1]['_job'], lines[-1]
+
+
+def measure(label, func, rounds=10):
+  start = time.time()
+  for i in range(rounds):
+    func()
+  print '{0:<28} {1:8.1f}ms'.format(label, (time.time() - start) * 1000 / rounds)
+
+
+if __name__ == '__main__':
+  latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+
+  devtools = FakeDevToolsServer(responder=make_delayed_responder(latency)).start()
+  service = ProfilingService('localhost:{0}/0'.format(devtools.port))
+  server = make_server('localhost:0', service)
+  server_thread = threading.Thread(target=server.serve_forever)
+  server_thread.setDaemon(True)
+  server_thread.start()
+
+  flow_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+  json.dump(FLOW, flow_file)
+  flow_file.close()
+  har_file = flow_file.name + '.har'
+
+  # the first job of the daemon opens its connection
+  post_job(server.server_address)
+
+  print '{0:.0f}ms per round trip:'.format(latency * 1000)
+  measure('bin/mobster.py per flow', lambda: run_mobster(devtools.port, flow_file.name, har_file))
+  measure('job posted to a daemon', lambda: post_job(server.server_address))
+
+  server.shutdown()
+  service.stop()
+  devtools.shutdown()
+  os.remove(flow_file.name)
+  os.remove(har_file)
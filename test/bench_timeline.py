@@ -0,0 +1,122 @@
+"""
+Benchmark for TimelineEventHandler. Replays synthetic Timeline.eventRecorded events, totalling the given number of
+records, through process_event and reports the processing time along with the resulting per record type table of
+counts, total time and self time. Also times a single very deep chain of records, which a recursive traversal could
+not handle.
+
+Usage: python test/bench_timeline.py [number of records]
+"""
+
+import os
+import random
+import sys
+import time
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.har.timeline import TimelineEventHandler
+
+# record type -> (relative frequency, mean duration in ms)
+RECORD_TYPES = {
+  'EvaluateScript': (2, 4.0),
+  'FunctionCall': (4, 1.5),
+  'TimerFire': (1, 2.0),
+  'Layout': (3, 1.2),
+  'RecalculateStyles': (3, 0.8),
+  'Paint': (3, 0.6),
+  'GCEvent': (1, 3.0),
+  'ParseHTML': (1, 2.5),
+  'TimeStamp': (1, 0)
+}
+
+DEEP_CHAIN_LENGTH = 5000
+
+
+def make_record(rand, start, end, depth, budget):
+  """
+  Returns a random record which starts at start and ends no later than end, with random records nested under it. Every
+  record made uses up one from budget[0].
+  """
+  record_type = rand.choice([t for t, (weight, mean) in RECORD_TYPES.iteritems() for i in range(weight)])
+  mean_duration = RECORD_TYPES[record_type][1]
+  budget[0] -= 1
+
+  record = {'type': record_type, 'startTime': start, 'usedHeapSize': rand.randrange(10 ** 6, 10 ** 7),
+            'totalHeapSize': 10 ** 7}
+  if not mean_duration:
+    return record
+
+  record['endTime'] = min(start + rand.expovariate(1 / mean_duration), end)
+  children = []
+  child_start = start
+  while depth < 6 and budget[0] > 0 and child_start < record['endTime'] and rand.random() < 0.7:
+    child = make_record(rand, child_start, record['endTime'], depth + 1, budget)
+    child_start = child.get('endTime', child_start)
+    children.append(child)
+  if children:
+    record['children'] = children
+  return record
+
+
+def make_events(num_records, seed=0):
+  """Returns Timeline.eventRecorded events containing num_records records, each one rooted at a Program record"""
+  rand = random.Random(seed)
+  events = []
+  budget = [num_records]
+  start = 1000000.0
+  while budget[0] > 0:
+    program = {'type': 'Program', 'startTime': start, 'endTime': start + 50, 'children': []}
+    budget[0] -= 1
+    child_start = start
+    while budget[0] > 0 and child_start < program['endTime']:
+      child = make_record(rand, child_start, program['endTime'], 0, budget)
+      child_start = child.get('endTime', child_start) + 0.1
+      program['children'].append(child)
+    events.append({'method': 'Timeline.eventRecorded', 'params': {'record': program}})
+    start += 50
+  return events
+
+
+DEEP_RECORD = {'type': 'FunctionCall', 'startTime': 0.0, 'endTime': 1.0, 'usedHeapSize': 10 ** 6,
+               'totalHeapSize': 10 ** 7}
+
+
+def make_deep_event(length):
+  """Returns a Timeline.eventRecorded event holding a single chain of length nested function calls"""
+  root = record = dict(DEEP_RECORD)
+  for i in xrange(1, length):
+    child = dict(DEEP_RECORD)
+    record['children'] = [child]
+    record = child
+  return {'method': 'Timeline.eventRecorded', 'params': {'record': root}}
+
+
+def time_events(events):
+  handler = TimelineEventHandler()
+  start = time.time()
+  for event in events:
+    handler.process_event(event)
+  return handler, time.time() - start
+
+
+def run(num_records):
+  events = make_events(num_records)
+  handler, elapsed = time_events(events)
+
+  print '{0} records in {1} events: {2:.3f}s ({3:.2f}us/record)\n'.format(num_records, len(events), elapsed,
+                                                                        elapsed * 1e6 / num_records)
+
+  record_types = handler.get_event_stats()['_recordTypes']
+  print '{0:<20} {1:>8} {2:>14} {3:>14}'.format('Record Type', 'Count', 'Total (ms)', 'Self (ms)')
+  for record_type, stats in sorted(record_types.iteritems(), key=lambda item: -item[1]['selfTime']):
+    print '{0:<20} {1:>8} {2:>14.1f} {3:>14.1f}'.format(record_type, stats['count'], stats['totalTime'],
+                                                        stats['selfTime'])
+
+  handler, elapsed = time_events([make_deep_event(DEEP_CHAIN_LENGTH)])
+  assert handler.get_event_stats()['_recordTypes']['FunctionCall']['count'] == DEEP_CHAIN_LENGTH
+  print '\nchain of {0} nested records: {1:.3f}s'.format(DEEP_CHAIN_LENGTH, elapsed)
+
+
+if __name__ == '__main__':
+  run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
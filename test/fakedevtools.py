@@ -0,0 +1,210 @@
+"""
+A minimal, local stand-in for a browser's remote debugging endpoint. It serves the /json page listing and answers
+every protocol command on the WebSocket immediately, which makes it useful for measuring mobster's own overhead.
+"""
+
+import base64
+import hashlib
+import json
+import SocketServer
+import struct
+import threading
+import time
+
+WS_MAGIC = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def read_frame(rfile):
+  """Reads a single (masked) client frame and returns (opcode, payload)"""
+  header = rfile.read(2)
+  if len(header) < 2:
+    return None, None
+
+  opcode = ord(header[0]) & 0x0f
+  masked = ord(header[1]) & 0x80
+  length = ord(header[1]) & 0x7f
+  if length == 126:
+    length = struct.unpack('!H', rfile.read(2))[0]
+  elif length == 127:
+    length = struct.unpack('!Q', rfile.read(8))[0]
+
+  mask = rfile.read(4) if masked else '\x00' * 4
+  data = bytearray(rfile.read(length))
+  for i in xrange(len(data)):
+    data[i] ^= ord(mask[i % 4])
+  return opcode, str(data)
+
+
+def make_frame(payload, opcode=0x1):
+  """Makes a single unmasked server frame"""
+  length = len(payload)
+  if length < 126:
+    header = struct.pack('!BB', 0x80 | opcode, length)
+  elif length < 65536:
+    header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+  else:
+    header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+  return header + payload
+
+
+def default_responder(cmd):
+  """Returns the list of messages the fake browser sends back for the given command"""
+  if cmd['method'] == 'Runtime.evaluate':
+    return [{'id': cmd['id'], 'result': {'result': {'type': 'string', 'value': 'fake'}}}]
+  return [{'id': cmd['id'], 'result': {}}]
+
+
+def page_load_responder(cmd, num_resources=3):
+  """
+  Responds like a browser loading a small page: navigating produces network events for a few resources followed by
+  Page.loadEventFired, and the queries mobster makes after a page load return plausible values.
+  """
+  method = cmd['method']
+  now = time.time()
+
+  if method == 'Page.navigate':
+    messages = [{'id': cmd['id'], 'result': {}}]
+    for i in range(num_resources):
+      request_id = '{0}.{1}'.format(cmd['id'], i)
+      base = {'requestId': request_id, 'frameId': '1', 'timestamp': now}
+      messages.append({'method': 'Network.requestWillBeSent', 'params': dict(base, request={
+        'url': '{0}/resource{1}'.format(cmd['params']['url'], i), 'method': 'GET', 'headers': {}})})
+      messages.append({'method': 'Network.responseReceived', 'params': dict(base, response={
+        'status': 200, 'statusText': 'OK', 'headers': {}, 'timing': {
+          'requestTime': now, 'dnsStart': 0, 'dnsEnd': 1, 'connectStart': 1, 'connectEnd': 3, 'sendStart': 3,
+          'sendEnd': 4}})})
+      messages.append({'method': 'Network.dataReceived', 'params': dict(base, dataLength=1000,
+                                                                         encodedDataLength=500)})
+      messages.append({'method': 'Network.loadingFinished', 'params': dict(base, timestamp=now + 0.01)})
+      messages.append({'method': 'Timeline.eventRecorded', 'params': {'record': {
+        'type': 'Program', 'startTime': now * 1000, 'endTime': now * 1000 + 5, 'usedHeapSize': 1000000 + i,
+        'totalHeapSize': 2000000, 'children': [{'type': 'Paint', 'startTime': now * 1000, 'endTime': now * 1000 + 2,
+                                                'usedHeapSize': 1000000 + i, 'totalHeapSize': 2000000}]}}})
+    messages.append({'method': 'Page.loadEventFired', 'params': {'timestamp': now}})
+    return messages
+
+  if method == 'Runtime.evaluate':
+    expression = cmd['params']['expression']
+    if expression == 'window.performance':
+      value = {'timing': {'navigationStart': now * 1000, 'domContentLoadedEventEnd': now * 1000 + 50,
+                          'loadEventEnd': now * 1000 + 100}}
+    elif expression.startswith('(function(timingFields)'):
+      # the page probe run after every page load
+      value = {'title': 'Fake Page', 'elements': 42,
+               'timing': {'navigationStart': now * 1000, 'domContentLoadedEventEnd': now * 1000 + 50,
+                          'loadEventEnd': now * 1000 + 100},
+               'resources': [['http://fake/resource0', 'script', 10.0, 5.0]]}
+    elif expression.startswith('var mobsterActionErrors'):
+      # fused flow actions, which all succeed
+      value = []
+    elif expression == 'navigator.userAgent':
+      value = 'Mozilla/5.0 (Linux; Android 4.1.1) Chrome/25.0.1364.123 Mobile Safari/537.22'
+    else:
+      value = 'Fake Page'
+    return [{'id': cmd['id'], 'result': {'result': {'type': 'object', 'value': value}}}]
+
+  if method == 'Memory.getDOMNodeCount':
+    return [{'id': cmd['id'], 'result': {'domGroups': [{'size': 42}], 'strings': []}}]
+
+  if method == 'CSS.stopSelectorProfiler':
+    return [{'id': cmd['id'], 'result': {'profile': {'totalTime': 1.5, 'data': [
+      {'selector': '.a', 'url': 'http://x/a.css', 'lineNumber': 1, 'time': 1.0, 'hitCount': 10, 'matchCount': 5},
+      {'selector': '#b', 'url': 'http://x/a.css', 'lineNumber': 2, 'time': 0.5, 'hitCount': 0, 'matchCount': 0}]}}}]
+
+  return [{'id': cmd['id'], 'result': {}}]
+
+
+def make_heap_snapshot_responder(snapshot, chunk_size=64 * 1024, responder=page_load_responder):
+  """
+  Returns a responder which answers heap profiling commands with the given serialized heap snapshot, sent in chunks of
+  chunk_size characters, and hands every other command to the given responder. snapshot can also be a function, which
+  is called for a new snapshot every time one is requested.
+  """
+  def heap_snapshot_responder(cmd):
+    method = cmd['method']
+    if method == 'Profiler.takeHeapSnapshot':
+      return [{'method': 'Profiler.reportHeapSnapshotProgress', 'params': {'done': done, 'total': 10}}
+              for done in range(0, 11, 5)] + [{'id': cmd['id'], 'result': {}}]
+
+    if method == 'Profiler.getProfileHeaders':
+      return [{'id': cmd['id'], 'result': {'headers': [{'typeId': 'HEAP', 'uid': 1, 'title': 'Snapshot 1'}]}}]
+
+    if method == 'Profiler.getProfile':
+      data = snapshot() if callable(snapshot) else snapshot
+      messages = [{'method': 'Profiler.addHeapSnapshotChunk', 'params': {'uid': 1, 'chunk': data[i:i + chunk_size]}}
+                  for i in xrange(0, len(data), chunk_size)]
+      messages.append({'method': 'Profiler.finishHeapSnapshot', 'params': {'uid': 1}})
+      messages.append({'id': cmd['id'], 'result': {}})
+      return messages
+
+    return responder(cmd)
+  return heap_snapshot_responder
+
+
+class FakeDevToolsHandler(SocketServer.StreamRequestHandler):
+  disable_nagle_algorithm = True
+
+  def handle(self):
+    request_line = self.rfile.readline().strip()
+    headers = {}
+    while True:
+      line = self.rfile.readline().strip()
+      if not line:
+        break
+      key, value = line.split(':', 1)
+      headers[key.strip().lower()] = value.strip()
+
+    path = request_line.split(' ')[1]
+    if headers.get('upgrade', '').lower() == 'websocket':
+      self.handle_websocket(headers)
+    elif path.startswith('/json'):
+      self.handle_page_list()
+
+  def handle_page_list(self):
+    host, port = self.server.server_address
+    pages = [{'title': 'Fake Page {0}'.format(i),
+              'url': 'about:blank',
+              'webSocketDebuggerUrl': 'ws://{0}:{1}/devtools/page/{2}'.format(host, port, i)}
+             for i in range(self.server.num_pages)]
+    body = json.dumps(pages)
+    self.wfile.write('HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {0}\r\n'
+                     'Connection: close\r\n\r\n{1}'.format(len(body), body))
+
+  def handle_websocket(self, headers):
+    accept = base64.b64encode(hashlib.sha1(headers['sec-websocket-key'] + WS_MAGIC).digest())
+    self.wfile.write('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     'Sec-WebSocket-Accept: {0}\r\n\r\n'.format(accept))
+    self.wfile.flush()
+
+    while True:
+      opcode, payload = read_frame(self.rfile)
+      if opcode is None or opcode == 0x8:
+        if opcode == 0x8:
+          self.wfile.write(make_frame('', 0x8))
+        break
+      if opcode != 0x1:
+        continue
+
+      for message in self.server.responder(json.loads(payload)):
+        self.wfile.write(make_frame(json.dumps(message)))
+      self.wfile.flush()
+
+
+class FakeDevToolsServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, port=0, num_pages=1, responder=default_responder):
+    SocketServer.TCPServer.__init__(self, ('localhost', port), FakeDevToolsHandler)
+    self.num_pages = num_pages
+    self.responder = responder
+
+  @property
+  def port(self):
+    return self.server_address[1]
+
+  def start(self):
+    thread = threading.Thread(target=self.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return self
@@ -0,0 +1,135 @@
+"""
+Checks of the compilation of flows into steps (har/flowplan.py), including running a fused script in a JS engine
+(node, if it is installed) against a minimal stand-in for the page's document.
+
+Usage: python test/test_flowplan.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.har.flowplan import NavigateStep, ScriptStep, compile_flow, compile_steps
+from linkedin.mobster.utils import cmd_exists
+
+# evaluates the script given on stdin in the global scope of a page with a text field 'q', a button 'go' and a form
+# 'login', and prints the result along with the state of the page
+NODE_PAGE_JS = '''
+var elements = {
+  q: {value: ''},
+  go: {clicks: 0, click: function() { this.clicks++ }},
+  login: {submits: 0, submit: function() { this.submits++ }}
+};
+globalThis.document = {getElementById: function(id) { return elements[id] }};
+var script = require('fs').readFileSync(0, 'utf8');
+var result = (0, eval)(script);
+console.log(JSON.stringify({result: result, q: elements.q.value, clicks: elements.go.clicks,
+                            submits: elements.login.submits, globalVar: typeof x === 'undefined' ? null : x}));
+'''
+
+
+def action(action_type, **params):
+  return {'type': action_type, 'params': params}
+
+
+def step_types(steps):
+  return [(step.__class__.__name__, len(step.actions) if isinstance(step, ScriptStep) else 1) for step in steps]
+
+
+class FakeClient(object):
+  def __init__(self, result):
+    self.result = result
+    self.scripts = []
+
+  def run_js(self, script):
+    self.scripts.append(script)
+    return self.result
+
+
+class CompileStepsTest(unittest.TestCase):
+
+  def compile(self, actions):
+    return compile_steps(actions, ['action {0}'.format(i + 1) for i in range(len(actions))])
+
+  def test_consecutive_actions_are_fused(self):
+    steps = self.compile([action('textfield-set', id='q', value='a'), action('dispatch-event', id='q',
+                                                                            **{'event-type': 'change'}),
+                          action('raw-js', lines=['1'])])
+    self.assertEqual(step_types(steps), [('ScriptStep', 3)])
+
+  def test_steps_end_at_navigations(self):
+    steps = self.compile([action('textfield-set', id='q', value='a'), action('navigate', url='http://a'),
+                          action('click', id='go')])
+    self.assertEqual(step_types(steps), [('ScriptStep', 1), ('NavigateStep', 1), ('ScriptStep', 1)])
+    self.assertTrue(isinstance(steps[1], NavigateStep))
+
+  def test_steps_end_after_actions_which_leave_the_page(self):
+    steps = self.compile([action('textfield-set', id='q', value='a'), action('form-submit', id='login'),
+                          action('textfield-set', id='q', value='b'), action('link-click', id='next'),
+                          action('click', id='go'), action('raw-js', lines=['1'])])
+    self.assertEqual(step_types(steps), [('ScriptStep', 2), ('ScriptStep', 2), ('ScriptStep', 1),
+                                         ('ScriptStep', 1)])
+
+  def test_page_load_step_is_separate(self):
+    plan = compile_flow({'navigations': [[action('textfield-set', id='q', value='a'), action('click', id='go'),
+                                          dict(action('form-submit', id='login'), **{'page-name': 'Login'})]]})[0]
+    self.assertEqual(step_types(plan.setup_steps), [('ScriptStep', 2)])
+    self.assertEqual(step_types([plan.page_load_step]), [('ScriptStep', 1)])
+
+
+class ScriptStepTest(unittest.TestCase):
+
+  def make_step(self):
+    return ScriptStep([action('textfield-set', id='q', value='a'), action('raw-js', lines=['throw new Error("x")']),
+                       action('click', id='go')], ['first', 'second', 'third'])
+
+  def test_errors_are_mapped_to_their_actions(self):
+    step = self.make_step()
+    self.assertEqual(step.run(FakeClient([[1, 'Error: x']])), [('second', 'Error: x')])
+    self.assertEqual(step.run(FakeClient([])), [])
+
+  def test_every_action_fails_if_the_script_does_not_run(self):
+    self.assertEqual(self.make_step().run(FakeClient(None)),
+                     [('first', 'not run'), ('second', 'not run'), ('third', 'not run')])
+
+  def test_fused_script_does_not_evaluate_strings(self):
+    # pages whose Content Security Policy does not allow 'unsafe-eval' would refuse to run it
+    script = self.make_step().script
+    self.assertNotIn('eval', script)
+    self.assertNotIn('Function(', script)
+    self.assertIn('throw new Error("x")', script)
+
+  def test_fused_script_runs_in_js_engine(self):
+    if not cmd_exists('node'):
+      self.skipTest('node is not installed')
+
+    step = ScriptStep([action('textfield-set', id='q', value='it\'s "quoted"'),
+                       action('raw-js', lines=['var x = 42']),
+                       action('raw-js', lines=['throw new Error("boom")']),
+                       action('click', id='go'),
+                       action('click', id='missing'),
+                       action('form-submit', id='login')],
+                      ['set', 'declare', 'throw', 'click', 'click missing', 'submit'])
+    node = subprocess.Popen(['node', '-e', NODE_PAGE_JS], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output, _ = node.communicate(step.script)
+    self.assertEqual(node.returncode, 0)
+    page = json.loads(output)
+
+    # an action which throws does not stop the ones after it, and vars are declared in the global scope, as if each
+    # action had been run on its own
+    self.assertEqual([index for index, message in page['result']], [2, 4])
+    self.assertIn('boom', page['result'][0][1])
+    self.assertEqual(page['q'], 'it\'s "quoted"')
+    self.assertEqual((page['clicks'], page['submits'], page['globalVar']), (1, 1, 42))
+
+    failures = step.run(FakeClient(page['result']))
+    self.assertEqual([description for description, message in failures], ['throw', 'click missing'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,128 @@
+"""
+Checks of the merging of the HARs of several runs of a page (har/merge.py), on small hand-built HARs.
+
+Usage: python test/test_merge.py
+"""
+
+import os
+import sys
+import unittest
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.har.merge import merge_by_percentile, normalize_url, reject_outliers
+from linkedin.mobster.utils import format_time, parse_time
+
+RUN_START = 1400000000.0
+
+
+def make_entry(method, url, start_offset, time):
+  """An entry of a request made start_offset ms after the start of the run, which took time ms"""
+  return {
+    'startedDateTime': format_time(RUN_START + start_offset / 1000.0),
+    'time': time,
+    'request': {'method': method, 'url': url},
+    'response': {'status': 200},
+    'timings': {'blocked': 0, 'dns': -1, 'connect': -1, 'send': 1, 'wait': time - 1, 'receive': 0}
+  }
+
+
+def make_har(onload, entries):
+  return {'log': {
+    'version': '1.2',
+    'creator': {'name': 'Mobster', 'version': '1.0'},
+    'browser': {'name': 'Chrome', 'version': '25'},
+    '_os': {'_name': 'Android', '_version': '4.1'},
+    'pages': [{'id': 'page_1', 'title': 'Page', 'pageTimings': {'onContentLoad': onload / 2, 'onLoad': onload}}],
+    'entries': entries
+  }}
+
+
+def entries_by_request(har):
+  return dict(((entry['request']['method'], entry['request']['url']), entry) for entry in har['log']['entries'])
+
+
+class RejectOutliersTest(unittest.TestCase):
+
+  def test_outliers_are_rejected(self):
+    kept, rejected = reject_outliers([100, 104, 98, 101, 400, 99], lambda value: value)
+    self.assertEqual(kept, [100, 104, 98, 101, 99])
+    self.assertEqual(rejected, [4])
+
+  def test_nothing_is_rejected_from_less_than_3_items(self):
+    self.assertEqual(reject_outliers([100, 400], lambda value: value), ([100, 400], []))
+
+  def test_nothing_is_rejected_when_most_values_are_equal(self):
+    self.assertEqual(reject_outliers([100, 100, 100, 400], lambda value: value), ([100, 100, 100, 400], []))
+
+
+class NormalizeUrlTest(unittest.TestCase):
+
+  def test_scheme_and_host_are_lower_cased(self):
+    self.assertEqual(normalize_url('HTTP://Example.COM/Path?Q=1'), 'http://example.com/Path?Q=1')
+
+  def test_default_ports_are_removed(self):
+    self.assertEqual(normalize_url('http://example.com:80/a'), 'http://example.com/a')
+    self.assertEqual(normalize_url('https://example.com:443/a'), 'https://example.com/a')
+    self.assertEqual(normalize_url('http://example.com:8080/a'), 'http://example.com:8080/a')
+    self.assertEqual(normalize_url('https://example.com:80/a'), 'https://example.com:80/a')
+
+  def test_fragment_is_removed(self):
+    self.assertEqual(normalize_url('http://example.com/a?b=1#top'), 'http://example.com/a?b=1')
+
+
+class MergeByPercentileTest(unittest.TestCase):
+
+  def test_outlier_runs_are_left_out(self):
+    hars = [make_har(onload, [make_entry('GET', 'http://example.com/', 0, onload)])
+            for onload in [1000, 1010, 990, 5000, 1005]]
+    merged = merge_by_percentile(hars)
+    self.assertEqual((merged['log']['_mergedRuns'], merged['log']['_rejectedRuns']), (4, [3]))
+    self.assertEqual(merged['log']['entries'][0]['_runs'], 4)
+    self.assertEqual(merged['log']['pages'][0]['pageTimings']['_distributions']['onLoad']['max'], 1010)
+
+  def test_entries_have_the_medians_of_the_runs(self):
+    hars = [make_har(1000 + i, [make_entry('GET', 'http://example.com/', 0, 50),
+                                make_entry('GET', 'http://example.com/app.js', offset, time)])
+            for i, (offset, time) in enumerate([(10, 30), (30, 10), (20, 20)])]
+    merged = merge_by_percentile(hars)
+
+    entry = entries_by_request(merged)[('GET', 'http://example.com/app.js')]
+    self.assertEqual((entry['time'], entry['_runs']), (20, 3))
+    self.assertEqual(entry['timings']['wait'], 19)
+    self.assertEqual(entry['timings']['dns'], -1)
+    self.assertAlmostEqual(parse_time(entry['startedDateTime']), RUN_START + 0.02, places=3)
+    distribution = entry['_distributions']['time']
+    self.assertEqual((distribution['min'], distribution['p50'], distribution['max']), (10, 20, 30))
+
+  def test_entries_are_matched_by_normalized_url(self):
+    hars = [make_har(1000, [make_entry('GET', 'http://example.com/a.css', 0, 10)]),
+            make_har(1001, [make_entry('GET', 'HTTP://EXAMPLE.com:80/a.css#x', 0, 20)]),
+            make_har(1002, [make_entry('GET', 'http://example.com/a.css', 0, 30)])]
+    entries = merge_by_percentile(hars)['log']['entries']
+    self.assertEqual([(entry['_runs'], entry['time']) for entry in entries], [(3, 20)])
+
+  def test_entries_are_matched_by_method(self):
+    # a POST to a URL in one run must not be matched with a GET of it in another
+    hars = [make_har(1000, [make_entry('GET', 'http://example.com/api', 0, 10),
+                            make_entry('POST', 'http://example.com/api', 5, 100)]),
+            make_har(1001, [make_entry('POST', 'http://example.com/api', 0, 200),
+                            make_entry('GET', 'http://example.com/api', 5, 20)]),
+            make_har(1002, [make_entry('GET', 'http://example.com/api', 0, 30)])]
+    entries = entries_by_request(merge_by_percentile(hars))
+    self.assertEqual((entries[('GET', 'http://example.com/api')]['_runs'],
+                      entries[('GET', 'http://example.com/api')]['time']), (3, 20))
+    self.assertEqual((entries[('POST', 'http://example.com/api')]['_runs'],
+                      entries[('POST', 'http://example.com/api')]['time']), (2, 150))
+
+  def test_repeated_requests_are_matched_in_order(self):
+    hars = [make_har(1000 + i, [make_entry('GET', 'http://example.com/poll', 0, first),
+                                make_entry('GET', 'http://example.com/poll', 100, second)])
+            for i, (first, second) in enumerate([(10, 100), (20, 200), (30, 300)])]
+    entries = merge_by_percentile(hars)['log']['entries']
+    self.assertEqual([(entry['_runs'], entry['time']) for entry in entries], [(3, 20), (3, 200)])
+
+
+if __name__ == '__main__':
+  unittest.main()
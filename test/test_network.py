@@ -0,0 +1,55 @@
+"""
+Checks of the HAR entries NetworkEventHandler makes from network events.
+
+Usage: python test/test_network.py
+"""
+
+import os
+import sys
+import unittest
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.har.network import NetworkEventHandler
+
+
+def request_events(request_id, url, start):
+  base = {'requestId': request_id, 'frameId': '1', 'timestamp': start}
+  return [
+    {'method': 'Network.requestWillBeSent', 'params': dict(base, request={'method': 'GET', 'url': url,
+                                                                          'headers': {}})},
+    {'method': 'Network.responseReceived', 'params': dict(base, response={'status': 200, 'statusText': 'OK',
+                                                                          'headers': {}})},
+    {'method': 'Network.dataReceived', 'params': dict(base, timestamp=start + 0.1, dataLength=100,
+                                                      encodedDataLength=50)},
+    {'method': 'Network.loadingFinished', 'params': dict(base, timestamp=start + 0.2)}
+  ]
+
+
+class NetworkEventHandlerTest(unittest.TestCase):
+
+  def test_requests_are_recorded(self):
+    handler = NetworkEventHandler()
+    for event in request_events('1', 'http://example.com/', 1000.0):
+      handler.process_event(event)
+
+    entries = handler.make_entry_list()
+    self.assertEqual([entry['request']['url'] for entry in entries], ['http://example.com/'])
+    self.assertEqual(entries[0]['response']['bodySize'], 100)
+    self.assertEqual(handler.get_first_request_time(), 1000.0)
+
+  def test_events_of_requests_sent_before_recording_are_ignored(self):
+    handler = NetworkEventHandler()
+    # the request was sent before the handler was listening, so only its later events arrive
+    for event in request_events('0', 'http://example.com/early', 999.0)[1:]:
+      handler.process_event(event)
+    for event in request_events('1', 'http://example.com/', 1000.0):
+      handler.process_event(event)
+
+    self.assertEqual([entry['request']['url'] for entry in handler.make_entry_list()], ['http://example.com/'])
+    self.assertEqual(handler.get_first_request_time(), 1000.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
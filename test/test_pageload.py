@@ -0,0 +1,65 @@
+"""
+Checks of when PageLoadNotifier decides that a page is loaded, with events delivered from another thread as the
+communicator does.
+
+Usage: python test/test_pageload.py
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.har.page import PageLoadNotifier
+
+
+def network_event(method, request_id):
+  return {'method': method, 'params': {'requestId': request_id}, '_arrivalTime': time.time()}
+
+
+def send_later(delay, handler, message):
+  timer = threading.Timer(delay, handler, [message])
+  timer.start()
+  return timer
+
+
+class PageLoadNotifierTest(unittest.TestCase):
+
+  def time_wait(self, notifier, timeout):
+    start = time.time()
+    notifier.wait_until_loaded(timeout)
+    return time.time() - start
+
+  def test_request_which_never_finishes(self):
+    # the only request (e.g. a long poll) never finishes, so the page is loaded network_event_timeout after it is sent
+    notifier = PageLoadNotifier(False, network_event_timeout=0.5, grace_period=0.1)
+    send_later(0.1, notifier.process_network_event, network_event('Network.requestWillBeSent', '1'))
+    self.assertLess(self.time_wait(notifier, 5), 1)
+    self.assertEqual(notifier.in_flight_requests, 1)
+
+  def test_requests_which_finish(self):
+    notifier = PageLoadNotifier(False, network_event_timeout=3, grace_period=0.1)
+    send_later(0.1, notifier.process_network_event, network_event('Network.requestWillBeSent', '1'))
+    send_later(0.2, notifier.process_network_event, network_event('Network.loadingFinished', '1'))
+    self.assertLess(self.time_wait(notifier, 5), 1)
+
+  def test_waits_for_load_event(self):
+    notifier = PageLoadNotifier(True, network_event_timeout=0.2, grace_period=0.1)
+    notifier.process_network_event(network_event('Network.requestWillBeSent', '1'))
+    notifier.process_network_event(network_event('Network.loadingFinished', '1'))
+    send_later(0.5, notifier.process_page_event, {'method': 'Page.loadEventFired'})
+    elapsed = self.time_wait(notifier, 5)
+    self.assertGreaterEqual(elapsed, 0.5)
+    self.assertLess(elapsed, 1)
+
+  def test_timeout(self):
+    notifier = PageLoadNotifier(True, network_event_timeout=0.2, grace_period=0.1)
+    self.assertRaises(Exception, notifier.wait_until_loaded, 0.3)
+
+
+if __name__ == '__main__':
+  unittest.main()
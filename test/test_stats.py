@@ -0,0 +1,136 @@
+"""
+Checks of utils.StatsAccumulator against statistics computed exactly from all the values, for streams short enough
+for its quantile sketch to hold every value and for streams long enough to be compressed.
+
+Usage: python test/test_stats.py
+"""
+
+import os
+import random
+import sys
+import unittest
+
+# Add src directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')))
+
+from linkedin.mobster.utils import StatsAccumulator
+
+QUANTILES = [0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1]
+
+# the sketch is compressed once it holds 2 * max_centroids values
+MAX_CENTROIDS = 64
+COMPRESSION_THRESHOLD = 2 * MAX_CENTROIDS
+
+
+def exact_mean(values):
+  return float(sum(values)) / len(values)
+
+
+def exact_variance(values):
+  mean = exact_mean(values)
+  return sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+
+
+def exact_quantile(values, q):
+  """The q-quantile of the values, interpolating between the closest values like numpy.percentile does"""
+  values = sorted(values)
+  rank = q * (len(values) - 1)
+  low = int(rank)
+  if low == len(values) - 1:
+    return values[low]
+  return values[low] + (values[low + 1] - values[low]) * (rank - low)
+
+
+def accumulate(values):
+  stats = StatsAccumulator(MAX_CENTROIDS)
+  for value in values:
+    stats.add(value)
+  return stats
+
+
+def make_values(count, seed=0):
+  """Skewed values, like page load times"""
+  rand = random.Random(seed)
+  return [100 + rand.expovariate(1 / 50.0) for i in range(count)]
+
+
+class StatsAccumulatorTest(unittest.TestCase):
+
+  def assertMomentsEqual(self, stats, values):
+    self.assertEqual(stats.count, len(values))
+    self.assertAlmostEqual(stats.mean, exact_mean(values), places=9)
+    self.assertAlmostEqual(stats.variance, exact_variance(values), places=6)
+    self.assertEqual((stats.min, stats.max), (min(values), max(values)))
+
+  def assertQuantilesClose(self, stats, values, max_rank_error):
+    """Checks that every quantile is between the exact quantiles max_rank_error (a fraction of the count) around it"""
+    for q in QUANTILES:
+      low = exact_quantile(values, max(q - max_rank_error, 0))
+      high = exact_quantile(values, min(q + max_rank_error, 1))
+      self.assertTrue(low <= stats.quantile(q) <= high,
+                      'quantile {0}: {1} not within [{2}, {3}]'.format(q, stats.quantile(q), low, high))
+
+  def test_empty(self):
+    stats = StatsAccumulator()
+    self.assertEqual(stats.count, 0)
+    self.assertEqual(stats.variance, 0.0)
+    self.assertEqual(stats.quantile(0.5), None)
+    self.assertEqual(stats.ci_half_width(), float('inf'))
+
+  def test_single_value(self):
+    stats = accumulate([7])
+    self.assertEqual((stats.mean, stats.variance, stats.quantile(0.1), stats.quantile(0.9)), (7, 0.0, 7, 7))
+
+  def test_docstring_example(self):
+    stats = accumulate([1, 2, 3, 4])
+    self.assertEqual((stats.mean, stats.quantile(0.5)), (2.5, 2.5))
+
+  def test_moments_below_compression_threshold(self):
+    values = make_values(COMPRESSION_THRESHOLD - 1)
+    self.assertMomentsEqual(accumulate(values), values)
+
+  def test_moments_above_compression_threshold(self):
+    values = make_values(20 * COMPRESSION_THRESHOLD)
+    self.assertMomentsEqual(accumulate(values), values)
+
+  def test_quantiles_are_exact_below_compression_threshold(self):
+    values = make_values(COMPRESSION_THRESHOLD - 1)
+    stats = accumulate(values)
+    for q in QUANTILES:
+      self.assertAlmostEqual(stats.quantile(q), exact_quantile(values, q), places=9)
+
+  def test_quantiles_are_close_above_compression_threshold(self):
+    for count in [COMPRESSION_THRESHOLD, 3 * COMPRESSION_THRESHOLD, 100 * COMPRESSION_THRESHOLD]:
+      values = make_values(count, seed=count)
+      stats = accumulate(values)
+      self.assertEqual((stats.quantile(0), stats.quantile(1)), (min(values), max(values)))
+      # every centroid stands for about 1 / max_centroids of the values
+      self.assertQuantilesClose(stats, values, 1.0 / MAX_CENTROIDS)
+
+  def test_merge_below_compression_threshold(self):
+    first, second = make_values(40, seed=1), make_values(50, seed=2)
+    stats = accumulate(first).merge(accumulate(second))
+    self.assertMomentsEqual(stats, first + second)
+    for q in QUANTILES:
+      self.assertAlmostEqual(stats.quantile(q), exact_quantile(first + second, q), places=9)
+
+  def test_merge_above_compression_threshold(self):
+    # streams of different distributions, so a merge which mixed them up would show in the quantiles
+    first = make_values(10 * COMPRESSION_THRESHOLD, seed=1)
+    second = [value * 3 for value in make_values(5 * COMPRESSION_THRESHOLD, seed=2)]
+    stats = accumulate(first).merge(accumulate(second))
+    self.assertMomentsEqual(stats, first + second)
+    self.assertQuantilesClose(stats, first + second, 2.0 / MAX_CENTROIDS)
+
+  def test_merge_with_empty(self):
+    values = make_values(10)
+    self.assertMomentsEqual(accumulate(values).merge(StatsAccumulator()), values)
+    self.assertMomentsEqual(StatsAccumulator(MAX_CENTROIDS).merge(accumulate(values)), values)
+
+  def test_merge_returns_self(self):
+    stats = StatsAccumulator()
+    self.assertTrue(stats.merge(accumulate([1, 2])) is stats)
+
+
+if __name__ == '__main__':
+  unittest.main()